@@ -0,0 +1,91 @@
+"""Slowdown of a tight loop run under the debugger, with breakpoints set.
+
+Each scenario runs loop() through Pdb.runcall, continuing from the first
+stop to the end, and is compared with a plain call.  'before' is the stock
+pdb.Pdb, whose bdb machinery evaluates condition strings on every hit and
+traces every function of a file with breakpoints.  Run from the top of the
+source tree:
+
+    python benchmarks/bench_breakpoints.py [iterations]
+"""
+
+import os
+import pdb
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from tbtools import Debugger
+
+
+def helper(i):
+    return i * 2
+
+
+def unrelated():
+    return 0                    # breakpoint of the second scenario
+
+
+def loop(n):
+    total = 0
+    for i in xrange(n):
+        total += helper(i)      # conditional breakpoint of the first one
+    return total
+
+
+def _line(function, offset):
+    return function.func_code.co_firstlineno + offset
+
+
+def _continuing(base):
+    class Continuing(base):
+        def interaction(self, frame, traceback):
+            self.set_continue()
+    return Continuing
+
+
+def _debugger(base):
+    if base is pdb.Pdb:
+        debugger = _continuing(pdb.Pdb)(stdout=open(os.devnull, 'w'))
+    else:
+        debugger = _continuing(base)(color_scheme='NoColor')
+    debugger.rcLines = []
+    return debugger
+
+
+def timed(debugger, n, breakpoint, cond=None):
+    filename = loop.func_code.co_filename
+    if debugger is None:
+        start = time.time()
+        loop(n)
+        return time.time() - start
+    debugger.set_break(filename, breakpoint, cond=cond)
+    try:
+        start = time.time()
+        debugger.runcall(loop, n)
+        return time.time() - start
+    finally:
+        sys.settrace(None)
+        debugger.clear_all_breaks()
+
+
+def main():
+    n = int((sys.argv[1:] or [200000])[0])
+    scenarios = [
+        ('false conditional bp inside loop', _line(loop, 3), 'i < 0'),
+        ('bp in an unrelated function, same file', _line(unrelated, 1),
+         None),
+    ]
+    plain = min([timed(None, n, None) for i in range(3)])
+    print 'runcall() slowdown over a plain call, %d iterations' % n
+    print '%-40s %8s %8s' % ('', 'before', 'after')
+    for name, line, cond in scenarios:
+        before = timed(_debugger(pdb.Pdb), n, line, cond) / plain
+        after = timed(_debugger(Debugger.Pdb), n, line, cond) / plain
+        print '%-40s %7.0fx %7.0fx' % (name, before, after)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Count the write() calls tracebacks and colorized source make.
+
+Each write() on an unbuffered stream (stderr, many pipes and sockets) is a
+system call.  Run from the top of the source tree:
+
+    python benchmarks/bench_writes.py
+
+'before' is what the code did without tbtools.output: print >>out, text for
+tracebacks, and PyColorize writing every token straight to the stream.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from tbtools import PyColorize, output, ultraTB
+
+
+class CountingStream(object):
+    """A stream counting its write calls, and the characters written."""
+
+    def __init__(self):
+        self.writes = 0
+        self.chars = 0
+        self.softspace = 0
+
+    def write(self, s):
+        self.writes += 1
+        self.chars += len(s)
+
+    def flush(self):
+        pass
+
+
+def _recurse(n):
+    if n == 0:
+        raise ValueError('bottom')
+    _recurse(n - 1)
+
+
+def traceback_writes(mode):
+    formatter = ultraTB.AutoFormattedTB(mode=mode, color_scheme='Linux')
+    formatter.set_colors('Linux')
+    try:
+        _recurse(20)
+    except ValueError:
+        text = formatter.text(*sys.exc_info())
+    before = CountingStream()
+    print >>before, text
+    after = CountingStream()
+    ultraTB._print_tb(after, text)
+    return before.writes, after.writes
+
+
+def colorize_writes(filename):
+    source = open(filename).read()
+    before = CountingStream()
+    buffered = PyColorize.output.BufferedWriter
+    PyColorize.output.BufferedWriter = lambda out: out
+    try:
+        PyColorize.Parser().format(source, before, 'Linux')
+    finally:
+        PyColorize.output.BufferedWriter = buffered
+    after = CountingStream()
+    PyColorize.Parser().format(source, after, 'Linux')
+    assert before.chars == after.chars
+    return before.writes, after.writes
+
+
+def main():
+    rows = [('Plain traceback, 21 frames', traceback_writes('Plain')),
+            ('Verbose traceback, 21 frames', traceback_writes('Verbose')),
+            ('colorizing ultraTB.py',
+             colorize_writes(ultraTB.__file__.replace('.pyc', '.py')))]
+    print '%-32s %8s %8s' % ('write calls', 'before', 'after')
+    for name, (before, after) in rows:
+        print '%-32s %8d %8d' % (name, before, after)
+
+
+if __name__ == '__main__':
+    main()
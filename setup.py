@@ -20,6 +20,8 @@ setup(name="tbtools",
       ],
 
       packages=["tbtools"],
-      entry_points={'console_scripts':['ipdb = tbtools.Debugger:main']},
+      entry_points={'console_scripts':['ipdb = tbtools.Debugger:main',
+                                       'tbcrash = tbtools.crashstore:main',
+                                       'tblogscan = tbtools.logscan:main']},
       zip_safe=True
 )
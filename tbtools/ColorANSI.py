@@ -10,19 +10,90 @@ $Id: ColorANSI.py 1005 2006-01-12 08:39:26Z fperez $"""
 #  the file COPYING, distributed as part of this software.
 #*****************************************************************************
 __license__ = "BSD"
-__all__ = ['TermColors', 'InputTermColors', 'ColorScheme', 'ColorSchemeTable']
+__all__ = ['TermColors', 'InputTermColors', 'Color256', 'TrueColor',
+           'ColorScheme', 'ColorSchemeTable', 'color_depth',
+           'reset_color_depth', 'NO_COLORS', 'COLORS_16', 'COLORS_256',
+           'TRUECOLOR']
 
 import os
+import sys
+import weakref
 
 
 class Struct(dict):
+    """A dict whose string keys can also be read as attributes.
+
+    Color lookups like Colors.filenameEm sit in the formatting loops, so the
+    string keys are mirrored into the instance __dict__: reading them is a
+    plain attribute lookup, and __getattr__ is only reached for missing
+    names.  Every way of changing the dict keeps the mirror up to date.
+
+    Keys naming an attribute of Struct itself (update, copy, keys...) are
+    not mirrored, so they can't shadow the dict methods: they are only
+    reachable as items, and setting them as attributes is an error."""
+
+    def __init__(self, *args, **kw):
+        dict.__init__(self)
+        self.update(*args, **kw)
 
     def __getattr__(self, attr):
-        return self[attr]
+        try:
+            return self[attr]
+        except KeyError:
+            raise AttributeError(attr)
 
     def __setattr__(self, attr, val):
+        if attr in _STRUCT_ATTRIBUTES:
+            raise AttributeError('%r is a Struct method: use item access'
+                                 % attr)
         self[attr] = val
 
+    def __delattr__(self, attr):
+        try:
+            del self[attr]
+        except KeyError:
+            raise AttributeError(attr)
+
+    def __setitem__(self, key, val):
+        dict.__setitem__(self, key, val)
+        if isinstance(key, basestring) and key not in _STRUCT_ATTRIBUTES:
+            self.__dict__[key] = val
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.__dict__.pop(key, None)
+
+    def update(self, *args, **kw):
+        for key, val in dict(*args, **kw).iteritems():
+            self[key] = val
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        self.__dict__.pop(key, None)
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        key, val = dict.popitem(self)
+        self.__dict__.pop(key, None)
+        return key, val
+
+    def clear(self):
+        dict.clear(self)
+        self.__dict__.clear()
+
+    def copy(self):
+        return Struct(self)
+
+    def __reduce__(self):
+        return (Struct, (dict(self),))
+
+# the names a key must not shadow in a Struct's __dict__
+_STRUCT_ATTRIBUTES = frozenset(dir(Struct))
+
 
 def make_color_table(in_class):
     """Build a set of color attributes in a class.
@@ -89,20 +160,206 @@ class InputTermColors:
 # Build the actual color table as a set of class attributes:
 make_color_table(InputTermColors)
 
+#****************************************************************************
+# Colors beyond the basic 16
+
+# color depths, as returned by color_depth()
+NO_COLORS = 0
+COLORS_16 = 16
+COLORS_256 = 256
+TRUECOLOR = 1 << 24
+
+# the usual RGB values of the 16 basic colors, by SGR code
+_BASIC_RGB = (
+    ('0;30', (0, 0, 0)),       ('0;31', (205, 0, 0)),
+    ('0;32', (0, 205, 0)),     ('0;33', (205, 205, 0)),
+    ('0;34', (0, 0, 238)),     ('0;35', (205, 0, 205)),
+    ('0;36', (0, 205, 205)),   ('0;37', (229, 229, 229)),
+    ('1;30', (127, 127, 127)), ('1;31', (255, 0, 0)),
+    ('1;32', (0, 255, 0)),     ('1;33', (255, 255, 0)),
+    ('1;34', (92, 92, 255)),   ('1;35', (255, 0, 255)),
+    ('1;36', (0, 255, 255)),   ('1;37', (255, 255, 255)),
+    )
+
+_CUBE = (0, 95, 135, 175, 215, 255)
+
+def _rgb_of_256(index):
+    """RGB value of an entry of the xterm 256 color palette."""
+    if index < 16:
+        return _BASIC_RGB[index][1]
+    if index < 232:
+        index -= 16
+        return (_CUBE[index // 36], _CUBE[index // 6 % 6], _CUBE[index % 6])
+    level = 8 + 10 * (index - 232)
+    return (level, level, level)
+
+def _distance(a, b):
+    return (a[0]-b[0])**2 + (a[1]-b[1])**2 + (a[2]-b[2])**2
+
+def _nearest_256(rgb):
+    """Index of the entry of the 256 color palette closest to rgb."""
+    cube = [min(range(6), key=lambda i: abs(_CUBE[i] - c)) for c in rgb]
+    best = 16 + 36 * cube[0] + 6 * cube[1] + cube[2]
+    gray = min(23, max(0, (sum(rgb) // 3 - 8 + 5) // 10))
+    if _distance(_rgb_of_256(232 + gray), rgb) < \
+       _distance(_rgb_of_256(best), rgb):
+        best = 232 + gray
+    return best
+
+def _nearest_16(rgb):
+    """SGR code of the basic color closest to rgb."""
+    return min(_BASIC_RGB, key=lambda (code, value): _distance(value, rgb))[0]
+
+class Color256(object):
+    """A color of the xterm 256 color palette, for use in ColorSchemes.
+
+    The escape sequence is computed when a scheme is compiled for the color
+    depth of a terminal; with only 16 colors, the closest one is used."""
+
+    def __init__(self, index):
+        if not 0 <= index < 256:
+            raise ValueError, 'not a 256 color palette index: %r' % (index,)
+        self.index = index
+
+    def rgb(self):
+        return _rgb_of_256(self.index)
+
+    def escape(self, depth, base=TermColors._base):
+        if depth >= COLORS_256:
+            return base % ('38;5;%d' % self.index)
+        if depth >= COLORS_16:
+            return base % _nearest_16(self.rgb())
+        return ''
+
+    def __repr__(self):
+        return 'Color256(%d)' % self.index
+
+class TrueColor(Color256):
+    """A 24 bit color, given as (r, g, b) or as a '#rrggbb' string.
+
+    Terminals without truecolor support get the closest color they have."""
+
+    def __init__(self, r, g=None, b=None):
+        if isinstance(r, basestring):
+            spec = r.lstrip('#')
+            if len(spec) != 6:
+                raise ValueError, 'not a #rrggbb color: %r' % (r,)
+            r, g, b = [int(spec[i:i+2], 16) for i in (0, 2, 4)]
+        self.r, self.g, self.b = r, g, b
+
+    def rgb(self):
+        return (self.r, self.g, self.b)
+
+    def escape(self, depth, base=TermColors._base):
+        if depth >= TRUECOLOR:
+            return base % ('38;2;%d;%d;%d' % self.rgb())
+        if depth >= COLORS_256:
+            return base % ('38;5;%d' % _nearest_256(self.rgb()))
+        if depth >= COLORS_16:
+            return base % _nearest_16(self.rgb())
+        return ''
+
+    def __repr__(self):
+        return 'TrueColor(%d, %d, %d)' % self.rgb()
+
+#****************************************************************************
+# Terminal capabilities
+
+# stream -> depth, for the streams which can be weakly referenced (others
+# are probed every time)
+_depths = weakref.WeakKeyDictionary()
+
+def color_depth(stream=None):
+    """Return how many colors the terminal behind stream (sys.stdout by
+    default) can show: NO_COLORS, COLORS_16, COLORS_256 or TRUECOLOR.
+
+    NO_COLOR in the environment, a stream which isn't a tty and TERM=dumb
+    mean no colors; COLORTERM=truecolor (or 24bit) and TERMs like
+    xterm-256color raise the depth.  The answer is cached per stream, see
+    reset_color_depth()."""
+    if stream is None:
+        stream = sys.stdout
+    try:
+        return _depths[stream]
+    except (KeyError, TypeError):
+        pass
+    environ = os.environ
+    term = environ.get('TERM', '')
+    if environ.get('NO_COLOR'):
+        depth = NO_COLORS
+    elif hasattr(stream, 'isatty') and not stream.isatty():
+        depth = NO_COLORS
+    elif term == 'dumb':
+        depth = NO_COLORS
+    elif environ.get('COLORTERM', '').lower() in ('truecolor', '24bit'):
+        depth = TRUECOLOR
+    elif '256color' in term:
+        depth = COLORS_256
+    else:
+        depth = COLORS_16
+    try:
+        _depths[stream] = depth
+    except TypeError:
+        # no weak references to it
+        pass
+    return depth
+
+def reset_color_depth(stream=None):
+    """Forget the cached color depth of stream, or of all streams."""
+    if stream is None:
+        _depths.clear()
+    else:
+        try:
+            _depths.pop(stream, None)
+        except TypeError:
+            pass
+
 class ColorScheme:
-    """Generic color scheme class. Just a name and a Struct."""
+    """Generic color scheme class. Just a name and a Struct.
+
+    Besides escape strings, the colors can be Color256 or TrueColor
+    instances: colors then holds their escapes for the current color depth
+    (set_depth), computed once per depth."""
     def __init__(self, __scheme_name_, colordict=None, **colormap):
         self.name = __scheme_name_
         if colordict is None:
-            self.colors = Struct(**colormap)
-        else:
-            self.colors = Struct(colordict)
+            colordict = colormap
+        # the Color256/TrueColor specs, and their escapes by depth
+        self.specs = {}
+        self._escapes = {}
+        plain = {}
+        for key, value in colordict.items():
+            if isinstance(value, Color256):
+                self.specs[key] = value
+            else:
+                plain[key] = value
+        self.colors = Struct(plain)
+        self.depth = None
+        self.set_depth(TRUECOLOR)
+
+    def set_depth(self, depth):
+        """Compile the colors for a terminal showing depth colors."""
+        if depth == self.depth or not self.specs:
+            self.depth = depth
+            return
+        try:
+            escapes = self._escapes[depth]
+        except KeyError:
+            escapes = self._escapes[depth] = {}
+            for key, spec in self.specs.items():
+                escapes[key] = spec.escape(depth)
+        self.colors.update(escapes)
+        self.depth = depth
 
     def copy(self, name=None):
         """Return a full copy of the object, optionally renaming it."""
         if name is None:
             name = self.name
-        return ColorScheme(name, self.colors.__dict__)
+        colors = dict(self.colors)
+        colors.update(self.specs)
+        scheme = ColorScheme(name, colors)
+        scheme.set_depth(self.depth)
+        return scheme
 
 class ColorSchemeTable(dict):
     """General class to handle tables of color schemes.
@@ -124,6 +381,9 @@ class ColorSchemeTable(dict):
         # create object attributes to be set later
         self.active_scheme_name = ''
         self.active_colors = None
+        self.color_depth = TRUECOLOR
+        # lowercased name -> name, for case-insensitive lookups
+        self._names = {}
 
         if scheme_list:
             if default_scheme == '':
@@ -134,34 +394,55 @@ class ColorSchemeTable(dict):
 
     def copy(self):
         """Return full copy of object"""
-        return ColorSchemeTable(self.values(), self.active_scheme_name)
+        table = ColorSchemeTable(self.values(), self.active_scheme_name)
+        table.color_depth = self.color_depth
+        return table
 
     def add_scheme(self, new_scheme):
         """Add a new color scheme to the table."""
         if not isinstance(new_scheme, ColorScheme):
             raise ValueError, 'ColorSchemeTable only accepts ColorScheme instances'
+        new_scheme.set_depth(self.color_depth)
         self[new_scheme.name] = new_scheme
 
+    def set_color_depth(self, depth):
+        """Compile all the schemes for a terminal showing depth colors.
+
+        See color_depth() for the values.  The escapes are computed once per
+        scheme and depth, so switching back and forth costs nothing."""
+        self.color_depth = depth
+        for scheme in self.values():
+            scheme.set_depth(depth)
+
+    def __setitem__(self, name, scheme):
+        dict.__setitem__(self, name, scheme)
+        self._names.setdefault(name.lower(), name)
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        if self._names.get(name.lower()) == name:
+            del self._names[name.lower()]
+            for other in self:
+                if other.lower() == name.lower():
+                    self._names[name.lower()] = other
+                    break
+
     def set_active_scheme(self, scheme, case_sensitive=0):
         """Set the currently active scheme.
 
         Names are by default compared in a case-insensitive way, but this can
         be changed by setting the parameter case_sensitive to true."""
 
-        scheme_names = self.keys()
         if case_sensitive:
-            valid_schemes = scheme_names
-            scheme_test = scheme
+            active = None
+            if scheme in self:
+                active = scheme
         else:
-            valid_schemes = [s.lower() for s in scheme_names]
-            scheme_test = scheme.lower()
-        try:
-            scheme_idx = valid_schemes.index(scheme_test)
-        except ValueError:
+            active = self._names.get(scheme.lower())
+        if active is None:
             raise ValueError, 'Unrecognized color scheme: ' + scheme + \
-                  '\nValid schemes: '+str(scheme_names).replace("'', ", '')
+                  '\nValid schemes: '+str(self.keys()).replace("'', ", '')
         else:
-            active = scheme_names[scheme_idx]
             self.active_scheme_name = active
             self.active_colors = self[active].colors
             # Now allow using '' as an index for the current active scheme
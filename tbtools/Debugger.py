@@ -38,12 +38,11 @@ import os
 import bdb
 import pdb
 import cmd
-import linecache
 import readline
 import __builtin__
 
 import tbtools
-from tbtools import PyColorize, ColorANSI
+from tbtools import PyColorize, ColorANSI, saferepr, output, paths, sources
 from tbtools.excolors import ExceptionColors
 
 
@@ -63,6 +62,30 @@ def _file_lines(fname):
         return out
 
 
+# how many code objects break_anywhere() remembers an answer for: the
+# table holds them (and their constants) alive, so it starts over when full
+MAX_CODE_BREAKS = 5000
+
+# the commands which only look at the stop; after any other ('!x = 1', p or
+# pp of an expression with side effects...) the rendered stack entries and
+# reprs are dropped, as the values they show may have changed
+_VIEW_COMMANDS = frozenset(['where', 'w', 'bt', 'up', 'u', 'down', 'd',
+                            'list', 'l', 'help', 'h', 'break', 'b',
+                            'tbreak', 'clear', 'cl', 'enable', 'disable',
+                            'condition', 'ignore'])
+
+
+# Silencing a single frame (deleting its f_trace, or returning None from the
+# call event) relies on CPython's trace trampoline.  Elsewhere the stepping
+# commands keep using the plain bdb machinery.
+try:
+    import platform
+    _can_filter_frames = platform.python_implementation() == 'CPython'
+except (ImportError, AttributeError):
+    # python < 2.6 only ever meant CPython
+    _can_filter_frames = True
+
+
 # Python 2.6 defines Restart
 try:
     from pdb import Restart
@@ -79,7 +102,8 @@ class Pdb(pdb.Pdb):
     # readline and breaks tab-completion.  This means we have to COPY the
     # constructor here, and that requires tracking various python versions.
 
-    def __init__(self, color_scheme='NoColor', stdin=None, stdout=None, use_textmate=True):
+    def __init__(self, color_scheme='NoColor', stdin=None, stdout=None, use_textmate=True,
+                 fast_stepping=True):
         bdb.Bdb.__init__(self)
         # don't load readline
         cmd.Cmd.__init__(self, completekey=None, stdin=stdin, stdout=stdout)
@@ -136,6 +160,24 @@ class Pdb(pdb.Pdb):
         self.use_textmate = use_textmate
         self.textmate = None
 
+        # per-file breakpoint index: canonic filename -> {lineno: bp}, kept
+        # in sync by the set_break/clear_* overrides below
+        self._breaks_index = {}
+        # (code, filename) -> does the code object span any breakpoint?
+        # Bounded by MAX_CODE_BREAKS, emptied when the breakpoints change
+        self._code_breaks = {}
+        # breakpoint condition source -> compiled code object (or None)
+        self._conditions = {}
+
+        # rendered stack entries of the current stop, see format_stack_entry
+        self._stack_entries = {}
+        # __return__/__args__ reprs of the current stop
+        self.repr_cache = saferepr.ReprCache()
+
+        # next/until/return/continue only trace the frames they can stop in
+        self.fast_stepping = fast_stepping and _can_filter_frames
+        self._step_filter = None
+
     def set_colors(self, scheme):
         """Shorthand access to the color table scheme selector method."""
         self.color_scheme_table.set_active_scheme(scheme)
@@ -190,6 +232,11 @@ class Pdb(pdb.Pdb):
     do_d = do_down
 
     def postcmd(self, stop, line):
+        # an empty line repeats the last command
+        command = self.parseline(line or self.lastcmd)[0]
+        if command not in _VIEW_COMMANDS:
+            self._stack_entries.clear()
+            self.repr_cache.clear()
         self.set_completer_frame(self.curframe)
         return stop
 
@@ -228,8 +275,21 @@ class Pdb(pdb.Pdb):
     # TextMate integration
     ##
     def do_where(self, arg):
-        pdb.Pdb.do_where(self, arg)
+        """w(here) [count]
+        Print the stack trace, most recent frame last.  A positive count
+        shows only the count innermost frames, a negative one the count
+        outermost frames."""
+        count = None
+        if arg:
+            try:
+                count = int(arg)
+            except ValueError:
+                print >>sys.stdout, '*** Error in argument:', `arg`
+                return
+        self.print_stack_trace(count)
         self._mate()
+    do_w = do_where
+    do_bt = do_where
     
     def do_next(self, arg):
         pdb.Pdb.do_next(self, arg)
@@ -240,31 +300,83 @@ class Pdb(pdb.Pdb):
         self.set_completer_frame(None)
         readline.set_completer(self.old_completer)
 
-    def print_stack_trace(self):
+    def forget(self):
+        pdb.Pdb.forget(self)
+        self.fncache.clear()
+        self._stack_entries.clear()
+        self.repr_cache.clear()
+
+    def print_stack_trace(self, count=None):
+        """Print the stack up to the current frame.
+
+        A positive count limits the output to the count innermost frames, a
+        negative one to the count outermost frames.  Runs of identical
+        recursive frames (same code and line) are collapsed into a single
+        entry followed by a repeat count."""
+
+        stack = self.stack[:self.curindex+1]
+        if count > 0:
+            stack = stack[-count:]
+        elif count:
+            stack = stack[:-count]
         try:
-            for frame_lineno in self.stack[:self.curindex+1]:
-                self.print_stack_entry(frame_lineno, context=5)
+            out = []
+            last = None
+            repeated = 0
+            for frame_lineno in stack:
+                frame, lineno = frame_lineno
+                key = (frame.f_code, lineno)
+                if key == last:
+                    repeated += 1
+                    continue
+                if repeated:
+                    out.append(self._format_repeated(repeated))
+                    repeated = 0
+                last = key
+                out.append(self.format_stack_entry(frame_lineno, '',
+                                                   context=5) + '\n')
+            if repeated:
+                out.append(self._format_repeated(repeated))
+            output.write_unit(sys.stdout, *out)
         except KeyboardInterrupt:
             pass
 
+    def _format_repeated(self, count):
+        Colors = self.color_scheme_table.active_colors
+        return '%s[... previous frame repeated %d more time%s ...]%s\n\n' % \
+               (Colors.em, count, count > 1 and 's' or '', Colors.Normal)
+
 
     def print_stack_entry(self, frame_lineno, prompt_prefix='\n-> ', context=3):
         frame, lineno = frame_lineno
-        print >>sys.stdout, self.format_stack_entry(frame_lineno, '', context)
+        output.write_unit(sys.stdout,
+                          self.format_stack_entry(frame_lineno, '', context),
+                          '\n')
 
 
     def format_stack_entry(self, frame_lineno, lprefix=': ', context=3):
-        import linecache, repr
+        """Return the rendered stack entry for a (frame, lineno) pair.
+
+        Entries are cached until the debugger leaves the current stop (or
+        the breakpoints or colors change, or a command which may change the
+        values shown runs), so 'where', 'up' and 'down' only format each
+        frame once."""
+        key = (frame_lineno, context,
+               self.color_scheme_table.active_scheme_name)
+        try:
+            return self._stack_entries[key]
+        except KeyError:
+            entry = self._format_stack_entry(frame_lineno, context)
+            self._stack_entries[key] = entry
+            return entry
 
+    def _format_stack_entry(self, frame_lineno, context):
         ret = ""
 
         Colors = self.color_scheme_table.active_colors
         ColorsNormal = Colors.Normal
         tpl_link = '%s%%s%s' % (Colors.filenameEm, ColorsNormal)
         tpl_call = 'in %s%%s%s%%s%s' % (Colors.vName, Colors.valEm, ColorsNormal)
-        tpl_line = '%%s%s%%s %s%%s' % (Colors.lineno, ColorsNormal)
-        tpl_line_em = '%%s%s%%s %s%%s%s' % (Colors.linenoEm, Colors.line,
-                                            ColorsNormal)
 
         frame, lineno = frame_lineno
 
@@ -272,7 +384,7 @@ class Pdb(pdb.Pdb):
         if '__return__' in frame.f_locals:
             rv = frame.f_locals['__return__']
             #return_value += '->'
-            return_value += repr.repr(rv) + '\n'
+            return_value += self.repr_cache.repr(frame, rv) + '\n'
         ret += return_value
 
         #s = filename + '(' + `lineno` + ')'
@@ -287,7 +399,7 @@ class Pdb(pdb.Pdb):
         call = ''
         if func != '?':
             if '__args__' in frame.f_locals:
-                args = repr.repr(frame.f_locals['__args__'])
+                args = self.repr_cache.repr(frame, frame.f_locals['__args__'])
             else:
                 args = '()'
             call = tpl_call % (func, args)
@@ -296,30 +408,47 @@ class Pdb(pdb.Pdb):
         ret += level
 
         start = lineno - 1 - context//2
-        lines = linecache.getlines(filename)
+        lines = sources.getlines(filename, frame.f_globals)
         start = max(start, 0)
         start = min(start, len(lines) - context)
         lines = lines[start : start + context]
 
-        for i in range(len(lines)):
-            line = lines[i]
-            if start + 1 + i == lineno:
-                ret += self.__format_line(tpl_line_em, filename, start + 1 + i, line, arrow = True)
-            else:
-                ret += self.__format_line(tpl_line, filename, start + 1 + i, line, arrow = False)
+        ret += ''.join(self.__format_lines(filename, start + 1, lines, lineno))
 
         return ret
 
 
-    def __format_line(self, tpl_line, filename, lineno, line, arrow = False):
+    def __format_lines(self, filename, first, lines, lineno):
+        """Format a run of source lines, the first one being number 'first'.
+
+        The breakpoint index for the file is looked up once, so the whole
+        listing is rendered in a single pass however many breakpoints the
+        file has.  The line numbered 'lineno' gets the arrow marker."""
+
+        Colors = self.color_scheme_table.active_colors
+        ColorsNormal = Colors.Normal
+        tpl_line = '%%s%s%%s %s%%s' % (Colors.lineno, ColorsNormal)
+        tpl_line_em = '%%s%s%%s %s%%s%s' % (Colors.linenoEm, Colors.line,
+                                            ColorsNormal)
+        breaks = self.get_file_break_index(filename)
+        format_line = self.__format_line
+
+        out = []
+        for i, line in enumerate(lines):
+            i = first + i
+            if i == lineno:
+                out.append(format_line(tpl_line_em, i, line, breaks.get(i),
+                                       arrow = True))
+            else:
+                out.append(format_line(tpl_line, i, line, breaks.get(i),
+                                       arrow = False))
+        return out
+
+
+    def __format_line(self, tpl_line, lineno, line, bp = None, arrow = False):
         bp_mark = ""
         bp_mark_color = ""
 
-        bp = None
-        if lineno in self.get_file_breaks(filename):
-            bps = self.get_breaks(filename, lineno)
-            bp = bps[-1]
-
         if bp:
             Colors = self.color_scheme_table.active_colors
             bp_mark = str(bp.number)
@@ -347,6 +476,283 @@ class Pdb(pdb.Pdb):
 
         return line
 
+    def canonic(self, filename):
+        # break_here() and break_anywhere() call this for every line and
+        # call event: the fncache of bdb stays in front of the shared table
+        # of paths, which calls os.getcwd() for relative names.  It is
+        # bounded, and emptied by forget() at every stop, so that a change
+        # of directory is seen from the next stop on.
+        try:
+            return self.fncache[filename]
+        except KeyError:
+            pass
+        canonic = paths.canonic(filename)
+        if len(self.fncache) >= paths.MAX_CACHED:
+            self.fncache.clear()
+        self.fncache[filename] = canonic
+        return canonic
+
+    ##
+    # Breakpoint index
+    ##
+    def get_file_break_index(self, filename):
+        """Return a {lineno: breakpoint} dict for the breakpoints in filename.
+
+        Where several breakpoints share a line, the most recent one is used,
+        as get_breaks(filename, lineno)[-1] would.  The dict belongs to the
+        debugger and must not be modified."""
+        return self._breaks_index.get(self.canonic(filename), {})
+
+    def _reindex_breaks(self, filename):
+        """Rebuild the breakpoint index entry of a canonic filename."""
+        self._code_breaks.clear()
+        self._stack_entries.clear()
+        index = {}
+        bplist = bdb.Breakpoint.bplist
+        for lineno in self.breaks.get(filename, ()):
+            bps = bplist.get((filename, lineno))
+            if bps:
+                index[lineno] = bps[-1]
+        if index:
+            self._breaks_index[filename] = index
+        else:
+            self._breaks_index.pop(filename, None)
+
+    def set_break(self, filename, lineno, temporary=0, cond=None,
+                  funcname=None):
+        err = pdb.Pdb.set_break(self, filename, lineno, temporary, cond,
+                                funcname)
+        self._reindex_breaks(self.canonic(filename))
+        return err
+
+    def clear_break(self, filename, lineno):
+        err = pdb.Pdb.clear_break(self, filename, lineno)
+        self._reindex_breaks(self.canonic(filename))
+        return err
+
+    def clear_bpbynumber(self, arg):
+        try:
+            bp = bdb.Breakpoint.bpbynumber[int(arg)]
+        except (ValueError, TypeError, IndexError):
+            bp = None
+        err = pdb.Pdb.clear_bpbynumber(self, arg)
+        if bp:
+            self._reindex_breaks(bp.file)
+        return err
+
+    def clear_all_file_breaks(self, filename):
+        err = pdb.Pdb.clear_all_file_breaks(self, filename)
+        self._reindex_breaks(self.canonic(filename))
+        return err
+
+    def clear_all_breaks(self):
+        err = pdb.Pdb.clear_all_breaks(self)
+        self._breaks_index = {}
+        self._code_breaks.clear()
+        self._stack_entries.clear()
+        return err
+
+    def do_enable(self, arg):
+        pdb.Pdb.do_enable(self, arg)
+        # breakpoint markers are colored by their state
+        self._stack_entries.clear()
+
+    def do_disable(self, arg):
+        pdb.Pdb.do_disable(self, arg)
+        self._stack_entries.clear()
+
+    ##
+    # Breakpoint hits
+    ##
+    def break_anywhere(self, frame):
+        """Tell whether frame's code object spans any breakpoint.
+
+        bdb only checks the file, so every function of a file with a single
+        breakpoint gets traced line by line.  The answer is cached per code
+        object until the breakpoints change, for at most MAX_CODE_BREAKS
+        code objects."""
+        code = frame.f_code
+        key = (code, code.co_filename)
+        try:
+            return self._code_breaks[key]
+        except KeyError:
+            pass
+        breaks = self._breaks_index.get(self.canonic(code.co_filename))
+        found = False
+        if breaks:
+            first = code.co_firstlineno
+            last = first + sum(map(ord, code.co_lnotab[1::2]))
+            for lineno in breaks:
+                if first <= lineno <= last:
+                    found = True
+                    break
+        if len(self._code_breaks) >= MAX_CODE_BREAKS:
+            self._code_breaks.clear()
+        self._code_breaks[key] = found
+        return found
+
+    def break_here(self, frame):
+        breaks = self._breaks_index.get(self.canonic(frame.f_code.co_filename))
+        if not breaks:
+            return False
+        lineno = frame.f_lineno
+        if lineno not in breaks:
+            # The line itself has no breakpoint, but maybe the line is the
+            # first line of a function with breakpoint set by function name.
+            lineno = frame.f_code.co_firstlineno
+            if lineno not in breaks:
+                return False
+
+        # flag says ok to delete temp. bp
+        bp, flag = self._effective(breaks[lineno].file, lineno, frame)
+        if bp:
+            self.currentbp = bp.number
+            if flag and bp.temporary:
+                self.do_clear(str(bp.number))
+            return True
+        else:
+            return False
+
+    ##
+    # Stepping engine
+    ##
+    # 'next', 'until', 'return' and 'continue' can only stop in a frame that
+    # is newly called while they run if it holds a breakpoint: the frame they
+    # were issued in always stops them when it returns.  So with
+    # fast_stepping on, call events of code objects without breakpoints are
+    # dropped right away (no line events for that frame, and no stop_here
+    # walk up the stack), and 'continue' also silences the frames already on
+    # the stack.  'step' and the fast_stepping=False case go through bdb.
+    # Either way the frames a command may stop in are (re)armed for tracing.
+
+    def _set_step_filter(self, command, frame=None):
+        if self.fast_stepping:
+            self._step_filter = command
+        # frames left untraced by break_anywhere() or silenced by an earlier
+        # 'continue' must see line events again if the command can stop there
+        while frame is not None and frame is not self.botframe:
+            if not frame.f_trace:
+                frame.f_trace = self.trace_dispatch
+            frame = frame.f_back
+
+    def reset(self):
+        pdb.Pdb.reset(self)
+        self._step_filter = None
+
+    def set_step(self):
+        pdb.Pdb.set_step(self)
+        self._step_filter = None
+
+    def set_next(self, frame):
+        pdb.Pdb.set_next(self, frame)
+        self._set_step_filter('next', frame)
+
+    def set_until(self, frame):
+        pdb.Pdb.set_until(self, frame)
+        self._set_step_filter('until', frame)
+
+    def set_return(self, frame):
+        pdb.Pdb.set_return(self, frame)
+        self._set_step_filter('return', frame)
+
+    def set_continue(self):
+        pdb.Pdb.set_continue(self)
+        if not self.breaks:
+            # bdb has removed the trace function altogether
+            return
+        self._set_step_filter('continue')
+        if self._step_filter:
+            frame = sys._getframe().f_back
+            while frame is not None and frame is not self.botframe:
+                if frame.f_trace and not self.break_anywhere(frame):
+                    del frame.f_trace
+                frame = frame.f_back
+
+    def trace_dispatch(self, frame, event, arg):
+        # the call event filter is inlined here, since it runs for every
+        # single function call of the debugged program
+        if event == 'call' and self._step_filter and \
+               self.botframe is not None:
+            code = frame.f_code
+            try:
+                traced = self._code_breaks[code, code.co_filename]
+            except KeyError:
+                traced = self.break_anywhere(frame)
+            if not traced:
+                # No need to trace this function
+                return # None
+        return pdb.Pdb.trace_dispatch(self, frame, event, arg)
+
+    def dispatch_line(self, frame):
+        if self._step_filter == 'continue':
+            # stop_here() is always false while continuing
+            stop = self.break_here(frame)
+        else:
+            stop = self.stop_here(frame) or self.break_here(frame)
+        if stop:
+            self.user_line(frame)
+            if self.quitting: raise bdb.BdbQuit
+        if self._step_filter == 'continue' and not self.break_anywhere(frame):
+            # The frame we were continued from: the trace trampoline would
+            # reinstall f_trace from our return value, so remove it here.
+            del frame.f_trace
+            return # None
+        return self.trace_dispatch
+
+    def _effective(self, filename, lineno, frame):
+        """Same as bdb.effective, but with conditions compiled only once."""
+        for b in bdb.Breakpoint.bplist[filename, lineno]:
+            if not b.enabled:
+                continue
+            if not bdb.checkfuncname(b, frame):
+                continue
+            # Count every hit when bp is enabled
+            b.hits = b.hits + 1
+            if not b.cond:
+                # If unconditional, and ignoring, go on to next, else break
+                if b.ignore > 0:
+                    b.ignore = b.ignore - 1
+                    continue
+                else:
+                    # breakpoint and marker that's ok to delete if temporary
+                    return (b, 1)
+            else:
+                # Conditional bp.  Ignore count applies only to those bpt
+                # hits where the condition evaluates to true.
+                try:
+                    val = eval(self._compile_condition(b.cond),
+                               frame.f_globals, frame.f_locals)
+                    if val:
+                        if b.ignore > 0:
+                            b.ignore = b.ignore - 1
+                        else:
+                            return (b, 1)
+                except:
+                    # if eval fails, most conservative thing is to stop on
+                    # breakpoint regardless of ignore count.  Don't delete
+                    # temporary, as another hint to user.
+                    return (b, 0)
+        return (None, None)
+
+    def _compile_condition(self, cond):
+        """Return the code object for a breakpoint condition.
+
+        Conditions are compiled once and cached by their source, so changing
+        one with 'condition' simply compiles the new source on its next hit.
+        Conditions that fail to compile raise on every evaluation, just as
+        bdb's eval of the string would."""
+        try:
+            code = self._conditions[cond]
+        except KeyError:
+            try:
+                code = compile(cond, '<breakpoint condition>', 'eval')
+            except:
+                code = None
+            self._conditions[cond] = code
+        if code is None:
+            raise SyntaxError('invalid breakpoint condition: %s' % cond)
+        return code
+
 
     def do_list(self, arg):
         self.lastcmd = 'list'
@@ -374,25 +780,16 @@ class Pdb(pdb.Pdb):
             last = first + 10
         filename = self.curframe.f_code.co_filename
         try:
-            Colors = self.color_scheme_table.active_colors
-            ColorsNormal = Colors.Normal
-            tpl_line = '%%s%s%%s %s%%s' % (Colors.lineno, ColorsNormal)
-            tpl_line_em = '%%s%s%%s %s%%s%s' % (Colors.linenoEm, Colors.line, ColorsNormal)
-            src = []
-            for lineno in range(first, last+1):
-                line = linecache.getline(filename, lineno)
-                if not line:
-                    break
-
-                if lineno == self.curframe.f_lineno:
-                    line = self.__format_line(tpl_line_em, filename, lineno, line, arrow = True)
-                else:
-                    line = self.__format_line(tpl_line, filename, lineno, line, arrow = False)
-
-                src.append(line)
-                self.lineno = lineno
-
-            print >>sys.stdout, ''.join(src)
+            lines = first > 0 and \
+                    sources.getlines(filename,
+                                     self.curframe.f_globals)[first-1:last] \
+                    or []
+            src = self.__format_lines(filename, first, lines,
+                                      self.curframe.f_lineno)
+            if lines:
+                self.lineno = first + len(lines) - 1
+
+            output.write_unit(sys.stdout, *(src + ['\n']))
 
         except KeyboardInterrupt:
             pass
@@ -43,6 +43,9 @@ import sys
 import token
 import tokenize
 
+import backends
+import output
+import tbstats
 from ColorANSI import *
 
 #############################################################################
@@ -107,17 +110,32 @@ LightBGColors = ColorScheme(
 ANSICodeColors = ColorSchemeTable([NoColor, LinuxColors, LightBGColors],
                                   _scheme_default)
 
+def _token_colors(colors):
+    """Return the colors of a scheme as a tuple indexed by token type.
+
+    Operators all get the OP color, and types without a color of their own
+    the _TEXT one, so the token handler needs a single index operation."""
+    text = colors[_TEXT]
+    table = [colors.get(toktype, text) for toktype in range(_TEXT + 1)]
+    for toktype in range(token.LPAR, token.OP + 1):
+        table[toktype] = colors.get(token.OP, text)
+    return tuple(table)
+
 class Parser:
     """ Format colored Python source.
     """
 
-    def __init__(self, color_table=None, out = sys.stdout):
+    def __init__(self, color_table=None, out = sys.stdout, backend=None):
         """ Create a parser with a specified color table and output channel.
 
+        backend (see the backends module) selects the output format: ANSI
+        escapes by default, or 'plain' or 'html'.
+
         Call format() to process code.
         """
         self.color_table = color_table and color_table or ANSICodeColors
         self.out = out
+        self.backend = backends.get_backend(backend or backends.ANSI)
 
     def format(self, raw, out = None, scheme = ''):
         """ Parse and send the colored source.
@@ -129,45 +147,60 @@ class Parser:
         string 'str' and the parser will automatically return the output in a
         string."""
 
+        start_time = tbstats.clock()
         self.raw = string.strip(string.expandtabs(raw))
         string_output = 0
         if out == 'str' or self.out == 'str':
             out_old = self.out
             self.out = cStringIO.StringIO()
             string_output = 1
-        elif out is not None:
-            self.out = out
-        # local shorthand
-        colors = self.color_table[scheme].colors
-        self.colors = colors # put in object so __call__ sees it
-        # store line offsets in self.lines
-        self.lines = [0, 0]
-        pos = 0
-        while 1:
-            pos = string.find(self.raw, '\n', pos) + 1
-            if not pos: break
-            self.lines.append(pos)
-        self.lines.append(len(self.raw))
-
-        # parse the source and write it
-        self.pos = 0
-        text = cStringIO.StringIO(self.raw)
-        #self.out.write('<pre><font face="Courier New">')
+        else:
+            if out is not None:
+                self.out = out
+            # tokens come in by the thousand: pass them on in large chunks
+            out_old = self.out
+            self.out = output.BufferedWriter(out_old)
         try:
-            tokenize.tokenize(text.readline, self)
-        except tokenize.TokenError, ex:
-            msg = ex[0]
-            line = ex[1][0]
-            self.out.write("%s\n\n*** ERROR: %s%s%s\n" %
-                           (colors[token.ERRORTOKEN],
-                            msg, self.raw[self.lines[line]:],
-                            colors.normal)
-                           )
-        self.out.write(colors.normal+'\n')
-        if string_output:
-            output = self.out.getvalue()
+            # local shorthand
+            backend = self.backend
+            colors = backend.colors(self.color_table[scheme])
+            self.colors = colors # put in object so __call__ sees it
+            self.token_colors = _token_colors(colors)
+            self.escape = backend.escapes and backend.escape or None
+            # store line offsets in self.lines
+            self.lines = [0, 0]
+            pos = 0
+            while 1:
+                pos = string.find(self.raw, '\n', pos) + 1
+                if not pos: break
+                self.lines.append(pos)
+            self.lines.append(len(self.raw))
+
+            # parse the source and write it
+            self.pos = 0
+            text = cStringIO.StringIO(self.raw)
+            self.out.write(backend.prologue)
+            try:
+                tokenize.tokenize(text.readline, self)
+            except tokenize.TokenError, ex:
+                msg = ex[0]
+                line = ex[1][0]
+                error = msg + self.raw[self.lines[line]:]
+                if self.escape:
+                    error = self.escape(error)
+                self.out.write("%s\n\n*** ERROR: %s%s\n" %
+                               (colors[token.ERRORTOKEN], error, colors.normal)
+                               )
+            self.out.write(colors.normal + '\n' + backend.epilogue)
+            tbstats.add('tokenize_time', tbstats.clock() - start_time)
+            if string_output:
+                return self.out.getvalue()
+        finally:
+            # whatever happened, what was buffered goes out, and the parser
+            # writes to its stream again
+            if not string_output:
+                self.out.flush()
             self.out = out_old
-            return output
 
     def __call__(self, toktype, toktext, (srow, scol), (erow, ecol), line):
         """ Token handler, with syntax highlighting."""
@@ -190,7 +223,10 @@ class Parser:
 
         # send the original whitespace, if needed
         if newpos > oldpos:
-            self.out.write(self.raw[oldpos:newpos])
+            if self.escape:
+                self.out.write(self.escape(self.raw[oldpos:newpos]))
+            else:
+                self.out.write(self.raw[oldpos:newpos])
 
         # skip indenting tokens
         if toktype in [token.INDENT, token.DEDENT]:
@@ -198,11 +234,11 @@ class Parser:
             return
 
         # map token type to a color group
-        if token.LPAR <= toktype and toktype <= token.OP:
-            toktype = token.OP
-        elif toktype == token.NAME and keyword.iskeyword(toktext):
+        if toktype == token.NAME and keyword.iskeyword(toktext):
             toktype = _KEYWORD
-        color = colors.get(toktype, colors[_TEXT])
+        color = self.token_colors[toktype]
+        if self.escape:
+            toktext = self.escape(toktext)
 
         #print '<%s>' % toktext,    # dbg
 
@@ -2,6 +2,7 @@ import sys
 import ultraTB
 import Debugger
 import bdb
+import emergency
 
 defaultTB = ultraTB.AutoFormattedTB(mode="Context", color_scheme="LightBG")
 defaultPDB = Debugger.Pdb(color_scheme="LightBG")
@@ -9,6 +10,9 @@ defaultPDB = Debugger.Pdb(color_scheme="LightBG")
 # convenience
 set_trace = Debugger.set_trace
 
+# a crashstore.CrashStore the excepthook also records exceptions to
+crash_store = None
+
 # replacement excepthook
 # usage: sys.excepthook = tbtools.excepthook
 
@@ -16,8 +20,26 @@ set_trace = Debugger.set_trace
 def excepthook(etype, value, tb):
     if etype is bdb.BdbQuit:
         return
-        
-    defaultTB(etype, value, tb)
+
+    if emergency.is_memory_error(etype):
+        # no colors, no source reading and no debugger: just get the
+        # traceback out while there is a chance
+        emergency.report(etype, value, tb)
+        return
+
+    try:
+        defaultTB(etype, value, tb)
+    except MemoryError:
+        emergency.report(etype, value, tb)
+        return
+
+    if crash_store is not None:
+        # the traceback is out already: whatever goes wrong storing it (a
+        # full disk, a corrupt index, no memory left) must not replace it
+        try:
+            crash_store.record(etype, value, tb)
+        except Exception:
+            pass
 
     if tb and not sys.stdout.closed and \
             hasattr(sys.stdout, "isatty") and \
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""Reporting the exceptions of an asyncio (or trollius) event loop.
+
+The tracebacks of coroutine code are mostly event loop plumbing, and they
+don't say which task failed, nor which tasks were waiting for it.
+LoopExceptionHandler, installed with install() as the exception handler of
+a loop, reports what the loop hands it:
+
+  - the traceback, formatted by an AutoFormattedTB whose hidden_files are
+    the directories of the event loop implementation (asyncio, trollius,
+    selectors, concurrent.futures), so the frames of the loop itself are
+    collapsed into summary lines, with a single prefix test per frame;
+  - the task (or future) the error belongs to, by name, with its await
+    chain: the coroutines it is suspended in, innermost last, and the tasks
+    waiting for it;
+  - the message of the loop, and its other context entries;
+  - where the task, future or callback was created, when the loop is in
+    debug mode and hands over the source_traceback (or handle_traceback).
+
+Python 2 exceptions don't carry their traceback.  It is looked for where
+trollius keeps it: with the failed future, or in sys.exc_info() when the
+loop calls the handler from an except clause, as it does for callbacks.
+When it can't be found, only the exception line is shown, and the creation
+traceback, if any, is all there is to tell where the error came from.
+
+The loop only spends the time needed to take a snapshot of the task state,
+which can't wait as it changes as soon as the loop runs again; formatting
+and writing happen in a worker thread, so a storm of errors never blocks
+the loop.  At most max_pending reports wait for the worker; reports beyond
+that are counted in the dropped attribute instead of queued.  The worker is
+a daemon thread: when the process exits, it is given EXIT_TIMEOUT seconds
+to write the reports still pending.
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['LoopExceptionHandler', 'install', 'loop_prefixes', 'task_name',
+           'await_chain']
+
+import atexit
+import copy
+import os
+import sys
+import threading
+import time
+import weakref
+import Queue
+
+import ultraTB
+from output import write_unit
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+# how far await chains are followed, in either direction
+MAX_CHAIN = 32
+
+# how long close() waits by default, and how long the process waits at exit
+# for the reports still pending, in seconds
+CLOSE_TIMEOUT = 5.0
+EXIT_TIMEOUT = 2.0
+
+# id -> the handlers whose worker has been started, closed at exit
+_handlers = weakref.WeakValueDictionary()
+
+# context entries of the loop shown after the traceback, in this order
+_CONTEXT_KEYS = ('handle', 'protocol', 'transport', 'socket')
+
+# the creation tracebacks of debug mode, and how they are introduced
+_CREATED_KEYS = (('source_traceback', 'Object created at'),
+                 ('handle_traceback', 'Handle created at'))
+
+
+def _package_dir(name):
+    module = sys.modules.get(name)
+    if module is None:
+        try:
+            module = __import__(name, {}, {}, ['__file__'])
+        except ImportError:
+            return None
+    filename = getattr(module, '__file__', None)
+    if not filename:
+        return None
+    if os.path.basename(filename).startswith('__init__.'):
+        return os.path.dirname(os.path.abspath(filename)) + os.sep
+    # a plain module: its source, whatever the extension
+    return os.path.splitext(os.path.abspath(filename))[0] + '.'
+
+
+def loop_prefixes():
+    """The filename prefixes of the event loop implementation's frames."""
+    prefixes = []
+    for name in ('asyncio', 'trollius', 'selectors', 'concurrent.futures'):
+        prefix = _package_dir(name)
+        if prefix is not None:
+            prefixes.append(prefix)
+    return tuple(prefixes)
+
+
+def task_name(task):
+    """The name of a task, or the repr of a future."""
+    get_name = getattr(task, 'get_name', None)
+    if get_name is not None:
+        try:
+            return get_name()
+        except Exception:
+            pass
+    coro = _coroutine(task)
+    if coro is not None:
+        return 'Task %s' % _code_name(coro)
+    return repr(task)
+
+
+def _coroutine(task):
+    get_coro = getattr(task, 'get_coro', None)
+    if get_coro is not None:
+        try:
+            return get_coro()
+        except Exception:
+            pass
+    return getattr(task, '_coro', None)
+
+
+def _code_name(coro):
+    code = getattr(coro, 'cr_code', None) or getattr(coro, 'gi_code', None)
+    if code is None:
+        return repr(coro)
+    return '%s()' % code.co_name
+
+
+def _coro_frame(coro):
+    frame = getattr(coro, 'cr_frame', None)
+    if frame is None:
+        frame = getattr(coro, 'gi_frame', None)
+    return frame
+
+
+def _awaited(coro):
+    awaited = getattr(coro, 'cr_await', None)
+    if awaited is None:
+        awaited = getattr(coro, 'gi_yieldfrom', None)
+    return awaited
+
+
+def _waiters(future):
+    """The tasks whose wakeup is among the done callbacks of future."""
+    tasks = []
+    for callback in getattr(future, '_callbacks', None) or ():
+        if isinstance(callback, tuple):
+            # (callback, context) since Python 3.7
+            callback = callback[0]
+        owner = getattr(callback, '__self__', None)
+        if owner is not None and owner is not future and \
+               _coroutine(owner) is not None:
+            tasks.append(owner)
+    return tasks
+
+
+def await_chain(task):
+    """Return (suspended, waiters) for task.
+
+    suspended lists 'name() at file:line' for the coroutines the task is
+    suspended in, outermost first; waiters lists the names of the tasks
+    waiting for this one, nearest first."""
+    suspended = []
+    coro = _coroutine(task)
+    while coro is not None and len(suspended) < MAX_CHAIN:
+        frame = _coro_frame(coro)
+        if frame is not None:
+            suspended.append('%s at %s:%d' % (_code_name(coro),
+                                              frame.f_code.co_filename,
+                                              frame.f_lineno))
+        coro = _awaited(coro)
+    waiters = []
+    seen = {id(task): None}
+    pending = _waiters(task)
+    while pending and len(waiters) < MAX_CHAIN:
+        waiter = pending.pop(0)
+        if id(waiter) in seen:
+            continue
+        seen[id(waiter)] = None
+        waiters.append(task_name(waiter))
+        pending.extend(_waiters(waiter))
+    return suspended, waiters
+
+
+def _exception_tb(context, exception):
+    """The traceback of exception, or None if it can't be found."""
+    tb = getattr(exception, '__traceback__', None)
+    if tb is not None:
+        return tb
+    future = context.get('future') or context.get('task')
+    if future is not None and \
+           getattr(future, '_exception', None) is exception:
+        # trollius keeps the traceback of set_exception() here
+        tb = getattr(future, '_exception_tb', None)
+        if tb is not None:
+            return tb
+    etype, value, tb = sys.exc_info()
+    if value is exception:
+        return tb
+    return None
+
+
+class _Report(object):
+    """What the worker needs from a call of the handler."""
+
+    __slots__ = ('message', 'exc_info', 'task', 'suspended', 'waiters',
+                 'details', 'created')
+
+
+class LoopExceptionHandler(object):
+    """Exception handler for event loops; see the module docstring.
+
+    formatter is the AutoFormattedTB to use (a Context mode one by default),
+    out the stream the reports go to (sys.stderr by default, looked up at
+    each report).  To hide the loop frames, a copy of formatter is made, so
+    that the caller's other tracebacks are formatted as before."""
+
+    def __init__(self, formatter=None, out=None, hide_loop_frames=True,
+                 max_pending=100):
+        if formatter is None:
+            formatter = ultraTB.AutoFormattedTB(mode='Context',
+                                                color_scheme='Linux')
+        elif hide_loop_frames:
+            formatter = copy.copy(formatter)
+        if hide_loop_frames:
+            formatter.hidden_files = formatter.hidden_files + \
+                                     loop_prefixes()
+        self.formatter = formatter
+        self.out = out
+        self.dropped = 0
+        self._queue = Queue.Queue(max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __call__(self, loop, context):
+        """Called by the loop, in its thread."""
+        report = _Report()
+        report.message = context.get('message') or 'Unhandled exception'
+        exception = context.get('exception')
+        if exception is not None:
+            report.exc_info = (type(exception), exception,
+                               _exception_tb(context, exception))
+        else:
+            report.exc_info = None
+        task = context.get('task') or context.get('future')
+        if task is not None:
+            report.task = task_name(task)
+            report.suspended, report.waiters = await_chain(task)
+        else:
+            report.task = None
+        report.details = []
+        for key in _CONTEXT_KEYS:
+            if key in context:
+                try:
+                    value = repr(context[key])
+                except Exception:
+                    value = '<unrepresentable %s>' % type(context[key])
+                report.details.append((key, value))
+        report.created = []
+        for key, label in _CREATED_KEYS:
+            if context.get(key):
+                report.created.append((label, list(context[key])))
+        self._start()
+        try:
+            self._queue.put_nowait(report)
+        except Queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        self._lock.acquire()
+        try:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run,
+                                          name='tbtools-asynctb')
+                thread.setDaemon(True)
+                thread.start()
+                self._thread = thread
+                _handlers[id(self)] = self
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        while 1:
+            report = self._queue.get()
+            if report is None:
+                break
+            try:
+                text = self.format(report)
+                write_unit(self.out or sys.stderr, text, '\n')
+            except Exception:
+                # never let a broken report take the worker down
+                pass
+            report = None
+
+    def format(self, report):
+        """Return the text of a report."""
+        formatter = self.formatter
+        Colors = formatter.Colors
+        escape = formatter.backend.escape
+        parts = ['%s%s%s' % (Colors.topline, escape(report.message),
+                             Colors.Normal)]
+        if report.task is not None:
+            parts.append('%sTask%s: %s' % (Colors.excName, Colors.Normal,
+                                           escape(report.task)))
+            for entry in report.suspended:
+                parts.append('  suspended in %s' % escape(entry))
+            for waiter in report.waiters:
+                parts.append('  awaited by %s' % escape(waiter))
+        for key, value in report.details:
+            parts.append('%s: %s' % (key, escape(value)))
+        if report.exc_info is not None:
+            etype, value, tb = report.exc_info
+            if tb is None:
+                parts.append(ultraTB.ListTB.text(formatter, etype, value, []))
+            else:
+                parts.append(formatter.text(etype, value, tb))
+        for label, entries in report.created:
+            parts.append('%s%s (most recent call last)%s:' %
+                         (Colors.normalEm, label, Colors.Normal))
+            parts.append(''.join(formatter._format_list(entries)).rstrip())
+        return '\n'.join(parts)
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """Wait until the pending reports are written, at most timeout
+        seconds (None waits for as long as it takes), and stop the worker.
+
+        Return True if all the reports were written.  The worker goes on
+        with those left, if any."""
+        thread = self._thread
+        if thread is None:
+            return True
+        if thread is threading.currentThread():
+            # called while writing a report: the worker can't wait for itself
+            return False
+        if timeout is not None:
+            deadline = time.time() + timeout
+        try:
+            # the queue may be full, and the writes stuck
+            self._queue.put(None, True, timeout)
+        except Queue.Full:
+            return False
+        self._thread = None
+        if timeout is None:
+            thread.join()
+        else:
+            thread.join(max(deadline - time.time(), 0))
+        return not thread.isAlive()
+
+
+def _close_all():
+    """Give the workers EXIT_TIMEOUT seconds in all to write their
+    pending reports."""
+    deadline = time.time() + EXIT_TIMEOUT
+    for handler in _handlers.values():
+        handler.close(max(deadline - time.time(), 0))
+
+atexit.register(_close_all)
+
+
+def install(loop=None, **kw):
+    """Make a LoopExceptionHandler (built with the keyword arguments) the
+    exception handler of loop, by default the current event loop, and
+    return it."""
+    if loop is None:
+        if asyncio is None:
+            raise ImportError('neither asyncio nor trollius is available')
+        loop = asyncio.get_event_loop()
+    handler = LoopExceptionHandler(**kw)
+    loop.set_exception_handler(handler)
+    return handler
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Output backends: what the colors of a scheme turn into.
+
+The formatters (ListTB, VerboseTB, SyntaxTB, PyColorize.Parser) build their
+output from the entries of a color scheme and from text taken from the
+program: file names, source lines, reprs.  A backend decides what both
+become, so one rendering pipeline produces several formats directly,
+without post-processing passes stripping or translating ANSI escapes:
+
+    ANSI    the escapes of the color scheme, as always
+    PLAIN   no markup at all
+    HTML    <span class="tb-NAME"> elements named after the scheme entries
+            (tb-filenameEm, tb-lineno, ... and tb-NUMBER, tb-KEYWORD, ...
+            for colorized source), with the text HTML-escaped; the whole
+            output is a <pre class="tb-traceback"> block, which a style sheet
+            colors
+
+Backends are selected with the set_backend() method of the formatters, by
+instance or by name ('ansi', 'plain', 'html').
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['Backend', 'AnsiBackend', 'PlainBackend', 'HtmlBackend',
+           'ANSI', 'PLAIN', 'HTML', 'get_backend']
+
+import token
+
+from ColorANSI import Struct
+
+
+def _identity(text):
+    return text
+
+
+class Backend(object):
+    """Base class of the backends.
+
+    escape(text) makes program text safe to insert in the output; escapes
+    tells whether it does anything at all, so callers can skip it.  wrap()
+    is applied once to each complete traceback or listing; streaming
+    producers write its two halves, prologue and epilogue, themselves."""
+
+    name = None
+    escapes = False
+    escape = staticmethod(_identity)
+    prologue = ''
+    epilogue = ''
+
+    def colors(self, scheme):
+        """Return the Struct of colors to render scheme with."""
+        raise NotImplementedError
+
+    def wrap(self, text):
+        if not (self.prologue or self.epilogue):
+            return text
+        return '%s%s%s' % (self.prologue, text, self.epilogue)
+
+
+class AnsiBackend(Backend):
+    """The escape sequences of the color scheme."""
+
+    name = 'ansi'
+
+    def colors(self, scheme):
+        # the scheme's own Struct, so changes to the scheme show up
+        return scheme.colors
+
+
+class PlainBackend(Backend):
+    """Text without any markup, whatever the color scheme."""
+
+    name = 'plain'
+
+    def colors(self, scheme):
+        return Struct([(key, '') for key in scheme.colors])
+
+
+# names for the integer keys of the PyColorize schemes
+_token_names = dict(token.tok_name)
+_token_names[token.NT_OFFSET + 1] = 'KEYWORD'
+_token_names[token.NT_OFFSET + 2] = 'TEXT'
+try:
+    import tokenize
+    _token_names[tokenize.COMMENT] = 'COMMENT'
+    _token_names[tokenize.NL] = 'NL'
+except (ImportError, AttributeError):
+    pass
+
+
+def html_escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+class HtmlBackend(Backend):
+    """HTML, with a CSS class per color scheme entry.
+
+    Every color closes the current span and opens one for its entry;
+    Normal (or normal) reopens a span without a class."""
+
+    name = 'html'
+    escapes = True
+    escape = staticmethod(html_escape)
+
+    def __init__(self, prefix='tb-'):
+        self.prefix = prefix
+        self.prologue = '<pre class="%straceback"><span>' % prefix
+        self.epilogue = '</span></pre>'
+
+    def colors(self, scheme):
+        colors = Struct()
+        for key in scheme.colors:
+            if key in ('Normal', 'normal'):
+                colors[key] = '</span><span>'
+            elif key == 'NoColor':
+                colors[key] = ''
+            else:
+                if not isinstance(key, basestring):
+                    key_name = _token_names.get(key, str(key))
+                else:
+                    key_name = key
+                colors[key] = '</span><span class="%s%s">' % (self.prefix,
+                                                             key_name)
+        return colors
+
+
+ANSI = AnsiBackend()
+PLAIN = PlainBackend()
+HTML = HtmlBackend()
+
+_by_name = {'ansi': ANSI, 'plain': PLAIN, 'html': HTML}
+
+
+def get_backend(backend):
+    """Return backend, given as an instance or by name."""
+    if isinstance(backend, Backend):
+        return backend
+    try:
+        return _by_name[backend.lower()]
+    except (KeyError, AttributeError):
+        raise ValueError, 'Unknown output backend: %r\nValid backends: %s' % \
+              (backend, ', '.join(sorted(_by_name)))
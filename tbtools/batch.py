@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Rendering archived tracebacks in bulk.
+
+Exceptions logged as (etype, value, elist) records, elist being what
+traceback.extract_tb() returns, can be formatted again long after the fact
+with ListTB.text().  render() does it for any number of records:
+
+  - one formatter serves all the records, and builds its color templates
+    once (ListTB.text_many);
+  - source lines missing from the entries are filled in from the source
+    files, which are then read once, whatever the number of records;
+  - results are yielded one by one, in order, as they are ready, so
+    millions of records never have to be held in memory;
+  - with processes, the records are formatted in chunks by a pool of worker
+    processes (where multiprocessing is available).
+
+Archived exception types are often just names, and the classes they name
+may not be importable where the records are rendered: etype can be given
+as a class or as a name.  Records sent to worker processes are reduced to
+names and strings first, so that whatever they hold, they can be pickled.
+
+write() sends the results to a file, through a write-combining buffer.
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['render', 'write', 'portable']
+
+import collections
+import exceptions
+
+import backends
+import output
+import ultraTB
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# records per task sent to a worker process
+CHUNK_SIZE = 256
+
+# chunks in flight per worker process
+CHUNKS_PER_WORKER = 2
+
+# name -> stand-in class for the exception types given by name
+_named_types = {}
+
+
+def _exception_type(etype):
+    """The class to format etype with, given as a class or by name."""
+    if not isinstance(etype, basestring):
+        return etype
+    klass = getattr(exceptions, etype, None)
+    if isinstance(klass, type) and issubclass(klass, BaseException):
+        return klass
+    try:
+        return _named_types[etype]
+    except KeyError:
+        klass = _named_types[etype] = type(etype.split('.')[-1],
+                                           (Exception,), {})
+        return klass
+
+
+def _value_text(value):
+    try:
+        return str(value)
+    except:
+        return '<unprintable %s object>' % type(value).__name__
+
+
+def portable(record):
+    """Return record reduced to names, strings and tuples.
+
+    The exception type becomes its name, and the value its string, except
+    for syntax errors, whose location details ListTB shows."""
+    etype, value, elist = record
+    if not isinstance(etype, basestring):
+        etype = getattr(etype, '__name__', str(etype))
+    if etype == 'SyntaxError' and value is not None:
+        try:
+            msg, (filename, lineno, offset, line) = value
+            value = (msg, (filename, lineno, offset, line))
+        except:
+            value = _value_text(value)
+    elif value is not None:
+        value = _value_text(value)
+    if elist:
+        elist = [tuple(entry) for entry in elist]
+    return etype, value, elist
+
+
+def _normalize(records):
+    for etype, value, elist in records:
+        yield _exception_type(etype), value, elist
+
+
+def _formatter(color_scheme, backend, color_depth):
+    formatter = ultraTB.ListTB(color_scheme='NoColor')
+    formatter.set_backend(backend)
+    table = formatter.color_scheme_table
+    if color_depth is not None and color_depth != table.color_depth:
+        table.set_color_depth(color_depth)
+    formatter.set_colors(color_scheme)
+    return formatter
+
+
+# the formatter of a worker process, set up by _init_worker
+_worker = [None]
+
+
+def _init_worker(color_scheme, backend, color_depth):
+    _worker[0] = _formatter(color_scheme, backend, color_depth)
+
+
+def _render_chunk(args):
+    records, fill_lines = args
+    return list(_worker[0].text_many(_normalize(records),
+                                     fill_lines=fill_lines))
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(portable(record))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def render(records, color_scheme='NoColor', backend=None, color_depth=None,
+           fill_lines=True, processes=None, chunk_size=None):
+    """Yield the formatted text of every (etype, value, elist) record.
+
+    color_scheme, backend (see the backends module) and color_depth select
+    the output, as for the formatters; the default is plain text.  Missing
+    source lines are filled in unless fill_lines is false.
+
+    With processes (a number, or 0 for one per CPU), records are formatted
+    by that many worker processes, chunk_size records at a time, and
+    yielded in their original order.  Only CHUNKS_PER_WORKER chunks per
+    worker are handed out ahead of the results, so the records are read
+    as the results are consumed.  Without multiprocessing this falls back
+    to formatting in the calling process."""
+    if backend is None:
+        backend = backends.PLAIN
+    if processes is None or multiprocessing is None:
+        formatter = _formatter(color_scheme, backend, color_depth)
+        for text in formatter.text_many(_normalize(records),
+                                        fill_lines=fill_lines):
+            yield text
+        return
+
+    if not processes:
+        try:
+            processes = multiprocessing.cpu_count()
+        except NotImplementedError:
+            processes = 1
+    pool = multiprocessing.Pool(processes, _init_worker,
+                                (color_scheme, backend, color_depth))
+    try:
+        # not pool.imap(): its task handler reads all of the tasks at once
+        pending = collections.deque()
+        window = processes * CHUNKS_PER_WORKER
+        for chunk in _chunks(records, chunk_size or CHUNK_SIZE):
+            pending.append(pool.apply_async(_render_chunk,
+                                            ((chunk, fill_lines),)))
+            if len(pending) >= window:
+                for text in pending.popleft().get():
+                    yield text
+        while pending:
+            for text in pending.popleft().get():
+                yield text
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def write(records, out, separator='\n\n', **kw):
+    """Render records (see render() for the keyword arguments) to the file
+    out, separated by separator.  Return the number of records written."""
+    out = output.BufferedWriter(out)
+    count = 0
+    for text in render(records, **kw):
+        if count:
+            out.write(separator)
+        out.write(text)
+        count += 1
+    if count:
+        out.write('\n')
+    out.flush()
+    return count
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Rules deciding which variables the Verbose tracebacks show.
+
+The variable details of Verbose mode are all or nothing: every name on the
+failing line is evaluated and repr'd, passwords and gigabyte buffers
+included.  A CaptureFilter holds an ordered list of rules; the first rule
+matching a variable decides what happens to it:
+
+    'show'     the value is shown as usual
+    'redact'   a placeholder is shown instead of the value
+    'hide'     the variable is left out
+
+A rule matches when all the criteria it gives match:
+
+    names      glob patterns for the variable's name; dotted names match
+               either as a whole ('self.conf.*') or by their last part
+               ('*password*' matches self.password)
+    types      classes, or dotted class names ('numpy.ndarray') which don't
+               need to be imported, matched against the value's class and
+               its bases
+    modules    glob patterns for the __name__ of the frame's module
+    files      glob patterns for the frame's filename
+
+Module and file criteria are checked once per frame, and names before the
+value is even looked up: only rules with types need the value, and nothing
+is repr'd before a variable is known to be shown.  For example:
+
+    CaptureFilter([
+        {'action': 'redact', 'names': ['*password*', '*secret*', '*token*']},
+        {'action': 'hide', 'files': ['*/site-packages/*']},
+        {'action': 'redact', 'types': ['numpy.ndarray', 'str'],
+         'modules': ['myapp.ingest*']},
+    ])
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['CaptureFilter', 'Rule', 'SHOW', 'REDACT', 'HIDE',
+           'compile_globs']
+
+import fnmatch
+import inspect
+import re
+
+SHOW = 'show'
+REDACT = 'redact'
+HIDE = 'hide'
+
+_ACTIONS = (SHOW, REDACT, HIDE)
+
+
+def compile_globs(patterns):
+    """One regular expression matching any of the glob patterns (a string
+    or a sequence of them), or None if there are none."""
+    if not patterns:
+        return None
+    if isinstance(patterns, basestring):
+        patterns = [patterns]
+    return re.compile('|'.join(['(?:%s)' % fnmatch.translate(p)
+                                for p in patterns]))
+
+
+def _class_names(klass):
+    """Dotted names of klass and of all its bases."""
+    try:
+        mro = inspect.getmro(klass)
+    except:
+        mro = (klass,)
+    names = []
+    for base in mro:
+        name = getattr(base, '__name__', None)
+        if name:
+            names.append('%s.%s' % (getattr(base, '__module__', ''), name))
+            if getattr(base, '__module__', None) == '__builtin__':
+                names.append(name)
+    return names
+
+
+class Rule(object):
+    """One rule of a CaptureFilter.  See the module docstring."""
+
+    def __init__(self, action=REDACT, names=None, types=None, modules=None,
+                 files=None):
+        if action not in _ACTIONS:
+            raise ValueError, 'unknown capture action: %r' % (action,)
+        self.action = action
+        self.names = compile_globs(names)
+        self.modules = compile_globs(modules)
+        self.files = compile_globs(files)
+        self.classes = ()
+        self.class_names = {}
+        if types:
+            if not isinstance(types, (list, tuple)):
+                types = [types]
+            self.classes = tuple([t for t in types
+                                  if not isinstance(t, basestring)])
+            for t in types:
+                if isinstance(t, basestring):
+                    self.class_names[t] = None
+
+    def matches_frame(self, module, filename):
+        if self.modules is not None and not self.modules.match(module or ''):
+            return False
+        if self.files is not None and not self.files.match(filename or ''):
+            return False
+        return True
+
+    def matches_name(self, name):
+        if self.names is None:
+            return True
+        match = self.names.match
+        return bool(match(name) or match(name.rsplit('.', 1)[-1]))
+
+    def needs_value(self):
+        return bool(self.classes or self.class_names)
+
+    def matches_value(self, value):
+        klass = getattr(value, '__class__', None) or type(value)
+        if self.classes:
+            try:
+                if isinstance(value, self.classes):
+                    return True
+            except TypeError:
+                pass
+        if self.class_names:
+            for name in _class_names(klass):
+                if name in self.class_names:
+                    return True
+        return False
+
+
+class _FrameFilter(object):
+    """The rules of a CaptureFilter which apply to one frame."""
+
+    def __init__(self, rules, default):
+        self.rules = rules
+        self.default = default
+
+    def check(self, name, lookup):
+        """Return (action, value) for the variable called name.
+
+        lookup() gives the value of the variable; it is only called when a
+        rule needs it, and value is UNRESOLVED if it wasn't."""
+        value = UNRESOLVED
+        for rule in self.rules:
+            if not rule.matches_name(name):
+                continue
+            if rule.needs_value():
+                if value is UNRESOLVED:
+                    value = lookup()
+                if not rule.matches_value(value):
+                    continue
+            return rule.action, value
+        return self.default, value
+
+
+class _Unresolved(object):
+    def __repr__(self):
+        return '<unresolved>'
+
+UNRESOLVED = _Unresolved()
+
+
+class CaptureFilter(object):
+    """Ordered rules for the variables shown by Verbose tracebacks.
+
+    rules is a list of Rule instances or of dicts of Rule arguments.
+    Variables no rule matches get the default action; redacted ones are
+    shown as placeholder."""
+
+    def __init__(self, rules=(), default=SHOW, placeholder='<redacted>'):
+        if default not in _ACTIONS:
+            raise ValueError, 'unknown capture action: %r' % (default,)
+        self.rules = []
+        self.default = default
+        self.placeholder = placeholder
+        for rule in rules:
+            if isinstance(rule, dict):
+                self.add(**rule)
+            else:
+                self.rules.append(rule)
+
+    def add(self, action=REDACT, names=None, types=None, modules=None,
+            files=None):
+        """Append a rule; see the module docstring for the arguments."""
+        self.rules.append(Rule(action, names, types, modules, files))
+
+    def for_frame(self, module, filename):
+        """Return the filter for the variables of one frame.
+
+        Return None when everything in the frame gets shown anyway, so the
+        caller can skip the checks altogether."""
+        rules = [r for r in self.rules if r.matches_frame(module, filename)]
+        if not rules and self.default == SHOW:
+            return None
+        return _FrameFilter(rules, self.default)
@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+"""A bounded on-disk store of crash reports, indexed by fingerprint.
+
+Tracebacks written to a log file or to stderr pile up without bound and
+can only be found again by scanning everything.  A CrashStore keeps each
+report (a Verbose traceback without colors, plus a few lines of metadata)
+in a directory of segment files:
+
+  seg-00000001.log ...  the reports, appended one after the other; when a
+                        segment reaches segment_size a new one is started,
+                        and only the newest max_segments are kept
+  index                 one line per report, appended as it is stored:
+                        timestamp, fingerprint, exception type, segment,
+                        offset and length of the report in the segment
+  lock                  empty, locked while a report is being stored
+
+The fingerprint identifies the crash site rather than the occurrence: it is
+computed from the exception type and the file (base name) and function of
+every frame, leaving line numbers out so that edits elsewhere in a file
+don't split a group.  See fingerprint().
+
+Reports are fetched through the index, reading only their own bytes of
+their segment; the index is loaded once and then only the lines appended
+since are read.  Several processes may share a store: appends go through
+an exclusive lock on the lock file where fcntl is available.  The index
+can't be the one locked, as compacting it replaces it with a new file.
+
+From the command line (installed as the tbcrash script too):
+
+    python -m tbtools.crashstore [-n count] [-t type] DIR [list]
+    python -m tbtools.crashstore DIR groups
+    python -m tbtools.crashstore [-n count] DIR show FINGERPRINT
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['CrashStore', 'Entry', 'fingerprint', 'tb_frames', 'main']
+
+import os
+import socket
+import sys
+import threading
+import time
+
+import ultraTB
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# defaults for the size of a store
+SEGMENT_SIZE = 4 * 1024 * 1024
+MAX_SEGMENTS = 8
+
+_INDEX = 'index'
+_LOCK = 'lock'
+_SEGMENT = 'seg-%08d.log'
+
+
+def _normalize_file(filename):
+    """The part of a frame's filename which goes into fingerprints."""
+    name = os.path.basename(filename or '?')
+    if name.endswith('.pyc') or name.endswith('.pyo'):
+        name = name[:-1]
+    return name
+
+
+def fingerprint(etype, frames):
+    """Return the fingerprint of a crash, as a string of 16 hex digits.
+
+    etype is the exception class or its name, frames a sequence of
+    (filename, function name) pairs, outermost first."""
+    if not isinstance(etype, basestring):
+        etype = getattr(etype, '__name__', str(etype))
+    parts = [etype]
+    for filename, name in frames:
+        parts.append('%s:%s' % (_normalize_file(filename), name))
+    return md5('\n'.join(parts)).hexdigest()[:16]
+
+
+def tb_frames(tb):
+    """The (filename, function name) pairs of the frames of traceback tb."""
+    frames = []
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        frames.append((code.co_filename, code.co_name))
+        tb = tb.tb_next
+    return frames
+
+
+class Entry(object):
+    """One line of the index: where a report is and what it is about."""
+
+    __slots__ = ('timestamp', 'fingerprint', 'etype', 'segment', 'offset',
+                 'length')
+
+    def __init__(self, timestamp, fingerprint, etype, segment, offset,
+                 length):
+        self.timestamp = timestamp
+        self.fingerprint = fingerprint
+        self.etype = etype
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+
+    def line(self):
+        return '%.6f\t%s\t%s\t%d\t%d\t%d\n' % (
+            self.timestamp, self.fingerprint, self.etype, self.segment,
+            self.offset, self.length)
+
+    def parse(cls, line):
+        """Return the Entry of an index line, or None if it is damaged."""
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 6:
+            return None
+        try:
+            return cls(float(fields[0]), fields[1], fields[2],
+                       int(fields[3]), int(fields[4]), int(fields[5]))
+        except ValueError:
+            return None
+    parse = classmethod(parse)
+
+    def __repr__(self):
+        return '<Entry %s %s %s>' % (self.fingerprint, self.etype,
+                                     time.ctime(self.timestamp))
+
+
+class CrashStore(object):
+    """Crash reports stored under directory, in at most max_segments
+    segments of about segment_size bytes each."""
+
+    def __init__(self, directory, segment_size=None, max_segments=None):
+        self.directory = directory
+        self.segment_size = segment_size or SEGMENT_SIZE
+        self.max_segments = max_segments or MAX_SEGMENTS
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.RLock()
+        self._formatter = None
+        # the index as read so far
+        self._entries = []
+        self._by_fingerprint = {}
+        self._index_id = None
+        self._index_pos = 0
+
+    #------------------------------------------------------------------
+    # writing
+
+    def record(self, etype, value, tb, tb_offset=0, meta=None):
+        """Store a report of the exception and return its Entry.
+
+        The report is rendered by a Verbose formatter without colors; meta
+        is a dict of extra metadata (str keys and values) for the report."""
+        text = self._render(etype, value, tb, tb_offset)
+        frames = tb_frames(tb)[tb_offset:]
+        try:
+            message = str(value)
+        except:
+            message = '<unprintable %s object>' % type(value).__name__
+        info = {'message': message}
+        if meta:
+            info.update(meta)
+        return self.add(text, etype, fingerprint(etype, frames), info)
+
+    def _render(self, etype, value, tb, tb_offset):
+        if self._formatter is None:
+            formatter = ultraTB.VerboseTB(color_scheme='NoColor',
+                                          long_header=1)
+            formatter.set_backend('plain')
+            self._formatter = formatter
+        formatter = self._formatter
+        self._lock.acquire()
+        try:
+            formatter.tb_offset = tb_offset
+            return formatter.text(etype, value, tb)
+        finally:
+            self._lock.release()
+
+    def add(self, text, etype, fingerprint, meta=None, timestamp=None):
+        """Store an already rendered report and return its Entry."""
+        if not isinstance(etype, basestring):
+            etype = getattr(etype, '__name__', str(etype))
+        etype = etype.replace('\t', ' ').replace('\n', ' ')
+        if timestamp is None:
+            timestamp = time.time()
+        info = {'pid': str(os.getpid()), 'host': socket.gethostname(),
+                'argv': ' '.join(sys.argv)}
+        if meta:
+            info.update(meta)
+        header = ['Crash-Report: %s\n' % fingerprint,
+                  'Date: %s\n' % time.ctime(timestamp),
+                  'Type: %s\n' % etype]
+        keys = info.keys()
+        keys.sort()
+        for key in keys:
+            header.append('%s: %s\n' % (key.capitalize(),
+                                        _one_line(info[key])))
+        if isinstance(text, unicode):
+            text = text.encode('utf-8', 'replace')
+        data = '%s\n%s\n\n' % (''.join(header), text)
+
+        self._lock.acquire()
+        try:
+            lock = open(os.path.join(self.directory, _LOCK), 'ab')
+            try:
+                _lock_file(lock)
+                segment = self._current_segment(len(data))
+                path = os.path.join(self.directory, _SEGMENT % segment)
+                f = open(path, 'ab')
+                try:
+                    f.seek(0, 2)
+                    offset = f.tell()
+                    f.write(data)
+                finally:
+                    f.close()
+                entry = Entry(timestamp, fingerprint, etype, segment, offset,
+                              len(data))
+                # opened only now: rotating may have replaced the index
+                index = open(os.path.join(self.directory, _INDEX), 'ab')
+                try:
+                    index.write(entry.line())
+                finally:
+                    index.close()
+            finally:
+                lock.close()        # releases the lock too
+        finally:
+            self._lock.release()
+        return entry
+
+    def _segments(self):
+        """The numbers of the segments on disk, in increasing order."""
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith('seg-') and name.endswith('.log'):
+                try:
+                    numbers.append(int(name[4:-4]))
+                except ValueError:
+                    pass
+        numbers.sort()
+        return numbers
+
+    def _current_segment(self, size):
+        """The segment to append size bytes to, rotating if needed."""
+        segments = self._segments()
+        if not segments:
+            return 1
+        last = segments[-1]
+        path = os.path.join(self.directory, _SEGMENT % last)
+        try:
+            used = os.path.getsize(path)
+        except OSError:
+            used = 0
+        if not used or used + size <= self.segment_size:
+            return last
+        last += 1
+        segments.append(last)
+        expired = segments[:-self.max_segments]
+        if expired:
+            for old in expired:
+                try:
+                    os.unlink(os.path.join(self.directory, _SEGMENT % old))
+                except OSError:
+                    pass
+            self._compact(expired[-1] + 1)
+        return last
+
+    def _compact(self, oldest):
+        """Drop the index lines of the segments before oldest.
+
+        Called with the store locked; the new index replaces the old one
+        with a rename, so readers never see a partial index."""
+        path = os.path.join(self.directory, _INDEX)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return
+        try:
+            lines = f.readlines()
+        finally:
+            f.close()
+        kept = []
+        for line in lines:
+            entry = Entry.parse(line)
+            if entry is not None and entry.segment >= oldest:
+                kept.append(line)
+        if len(kept) == len(lines):
+            return
+        tmp = path + '.%d.tmp' % os.getpid()
+        f = open(tmp, 'wb')
+        try:
+            f.writelines(kept)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+
+    #------------------------------------------------------------------
+    # reading
+
+    def _refresh(self):
+        """Read the index lines appended since the last call."""
+        path = os.path.join(self.directory, _INDEX)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return
+        try:
+            st = os.fstat(f.fileno())
+            index_id = (st.st_dev, st.st_ino)
+            if index_id != self._index_id or st.st_size < self._index_pos:
+                # new or compacted index: start over
+                self._entries = []
+                self._by_fingerprint = {}
+                self._index_id = index_id
+                self._index_pos = 0
+            f.seek(self._index_pos)
+            data = f.read()
+        finally:
+            f.close()
+        # a line still being written is read next time
+        end = data.rfind('\n') + 1
+        self._index_pos += end
+        for line in data[:end].splitlines(True):
+            entry = Entry.parse(line)
+            if entry is None:
+                continue
+            self._entries.append(entry)
+            self._by_fingerprint.setdefault(entry.fingerprint,
+                                            []).append(entry)
+
+    def entries(self, fingerprint=None, etype=None, since=None, until=None,
+                limit=None):
+        """Return the Entries of the stored reports, newest first.
+
+        They can be restricted to a fingerprint (or its first digits), an
+        exception type name, a time interval, and to the newest limit."""
+        self._lock.acquire()
+        try:
+            self._refresh()
+            if fingerprint is None:
+                candidates = self._entries
+            elif fingerprint in self._by_fingerprint:
+                candidates = self._by_fingerprint[fingerprint]
+            else:
+                candidates = []
+                for key, found in self._by_fingerprint.items():
+                    if key.startswith(fingerprint):
+                        candidates.extend(found)
+                candidates.sort(key=lambda e: e.timestamp)
+        finally:
+            self._lock.release()
+        segments = self._segments()
+        oldest = segments and segments[0] or 0
+        result = []
+        for entry in reversed(candidates):
+            if entry.segment < oldest or \
+                   (etype is not None and entry.etype != etype) or \
+                   (since is not None and entry.timestamp < since) or \
+                   (until is not None and entry.timestamp >= until):
+                continue
+            result.append(entry)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def groups(self):
+        """Return {fingerprint: (count, exception type, last timestamp)}
+        for the reports still stored."""
+        groups = {}
+        for entry in self.entries():
+            count, etype, last = groups.get(entry.fingerprint,
+                                            (0, entry.etype, 0))
+            groups[entry.fingerprint] = (count + 1, etype,
+                                         max(last, entry.timestamp))
+        return groups
+
+    def read(self, entry):
+        """Return the stored report of entry, metadata included, or None if
+        its segment is gone."""
+        path = os.path.join(self.directory, _SEGMENT % entry.segment)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            f.seek(entry.offset)
+            return f.read(entry.length)
+        finally:
+            f.close()
+
+    def reports(self, fingerprint, limit=None):
+        """Return the reports with fingerprint, newest first."""
+        texts = []
+        for entry in self.entries(fingerprint, limit=limit):
+            text = self.read(entry)
+            if text is not None:
+                texts.append(text)
+        return texts
+
+    def excepthook(self, etype, value, tb):
+        """Record the exception, then pass it on to sys.__excepthook__."""
+        try:
+            self.record(etype, value, tb)
+        except (IOError, OSError):
+            pass
+        sys.__excepthook__(etype, value, tb)
+
+
+def _one_line(value):
+    return str(value).replace('\n', '\\n')
+
+
+def _lock_file(f):
+    """Lock f exclusively until it is closed (where fcntl exists)."""
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        except (IOError, OSError):
+            pass
+
+
+def main(argv=None):
+    """Command line interface, see the module docstring."""
+    import getopt
+    if argv is None:
+        argv = sys.argv[1:]
+    usage = 'usage: crashstore [-n count] [-t type] DIR ' \
+            '[list | groups | show FINGERPRINT]'
+    try:
+        opts, args = getopt.getopt(argv, 'n:t:h')
+    except getopt.GetoptError, msg:
+        print >> sys.stderr, msg
+        print >> sys.stderr, usage
+        return 2
+    limit = etype = None
+    for opt, arg in opts:
+        if opt == '-n':
+            limit = int(arg)
+        elif opt == '-t':
+            etype = arg
+        else:
+            print usage
+            return 0
+    if not args or not os.path.isdir(args[0]):
+        print >> sys.stderr, usage
+        return 2
+    store = CrashStore(args[0])
+    command = args[1:2] and args[1] or 'list'
+    if command == 'list':
+        for entry in store.entries(etype=etype, limit=limit):
+            print '%s  %s  %s' % (time.strftime('%Y-%m-%d %H:%M:%S',
+                                                time.localtime(entry.timestamp)),
+                                  entry.fingerprint, entry.etype)
+    elif command == 'groups':
+        groups = store.groups().items()
+        groups.sort(key=lambda item: -item[1][0])
+        for key, (count, group_type, last) in groups:
+            if etype is None or group_type == etype:
+                print '%6d  %s  %s  (last %s)' % (count, key, group_type,
+                                                  time.ctime(last))
+    elif command == 'show' and len(args) == 3:
+        texts = store.reports(args[2], limit=limit or 1)
+        if not texts:
+            print >> sys.stderr, 'No report with fingerprint %s' % args[2]
+            return 1
+        sys.stdout.write(''.join(texts))
+    else:
+        print >> sys.stderr, usage
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Last-resort traceback printing, for when memory has run out.
+
+The regular formatters build lists of frames, reprs and one big string for
+the whole traceback; when the error being reported is a MemoryError, or
+memory runs out halfway through formatting, they fail themselves and the
+original error is lost.  This module keeps, from import time on:
+
+  - a ballast block, released before anything else is done, so the rest of
+    the report has some memory to work with;
+  - a fixed output buffer, filled in place and written straight to a file
+    descriptor with os.write, bypassing the file objects.
+
+The traceback is rendered in Plain mode only, without colors, and source
+lines are shown only when linecache already holds them: nothing is read
+from disk.  The ballast is allocated again once the report is written.
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['is_memory_error', 'report', 'render', 'release', 'rearm']
+
+import errno
+import linecache
+import os
+import threading
+
+# bytes set aside for the report, and the size of the output buffer
+RESERVE_SIZE = 256 * 1024
+BUFFER_SIZE = 8 * 1024
+
+_ballast = [None]
+_buffer = bytearray(BUFFER_SIZE)
+_lock = threading.Lock()
+
+
+def release():
+    """Free the ballast block."""
+    _ballast[0] = None
+
+
+def rearm():
+    """Allocate the ballast block again, if memory allows."""
+    if _ballast[0] is None:
+        try:
+            _ballast[0] = '\0' * RESERVE_SIZE
+        except MemoryError:
+            pass
+
+rearm()
+
+
+def is_memory_error(etype):
+    """Whether etype is MemoryError or one of its subclasses."""
+    try:
+        return issubclass(etype, MemoryError)
+    except TypeError:
+        # string exceptions, or None
+        return False
+
+
+def _write_fd(fd, data):
+    """os.write all of data to fd; give up silently on errors."""
+    while len(data):
+        try:
+            n = os.write(fd, data)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            return
+        data = buffer(data, n)
+
+
+def _write_stream(out, data):
+    """out.write(data); os.write to fd 2 if that fails."""
+    try:
+        out.write(str(data))
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except:
+        _write_fd(2, data)
+
+
+class _Writer(object):
+    """Fill the shared buffer, handing it to sink(data) when full."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.pos = 0
+
+    def write(self, s):
+        if isinstance(s, unicode):
+            s = s.encode('ascii', 'backslashreplace')
+        n = len(s)
+        if self.pos + n > BUFFER_SIZE:
+            self.flush()
+            if n > BUFFER_SIZE:
+                s = s[:BUFFER_SIZE - 4] + '...\n'
+                n = BUFFER_SIZE
+        _buffer[self.pos:self.pos + n] = s
+        self.pos += n
+
+    def flush(self):
+        if self.pos:
+            self.sink(buffer(_buffer, 0, self.pos))
+            self.pos = 0
+
+
+def _safe_str(value):
+    try:
+        return str(value)
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except:
+        return '<unprintable %s object>' % _type_name(value)
+
+
+def _type_name(obj):
+    try:
+        return type(obj).__name__
+    except:
+        return '?'
+
+
+def _render(write, etype, value, tb, tb_offset=0):
+    while tb is not None and tb_offset > 0:
+        tb = tb.tb_next
+        tb_offset -= 1
+    if tb is not None:
+        write('Traceback (most recent call last):\n')
+    cache = linecache.cache
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        filename = code.co_filename
+        lineno = tb.tb_lineno
+        write('  File "')
+        write(filename)
+        write('", line ')
+        write(str(lineno))
+        write(', in ')
+        write(code.co_name)
+        write('\n')
+        # only what linecache holds already: reading files allocates
+        entry = cache.get(filename)
+        if entry is not None and 0 < lineno <= len(entry[2]):
+            line = entry[2][lineno - 1]
+            if line.strip():
+                write('    ')
+                write(line.lstrip())
+                if not line.endswith('\n'):
+                    write('\n')
+        tb = tb.tb_next
+    if isinstance(etype, basestring):
+        name = etype
+    else:
+        name = getattr(etype, '__name__', None) or _safe_str(etype)
+    write(name)
+    text = _safe_str(value)
+    if text:
+        write(': ')
+        write(text)
+    write('\n')
+
+
+def report(etype, value, tb, out=None, tb_offset=0):
+    """Write a Plain traceback to the file descriptor of out (fd 2 by default).
+
+    Streams without a file descriptor (StringIO, logging streams...) are
+    written to with their write method instead.  Never raises: this is what
+    is left when everything else has failed."""
+    release()
+    _lock.acquire()
+    try:
+        try:
+            fd = 2
+            if out is not None:
+                try:
+                    out.flush()
+                except:
+                    pass
+                try:
+                    fd = out.fileno()
+                except:
+                    fd = None
+            if fd is None:
+                sink = lambda data, out=out: _write_stream(out, data)
+            else:
+                sink = lambda data, fd=fd: _write_fd(fd, data)
+            writer = _Writer(sink)
+            try:
+                _render(writer.write, etype, value, tb, tb_offset)
+            finally:
+                writer.flush()
+                if fd is None:
+                    try:
+                        out.flush()
+                    except:
+                        pass
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            pass
+    finally:
+        _lock.release()
+        rearm()
+
+
+def render(etype, value, tb, tb_offset=0):
+    """Return a Plain traceback, built with as few allocations as possible.
+
+    For callers which need the text itself, like the text() methods."""
+    release()
+    _lock.acquire()
+    try:
+        chunks = []
+        writer = _Writer(lambda data: chunks.append(str(data)))
+        try:
+            _render(writer.write, etype, value, tb, tb_offset)
+        except MemoryError:
+            writer.write('\n[... traceback truncated: out of memory ...]\n')
+        writer.flush()
+        # the last newline is added by whoever prints the text
+        return ''.join(chunks)[:-1]
+    finally:
+        _lock.release()
+        rearm()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Predicates deciding which frames the tracebacks leave out.
+
+tb_offset can only drop the topmost frames.  In deep framework stacks most
+frames belong to the framework or to the standard library, and every one of
+them costs source reading, tokenizing and reprs in the verbose modes.  A
+FrameFilter tells, from the filename and module name of a frame, whether
+to hide it:
+
+    exclude_paths      filename prefixes (directories) of hidden frames
+    exclude_modules    glob patterns for the __name__ of the modules of
+                       hidden frames ('django.*' does not match 'django')
+    exclude_stdlib     hide the frames of the standard library (but not of
+                       the site-packages directories inside it)
+    include_paths,     frames matching these are always shown
+    include_modules
+
+Given includes but no excludes, everything but the included frames is
+hidden.  The patterns are compiled into a tuple of prefixes and a single
+regular expression, and the decision is remembered per filename and
+module, so the formatters can check each frame as they walk the traceback,
+before anything is extracted from it.  Consecutive hidden frames are shown
+as one summary line; the innermost frame, where the exception was raised,
+is always shown.
+
+Formatters take a FrameFilter in their frame_filter attribute:
+
+    tb = AutoFormattedTB(mode='Verbose')
+    tb.frame_filter = FrameFilter(exclude_modules=['django.*', 'werkzeug.*'],
+                                  exclude_stdlib=True)
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['FrameFilter', 'stdlib_prefixes']
+
+import os
+import sys
+
+import paths
+from capture import compile_globs
+
+# how many (filename, module) decisions are remembered before starting over
+MAX_CACHED = 2000
+
+
+def _prefixes(paths):
+    """The path prefixes as given and made absolute, with a trailing
+    separator so that /usr/lib doesn't match /usr/lib64."""
+    if isinstance(paths, basestring):
+        paths = [paths]
+    prefixes = []
+    for path in paths or ():
+        for prefix in (path, os.path.abspath(path)):
+            if not prefix.endswith(os.sep):
+                prefix += os.sep
+            if prefix not in prefixes:
+                prefixes.append(prefix)
+    return tuple(prefixes)
+
+
+def stdlib_prefixes():
+    """Return (stdlib, site) path prefixes: the directories of the standard
+    library, and the site-packages directories which may be inside them."""
+    stdlib = []
+    try:
+        import sysconfig
+        for key in ('stdlib', 'platstdlib'):
+            path = sysconfig.get_paths().get(key)
+            if path:
+                stdlib.append(path)
+    except ImportError:
+        from distutils import sysconfig
+        stdlib.append(sysconfig.get_python_lib(standard_lib=True))
+    # where os lives is the standard library, whatever the configuration
+    stdlib.append(os.path.dirname(os.path.abspath(os.__file__)))
+    site = [entry for entry in sys.path
+            if os.path.basename(entry.rstrip(os.sep)) in
+            ('site-packages', 'dist-packages')]
+    return _prefixes(stdlib), _prefixes(site)
+
+
+class FrameFilter(object):
+    """Which frames to hide; see the module docstring.
+
+    Calling the filter with the filename and module name of a frame returns
+    True if the frame is to be hidden."""
+
+    def __init__(self, exclude_paths=(), exclude_modules=(),
+                 include_paths=(), include_modules=(), exclude_stdlib=False):
+        self.exclude_paths = _prefixes(exclude_paths)
+        self.exclude_modules = compile_globs(exclude_modules)
+        self.include_paths = _prefixes(include_paths)
+        self.include_modules = compile_globs(include_modules)
+        self.stdlib = self.site = ()
+        if exclude_stdlib:
+            self.stdlib, self.site = stdlib_prefixes()
+        self._excludes = bool(self.exclude_paths or self.exclude_modules or
+                              self.stdlib)
+        self._includes = bool(self.include_paths or self.include_modules)
+        self._cache = {}
+
+    def __call__(self, filename, module=None):
+        key = (filename, module)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        path = filename or ''
+        if path and not path.startswith('<'):
+            # frames of scripts run from the current directory have relative
+            # filenames
+            path = paths.abspath(path)
+        hidden = self._hides(path, module or '')
+        if len(self._cache) >= MAX_CACHED:
+            self._cache.clear()
+        self._cache[key] = hidden
+        return hidden
+
+    def _hides(self, filename, module):
+        if (self.include_paths and filename.startswith(self.include_paths)) \
+               or (self.include_modules is not None and
+                   self.include_modules.match(module)):
+            return False
+        if not self._excludes:
+            return self._includes
+        if self.exclude_paths and filename.startswith(self.exclude_paths):
+            return True
+        if self.exclude_modules is not None and \
+               self.exclude_modules.match(module):
+            return True
+        if self.stdlib and filename.startswith(self.stdlib):
+            return not (self.site and filename.startswith(self.site))
+        return False
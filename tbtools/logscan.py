@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""Finding the distinct failures in logs full of tracebacks.
+
+parse() reads log lines as a stream and recovers the tracebacks in them,
+in the formats the formatters print:
+
+  - ListTB (Plain mode), which is also the standard Python format:
+    'Traceback (most recent call last):', '  File "f.py", line 3, in g'
+    entries and the exception line;
+  - VerboseTB (Context and Verbose modes, short or long header): a line of
+    dashes, the header, a 'f.py in g(...)' line and the '---->' marked line
+    for each frame, and the exception line;
+  - the verbose SyntaxTB report and the tracebacks without entries.
+
+The '[... ...]' lines standing for hidden frames or marking where a report
+degraded are skipped, so that a failure has the same fingerprint whatever
+the mode, the frame filter and the budgets it was printed with.
+
+Color escapes are ignored, and so is a prefix (timestamp, logger name...)
+in front of the lines, provided all the lines of a traceback have the same
+prefix as its first one.
+
+Each traceback comes out as a Traceback with its exception type, message
+and frames (filename, line number, function).  A Grouper clusters them by
+fingerprint, computed as crashstore.fingerprint() does from the exception
+type and the file and function of the frames, but not the line numbers: the
+same failure is one group before and after unrelated edits to its files.
+
+Lines are looked at one at a time and only the frames of the traceback
+being read are kept, besides one sample per group, so memory stays bounded
+whatever the size of the logs; lines which can't start a traceback are
+skipped with a substring test.  Logs ending in .gz are decompressed on the
+fly.
+
+From the command line (installed as the tblogscan script too):
+
+    python -m tbtools.logscan [-n top] [-v] LOG...
+    python -m tbtools.logscan -d OLDLOG NEWLOG
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['Traceback', 'Grouper', 'parse', 'scan', 'main']
+
+import re
+import sys
+
+from crashstore import fingerprint
+
+_ESCAPES = re.compile('\x1b\\[[0-9;]*m')
+_LIST_HEAD = 'Traceback (most recent call last):'
+_FILE = re.compile(r'\s*File "(.*)", line (\d+)(?:, in (.*))?$')
+_MARKED = re.compile(r'-+>\s*(\d+)')
+_FRAME = re.compile(r'(\S.*?) in ([^\s(]+)')
+# CapWords exception names, possibly dotted, alone or followed by ': msg'
+_EXCEPTION = re.compile(r'((?:[A-Za-z_]\w*\.)*[A-Z_]\w*)(?:: ?(.*))?$')
+
+# tracebacks longer than this many lines are dropped
+MAX_LINES = 100000
+
+_IDLE, _LIST, _VERBOSE, _BARE = range(4)
+
+
+class Traceback(object):
+    """A traceback recovered from a log.
+
+    frames holds (filename, lineno, name) tuples, outermost first; lineno
+    is None where the log doesn't show it.  source is the name of the log,
+    and line the number of the line the traceback starts at."""
+
+    def __init__(self, source=None, line=None):
+        self.source = source
+        self.line = line
+        self.etype = None
+        self.message = ''
+        self.frames = []
+
+    def short_type(self):
+        """The exception type without its module."""
+        return (self.etype or '?').split('.')[-1]
+
+    def fingerprint(self):
+        return fingerprint(self.short_type(),
+                           [(f, name) for f, lineno, name in self.frames])
+
+    def __repr__(self):
+        return '<Traceback %s with %d frames at %s:%s>' % \
+               (self.etype, len(self.frames), self.source, self.line)
+
+
+def _start(line):
+    """Return (state, prefix) if line starts a traceback, else None."""
+    if '\x1b' in line:
+        line = _ESCAPES.sub('', line)
+    line = line.rstrip()
+    if line.endswith(_LIST_HEAD):
+        return _LIST, len(line) - len(_LIST_HEAD)
+    at = line.find('-' * 60)
+    if at < 0 or line[at:].strip('-'):
+        return None
+    return len(line) - at >= 75 and _VERBOSE or _BARE, at
+
+
+def parse(lines, source=None):
+    """Yield the Tracebacks found in the iterable of lines."""
+    state = _IDLE
+    current = None
+    prefix = 0
+    count = 0
+    lineno = 0
+    for raw in lines:
+        lineno += 1
+        if state == _IDLE:
+            # the quick test all the lines of the log go through
+            if 'Traceback' not in raw and '------' not in raw:
+                continue
+            started = _start(raw)
+            if started is not None:
+                state, prefix = started
+                current = Traceback(source, lineno)
+                count = 0
+            continue
+
+        count += 1
+        if count > MAX_LINES:
+            state = _IDLE
+            continue
+        if 'Traceback' in raw or '------' in raw:
+            # a traceback cut short by the next one
+            started = _start(raw)
+            if started is not None:
+                state, prefix = started
+                current = Traceback(source, lineno)
+                count = 0
+                continue
+        line = raw
+        if '\x1b' in line:
+            line = _ESCAPES.sub('', line)
+        line = line[prefix:].rstrip()
+        if state == _LIST:
+            match = _FILE.match(line)
+            if match:
+                filename, number, name = match.groups()
+                if name is not None:
+                    current.frames.append((filename, int(number), name))
+                continue
+            if not line or line[0].isspace():
+                continue
+        elif state == _VERBOSE:
+            if count == 1:
+                # the header: type, then 'Traceback...' or the Python version
+                fields = line.split()
+                current.etype = fields and fields[0] or None
+                continue
+            if not line or line.startswith('A problem occured') or \
+                   line.startswith('calls leading up to the error'):
+                continue
+            match = _MARKED.match(line)
+            if match:
+                if current.frames and current.frames[-1][1] is None:
+                    filename, number, name = current.frames[-1]
+                    current.frames[-1] = (filename, int(match.group(1)), name)
+                continue
+            match = _FILE.match(line)
+            if match:
+                # frames rendered cheaply under a budget
+                filename, number, name = match.groups()
+                current.frames.append((filename, int(number), name or '?'))
+                continue
+            if line[0].isspace():
+                continue
+            if line.startswith('[...'):
+                # a run of hidden frames, or where the output degraded to
+                # stay within its budgets: not frames, and they vary with
+                # the filter and the load
+                continue
+            if not _EXCEPTION.match(line):
+                match = _FRAME.match(line)
+                if match:
+                    current.frames.append((match.group(1), None,
+                                           match.group(2)))
+                else:
+                    # verbose SyntaxTB: just the file name
+                    current.frames.append((line, None, '?'))
+                continue
+        elif state == _BARE:
+            if not line:
+                continue
+        # the exception line, which ends the traceback
+        state = _IDLE
+        match = _EXCEPTION.match(line)
+        if match is None:
+            continue
+        current.etype, current.message = match.group(1), match.group(2) or ''
+        yield current
+        current = None
+
+
+def _open(filename):
+    if filename == '-':
+        return sys.stdin
+    if filename.endswith('.gz'):
+        import gzip
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb', 1024 * 1024)
+
+
+def scan(filenames, grouper=None):
+    """Parse the log files and add their tracebacks to grouper (a new
+    Grouper by default), which is returned."""
+    if grouper is None:
+        grouper = Grouper()
+    for filename in filenames:
+        f = _open(filename)
+        try:
+            for tb in parse(f, filename):
+                grouper.add(tb)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    return grouper
+
+
+class Group(object):
+    """The tracebacks sharing a fingerprint: their count and first one."""
+
+    __slots__ = ('fingerprint', 'count', 'sample', 'last')
+
+    def __init__(self, fingerprint, sample):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.sample = sample
+        self.last = sample
+
+
+class Grouper(object):
+    """Clusters of tracebacks by fingerprint."""
+
+    def __init__(self):
+        self.groups = {}
+        self.total = 0
+
+    def add(self, tb):
+        key = tb.fingerprint()
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = Group(key, tb)
+        group.count += 1
+        # only where it was seen last is kept, not the frames
+        group.last = (tb.source, tb.line)
+        self.total += 1
+
+    def sorted(self):
+        """The groups, biggest first."""
+        groups = self.groups.values()
+        groups.sort(key=lambda g: (-g.count, g.fingerprint))
+        return groups
+
+    def format(self, top=None, verbose=False):
+        """Return a report of the groups: count, fingerprint, exception and
+        innermost frame of each, with all the frames if verbose."""
+        lines = ['%d tracebacks, %d distinct' % (self.total,
+                                                 len(self.groups))]
+        for group in self.sorted()[:top]:
+            lines.append(_format_group(group, verbose))
+        return '\n'.join(lines)
+
+
+def _format_group(group, verbose=False, count=None):
+    sample = group.sample
+    if count is None:
+        count = '%7d' % group.count
+    where = ''
+    if sample.frames:
+        filename, lineno, name = sample.frames[-1]
+        where = ' at %s:%s in %s' % (filename, lineno or '?', name)
+    text = '%s  %s  %s: %s%s' % (count, group.fingerprint, sample.etype,
+                                 sample.message[:80], where)
+    if verbose:
+        text += '\n         first seen at %s:%s' % (sample.source,
+                                                   sample.line)
+        for filename, lineno, name in sample.frames:
+            text += '\n           %s:%s in %s' % (filename, lineno or '?',
+                                                  name)
+    return text
+
+
+def diff(old, new):
+    """Compare two Groupers; return the lines describing the groups which
+    appeared, disappeared or changed count from old to new."""
+    lines = []
+    for group in new.sorted():
+        before = old.groups.get(group.fingerprint)
+        if before is None:
+            lines.append(_format_group(group, count='new %7d' % group.count))
+        elif before.count != group.count:
+            lines.append(_format_group(group, count='%+11d' %
+                                       (group.count - before.count)))
+    for group in old.sorted():
+        if group.fingerprint not in new.groups:
+            lines.append(_format_group(group, count='gone%7d' % group.count))
+    return lines
+
+
+def main(argv=None):
+    """Command line interface, see the module docstring."""
+    import getopt
+    if argv is None:
+        argv = sys.argv[1:]
+    usage = 'usage: logscan [-n top] [-v] LOG...\n' \
+            '       logscan -d OLDLOG NEWLOG'
+    try:
+        opts, args = getopt.getopt(argv, 'n:vdh')
+    except getopt.GetoptError, msg:
+        print >> sys.stderr, msg
+        print >> sys.stderr, usage
+        return 2
+    top = None
+    verbose = compare = False
+    for opt, arg in opts:
+        if opt == '-n':
+            top = int(arg)
+        elif opt == '-v':
+            verbose = True
+        elif opt == '-d':
+            compare = True
+        else:
+            print usage
+            return 0
+    if not args or (compare and len(args) != 2):
+        print >> sys.stderr, usage
+        return 2
+    if compare:
+        for line in diff(scan(args[:1]), scan(args[1:])):
+            print line
+    else:
+        print scan(args).format(top, verbose)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
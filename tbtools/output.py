@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Write-combining output for tracebacks, source listings and the debugger.
+
+sys.stderr is unbuffered, and so are many pipes and sockets tracebacks end
+up in: every write() is a system call.  Colorizing source writes up to three
+times per token and print statements write their newline separately, which
+adds up to thousands of tiny writes per traceback or listing.
+
+write_unit() hands a whole logical unit (a traceback, a stack entry, a
+listing) to the stream in a single write (plus one for its final newline)
+and flushes it; BufferedWriter collects the many small writes of a
+producer like PyColorize.Parser and passes them on in large chunks.
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['BufferedWriter', 'write_unit']
+
+# flush a BufferedWriter once it holds this many characters
+CHUNK_SIZE = 64 * 1024
+
+
+def _flush(out):
+    try:
+        flush = out.flush
+    except AttributeError:
+        return
+    flush()
+
+
+def write_unit(out, *pieces):
+    """Write the concatenation of pieces to out, then flush it once.
+
+    write_unit(out, text, '\\n') replaces print >>out, text.  A trailing
+    newline is written on its own rather than copying a whole traceback to
+    append it; the other pieces go in a single write.  Like print, it first
+    writes the space a print ending with a comma left pending, and leaves
+    none pending (out.softspace)."""
+    if getattr(out, 'softspace', 0):
+        out.write(' ')
+    newline = pieces and pieces[-1] == '\n'
+    if newline:
+        pieces = pieces[:-1]
+    if len(pieces) == 1:
+        out.write(pieces[0])
+    elif pieces:
+        out.write(''.join(pieces))
+    if newline:
+        out.write('\n')
+    try:
+        out.softspace = 0
+    except (AttributeError, TypeError):
+        pass
+    _flush(out)
+
+
+class BufferedWriter(object):
+    """File-like object collecting writes for another stream.
+
+    The data is passed on when chunk_size characters have been collected and
+    on flush(); other attributes (isatty, encoding, ...) are those of the
+    wrapped stream."""
+
+    def __init__(self, out, chunk_size=None):
+        self.out = out
+        self.chunk_size = chunk_size or CHUNK_SIZE
+        self.softspace = 0
+        self._chunks = []
+        self._size = 0
+
+    def write(self, s):
+        self._chunks.append(s)
+        self._size += len(s)
+        if self._size >= self.chunk_size:
+            self._send()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def _send(self):
+        if self._chunks:
+            data = ''.join(self._chunks)
+            self._chunks = []
+            self._size = 0
+            self.out.write(data)
+
+    def flush(self):
+        self._send()
+        _flush(self.out)
+
+    def __getattr__(self, name):
+        if name == 'out':
+            raise AttributeError(name)
+        return getattr(self.out, name)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Canonical and display forms of the filenames shown by the formatters.
+
+Every frame of every traceback has its filename made absolute, and the
+debugger canonicalizes the filename of every stack entry and breakpoint
+check: the same handful of paths, normalized over and over.  The functions
+here remember their results, in bounded tables shared by all the
+formatters and debuggers of the process:
+
+    abspath(filename)    os.path.abspath, and filename itself if that fails
+    canonic(filename)    what bdb.Bdb.canonic computes: the normalized
+                         absolute path, with '<string>'-like names kept
+    shorten(filename)    the path with the longest site-packages (or
+                         dist-packages) directory on sys.path replaced by
+                         its last component: site-packages/pkg/mod.py
+
+Relative filenames depend on the current directory, which is part of their
+key: looking them up costs an os.getcwd() call, where absolute filenames
+cost a single dictionary lookup.  The site directories are looked up once,
+the first time shorten() is called; set_site_dirs() changes them.
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['abspath', 'canonic', 'shorten', 'display', 'set_site_dirs',
+           'clear']
+
+import os
+import sys
+
+# how many filenames each table holds before it starts over
+MAX_CACHED = 1000
+
+_abspaths = {}
+_canonics = {}
+_short = {}
+# (prefix with a trailing separator, what replaces it), longest first
+_site_dirs = []
+_site_dirs_known = [False]
+
+
+def _key(filename):
+    if os.path.isabs(filename):
+        return filename
+    try:
+        return (os.getcwd(), filename)
+    except OSError:
+        return (None, filename)
+
+
+def _remember(cache, key, value):
+    if len(cache) >= MAX_CACHED:
+        cache.clear()
+    cache[key] = value
+
+
+def abspath(filename):
+    """The absolute path of filename; '?' if it is empty."""
+    if not filename:
+        return '?'
+    # absolute filenames are their own key: a hit costs no os call
+    try:
+        return _abspaths[filename]
+    except KeyError:
+        pass
+    key = _key(filename)
+    if key is not filename:
+        try:
+            return _abspaths[key]
+        except KeyError:
+            pass
+    try:
+        path = os.path.abspath(filename)
+    except OSError:
+        # if file is '<console>' or something not in the filesystem, the
+        # abspath call will throw an OSError: keep the original name
+        path = filename
+    _remember(_abspaths, key, path)
+    return path
+
+
+def canonic(filename):
+    """The canonical form of filename, as bdb.Bdb.canonic computes it."""
+    # absolute and '<string>'-like filenames are their own key: a hit costs
+    # no os call
+    try:
+        return _canonics[filename]
+    except KeyError:
+        pass
+    if filename == "<" + filename[1:-1] + ">":
+        _remember(_canonics, filename, filename)
+        return filename
+    key = _key(filename)
+    if key is not filename:
+        try:
+            return _canonics[key]
+        except KeyError:
+            pass
+    path = os.path.normcase(os.path.abspath(filename))
+    _remember(_canonics, key, path)
+    return path
+
+
+def _find_site_dirs():
+    dirs = []
+    for entry in sys.path:
+        if entry and os.path.basename(entry.rstrip(os.sep)) in \
+               ('site-packages', 'dist-packages'):
+            dirs.append(entry)
+    return dirs
+
+
+def set_site_dirs(dirs=None):
+    """Set the directories shorten() strips; by default, the site-packages
+    and dist-packages directories on sys.path."""
+    if dirs is None:
+        dirs = _find_site_dirs()
+    prefixes = []
+    for path in dirs:
+        path = os.path.abspath(path).rstrip(os.sep)
+        prefixes.append((path + os.sep, os.path.basename(path) + os.sep))
+    prefixes.sort(key=lambda p: -len(p[0]))
+    _site_dirs[:] = prefixes
+    _site_dirs_known[0] = True
+    _short.clear()
+
+
+def shorten(filename):
+    """filename (absolute) with its site directory cut short."""
+    try:
+        return _short[filename]
+    except KeyError:
+        pass
+    if not _site_dirs_known[0]:
+        set_site_dirs()
+    short = filename
+    for prefix, replacement in _site_dirs:
+        if filename.startswith(prefix):
+            short = replacement + filename[len(prefix):]
+            break
+    _remember(_short, filename, short)
+    return short
+
+
+def display(filename, short=False):
+    """The absolute path of filename, shortened if short is true."""
+    path = abspath(filename)
+    if short:
+        return shorten(path)
+    return path
+
+
+def clear():
+    """Forget every filename."""
+    _abspaths.clear()
+    _canonics.clear()
+    _short.clear()
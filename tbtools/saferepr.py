@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Bounded, time-limited repr for debugger and traceback displays.
+
+The stdlib repr module caps the size of containers and strings, but hands
+any other object to its own __repr__, which may take arbitrarily long (think
+of a huge array or a lazy database proxy).  SafeRepr adds a wall-clock budget
+on top of the usual limits: on the main thread of a POSIX system a
+SIGALRM-based timer interrupts a repr that runs over, and a placeholder is
+shown instead.
+
+ReprCache keeps the reprs computed for one debugger stop, so moving up and
+down the stack doesn't recompute expensive reprs.
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['ReprTimeout', 'SafeRepr', 'ReprCache', 'default']
+
+import __builtin__
+import repr
+import signal
+
+
+class ReprTimeout(Exception):
+    """Raised inside a repr which ran over its time budget."""
+
+
+def _raise_timeout(signum, frame):
+    raise ReprTimeout
+
+
+def _type_name(obj):
+    try:
+        return type(obj).__name__
+    except:
+        return '?'
+
+
+class SafeRepr(repr.Repr):
+    """repr.Repr with configurable limits and a time budget.
+
+    All the limits of repr.Repr (maxlevel, maxtuple, maxlist, maxarray,
+    maxdict, maxset, maxfrozenset, maxdeque, maxstring, maxlong, maxother)
+    can be given as keyword arguments.  time_budget is the number of seconds
+    a single safe_repr() call may take; 0 or None disables the timer."""
+
+    def __init__(self, time_budget=0.5, **limits):
+        repr.Repr.__init__(self)
+        self.time_budget = time_budget
+        for name, value in limits.items():
+            if not hasattr(self, name):
+                raise TypeError, 'unknown repr limit: %s' % name
+            setattr(self, name, value)
+
+    def repr1(self, x, level):
+        typename = type(x).__name__
+        if ' ' in typename:
+            typename = '_'.join(typename.split())
+        method = getattr(self, 'repr_' + typename, None)
+        if method is not None:
+            return method(x, level)
+        # repr.Repr calls the builtin repr directly here, unguarded and
+        # untruncated: go through repr_instance instead
+        return self.repr_instance(x, level)
+
+    def repr_instance(self, x, level):
+        try:
+            s = __builtin__.repr(x)
+        except (KeyboardInterrupt, ReprTimeout):
+            raise
+        except:
+            # Bugs in x.__repr__() can cause arbitrary exceptions -- then
+            # make up something
+            return '<%s instance at %x>' % (_type_name(x), id(x))
+        if len(s) > self.maxother:
+            i = max(0, (self.maxother-3)//2)
+            j = max(0, self.maxother-3-i)
+            s = s[:i] + '...' + s[len(s)-j:]
+        return s
+
+    def safe_repr(self, obj):
+        """Return a bounded repr of obj.
+
+        This never raises, except for KeyboardInterrupt: failing reprs and
+        reprs which exceed the time budget give a placeholder string."""
+        old_handler = self._start_timer()
+        try:
+            try:
+                try:
+                    return self.repr(obj)
+                finally:
+                    if old_handler is not None:
+                        signal.setitimer(signal.ITIMER_REAL, 0)
+            except ReprTimeout:
+                return '<%s object: repr timed out>' % _type_name(obj)
+            except KeyboardInterrupt:
+                raise
+            except:
+                return '<%s object: repr failed>' % _type_name(obj)
+        finally:
+            if old_handler is not None:
+                signal.signal(signal.SIGALRM, old_handler[0])
+
+    def _start_timer(self):
+        """Arm the SIGALRM timer, if it's possible and nobody else uses it.
+
+        Return a 1-tuple holding the previous handler, or None."""
+        if not self.time_budget or not hasattr(signal, 'setitimer'):
+            return None
+        if signal.getsignal(signal.SIGALRM) not in (signal.SIG_DFL,
+                                                    signal.SIG_IGN):
+            # somebody else's handler, or a SafeRepr further up the stack
+            return None
+        if signal.getitimer(signal.ITIMER_REAL)[0]:
+            return None
+        try:
+            old = signal.signal(signal.SIGALRM, _raise_timeout)
+        except ValueError:
+            # signals only work in the main thread
+            return None
+        signal.setitimer(signal.ITIMER_REAL, self.time_budget)
+        return (old,)
+
+
+class ReprCache(object):
+    """Reprs of the values shown at one debugger stop.
+
+    Results are keyed by (frame, id(value)); the values are kept alive along
+    with their repr, so an id can't be reused while the cache holds it.
+    Call clear() when the stop is over."""
+
+    def __init__(self, engine=None):
+        if engine is None:
+            engine = default
+        self.engine = engine
+        self._cache = {}
+
+    def repr(self, frame, value):
+        key = (frame, id(value))
+        try:
+            return self._cache[key][1]
+        except KeyError:
+            text = self.engine.safe_repr(value)
+            self._cache[key] = (value, text)
+            return text
+
+    def clear(self):
+        self._cache.clear()
+
+
+# The engine shared by every ReprCache created without one (the debugger's
+# among them).  Tune it by setting its attributes, for instance
+# saferepr.default.time_budget = 2
+default = SafeRepr()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Source line offsets and name indexes shared by all the processes of a host.
+
+In a prefork server every worker warms up its own caches: the first
+tracebacks going through a library make each worker read its sources and
+parse them for the names VerboseTB shows.  With the shared cache enabled,
+the first process to need them writes them to a cache directory:
+
+  <key>.lines   the offset of every line of the source, as raw integers
+                behind a small header; the file is memory-mapped and read
+                in place, so its pages are shared too
+  <hash>.names  the table of a sourceindex.SourceIndex, marshalled
+
+where the key is derived from the path, size and mtime of the source, and
+the hash is that of the source text the table was built from (the key, for
+a memory-mapped file), so an edited file simply gets new entries.  A
+process maps at most MAX_MAPPED .lines files at a time.  While the cache is
+enabled, sources serves every regular file from a memory map of it
+(instead of through linecache), and sourceindex loads the name tables
+instead of parsing.
+
+The cache is off unless enable() is called, or TBTOOLS_CACHE_DIR is set in
+the environment when this module is imported; the directory must belong to
+the user and be writable by them only.  Files are written to a
+temporary name and renamed into place, so readers never see partial entries;
+any failure to read or write the cache just means doing the work locally.
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['enable', 'disable', 'enabled', 'clear', 'file_key',
+           'get_offsets', 'put_offsets', 'get_names', 'put_names']
+
+import errno
+import marshal
+import os
+import stat
+import struct
+import tempfile
+from array import array
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+_MAGIC = 'TBLC'
+_VERSION = 1
+# magic, version, typecode of the offsets, their item size, their count
+_HEADER = struct.Struct('=4sHcBI')
+_TYPECODE = 'l'
+_ITEMSIZE = array(_TYPECODE).itemsize
+
+# how many .lines files a process keeps mapped before starting over
+MAX_MAPPED = 200
+
+# the cache directory, or None when the cache is disabled
+_directory = [None]
+# key -> _Offsets for the .lines files mapped by this process
+_mapped = {}
+
+
+def enable(directory=None):
+    """Turn the shared cache on, storing it in directory.
+
+    The default is $TBTOOLS_CACHE_DIR, or tbtools/ in $XDG_CACHE_HOME
+    (~/.cache).  The cache entries are unmarshalled, which is not safe
+    against crafted files: unless the directory belongs to the user and
+    nobody else can write to it, OSError is raised and the cache stays
+    off."""
+    if directory is None:
+        directory = os.environ.get('TBTOOLS_CACHE_DIR')
+    if directory is None:
+        base = os.environ.get('XDG_CACHE_HOME') or \
+               os.path.join(os.path.expanduser('~'), '.cache')
+        directory = os.path.join(base, 'tbtools')
+    _directory[0] = None
+    _mapped.clear()
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0700)
+    _check_private(directory)
+    _directory[0] = directory
+
+
+def _check_private(directory):
+    """Raise OSError unless directory is a directory of the user, not a
+    symbolic link, and writable by nobody else."""
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError(errno.ENOTDIR, 'cache directory is not a directory',
+                      directory)
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        raise OSError(errno.EPERM, 'cache directory belongs to another user',
+                      directory)
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise OSError(errno.EPERM, 'cache directory is writable by others',
+                      directory)
+
+
+def disable():
+    """Turn the shared cache off."""
+    _directory[0] = None
+    _mapped.clear()
+
+
+def enabled():
+    return mmap is not None and _directory[0] is not None
+
+
+def clear():
+    """Remove every entry from the cache directory."""
+    directory = _directory[0]
+    if directory is None:
+        return
+    _mapped.clear()
+    for name in os.listdir(directory):
+        if name.endswith('.lines') or name.endswith('.names'):
+            try:
+                os.unlink(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def file_key(filename, st):
+    """The md5 digest standing for the contents of filename, from its path
+    and its os.stat result st: a new size or mtime gives a new key."""
+    key = '%s\0%d\0%r' % (os.path.abspath(filename), st.st_size, st.st_mtime)
+    return md5(key).digest()
+
+
+def _path(filename, st, suffix):
+    return os.path.join(_directory[0],
+                        file_key(filename, st).encode('hex') + suffix)
+
+
+def _write(path, data):
+    """Write data to path atomically."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+class _Offsets(object):
+    """Read-only sequence of the line offsets held in a mapped .lines file."""
+
+    def __init__(self, map, count):
+        self._map = map
+        self._count = count
+        self._unpack = struct.Struct('=' + _TYPECODE).unpack_from
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError('offset index out of range')
+        return self._unpack(self._map, _HEADER.size + i * _ITEMSIZE)[0]
+
+
+def get_offsets(filename, st):
+    """Return the line offsets of filename, as of os.stat result st.
+
+    The result is a sequence of integers: where each line starts, plus the
+    size of the file.  None if the cache is off or has no entry."""
+    if not enabled():
+        return None
+    path = _path(filename, st, '.lines')
+    try:
+        return _mapped[path]
+    except KeyError:
+        pass
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError, OSError):
+            return None
+    finally:
+        f.close()
+    if len(map) < _HEADER.size:
+        return None
+    magic, version, typecode, itemsize, count = _HEADER.unpack_from(map)
+    if (magic, version, typecode, itemsize) != \
+           (_MAGIC, _VERSION, _TYPECODE, _ITEMSIZE) or \
+           len(map) != _HEADER.size + count * itemsize:
+        return None
+    offsets = _Offsets(map, count)
+    if len(_mapped) >= MAX_MAPPED:
+        # the maps still in use stay open through their _Offsets
+        _mapped.clear()
+    _mapped[path] = offsets
+    return offsets
+
+
+def put_offsets(filename, st, offsets):
+    """Store the line offsets (an array of _TYPECODE) of filename."""
+    if not enabled():
+        return
+    header = _HEADER.pack(_MAGIC, _VERSION, _TYPECODE, _ITEMSIZE,
+                          len(offsets))
+    _write(_path(filename, st, '.lines'), header + offsets.tostring())
+
+
+def _names_path(digest):
+    return os.path.join(_directory[0], digest.encode('hex') + '.names')
+
+
+def get_names(digest):
+    """Return (found, table) for the name index table of the source text
+    whose md5 digest is given.
+
+    The table is None for sources which could not be parsed."""
+    if not enabled():
+        return False, None
+    try:
+        f = open(_names_path(digest), 'rb')
+    except IOError:
+        return False, None
+    try:
+        try:
+            version, table = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            return False, None
+    finally:
+        f.close()
+    if version != _VERSION:
+        return False, None
+    return True, table
+
+
+def put_names(digest, table):
+    """Store the name index table (or None) of the source text whose md5
+    digest is given."""
+    if not enabled():
+        return
+    _write(_names_path(digest), marshal.dumps((_VERSION, table)))
+
+
+if os.environ.get('TBTOOLS_CACHE_DIR'):
+    try:
+        enable()
+    except OSError:
+        pass
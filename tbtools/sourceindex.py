@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Per-file index of the statements and names found on each source line.
+
+VerboseTB shows the value of every name used on the line where an exception
+happened.  Tokenizing forward from that line stops at the first NEWLINE, so
+it misses most of a multi-line statement, and the work is redone for every
+frame of every traceback.  Here each file is parsed once into an AST, and
+every line is mapped to the statement it belongs to, together with the names
+and dotted attribute chains (self.conn.pool) that statement references.
+
+Indexes are keyed by a hash of the source text (of the path, size and
+mtime for memory-mapped files, see sources.MappedSource.digest), so
+reloaded or edited files get a fresh index while identical sources share
+one.  With the shared
+cache on (see sharedcache), the tables are also saved for, and loaded from,
+the other processes of the host.
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['SourceIndex', 'get_index', 'line_names']
+
+import sharedcache
+import sources
+
+try:
+    import ast
+except ImportError:
+    # python < 2.6: callers fall back to tokenizing
+    ast = None
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+# list fields of compound statements holding nested statements rather than
+# the expressions of the statement's own header (exec's 'body' is one of those)
+_BODY_FIELDS = ('body', 'orelse', 'handlers', 'finalbody')
+
+# how many indexes to keep (by filename and by source hash)
+MAX_CACHED = 200
+
+
+def _collect_names(node, out):
+    """Append (lineno, col, name) for the names and attribute chains in node.
+
+    Dotted chains rooted at a plain name are reported as one name
+    ('a.b.c'); any other attribute access is descended into."""
+    if isinstance(node, ast.Name):
+        out.append((node.lineno, node.col_offset, node.id))
+        return
+    if isinstance(node, ast.Attribute):
+        attrs = []
+        base = node
+        while isinstance(base, ast.Attribute):
+            attrs.append(base.attr)
+            base = base.value
+        if isinstance(base, ast.Name):
+            attrs.append(base.id)
+            attrs.reverse()
+            out.append((base.lineno, base.col_offset, '.'.join(attrs)))
+        else:
+            _collect_names(base, out)
+        return
+    for child in ast.iter_child_nodes(node):
+        _collect_names(child, out)
+
+
+class SourceIndex(object):
+    """Map line numbers of one source text to statements and names.
+
+    statement(lineno) gives the (first, last) line span of the statement
+    containing lineno, names(lineno) the names it references, in source
+    order and without duplicates.  For compound statements (if, for, def,
+    except, ...) only the header counts, and each decorator is a statement
+    of its own."""
+
+    def __init__(self, source, table=None):
+        # table is what a previous index's table() returned
+        if table is not None:
+            self._lines = table
+            return
+        # raises SyntaxError (or TypeError for NUL bytes) on bad sources
+        tree = compile(source, '<sourceindex>', 'exec', ast.PyCF_ONLY_AST)
+        self._lines = {}
+        self._visit_body(tree.body)
+
+    def table(self):
+        """The index as a dict of plain data, which marshal can store."""
+        return self._lines
+
+    def statement(self, lineno):
+        try:
+            return self._lines[lineno][:2]
+        except KeyError:
+            return None
+
+    def names(self, lineno):
+        try:
+            return self._lines[lineno][2]
+        except KeyError:
+            return None
+
+    def _visit_body(self, stmts):
+        for stmt in stmts:
+            header = []
+            decorators = []
+            bodies = []
+            for field in stmt._fields:
+                value = getattr(stmt, field, None)
+                if field in _BODY_FIELDS and isinstance(value, list):
+                    bodies.append(value)
+                elif field == 'decorator_list':
+                    decorators = value
+                elif isinstance(value, ast.AST):
+                    header.append(value)
+                elif isinstance(value, list):
+                    header.extend([v for v in value if isinstance(v, ast.AST)])
+            # decorators are applied by the def/class statement, so their
+            # names count there too
+            self._add(stmt.lineno, header, header + decorators)
+            for deco in decorators:
+                self._add(deco.lineno, [deco], [deco])
+            for body in bodies:
+                # except handlers look enough like statements
+                self._visit_body(body)
+
+    def _add(self, first, span_nodes, name_nodes):
+        last = first
+        for node in span_nodes:
+            for child in ast.walk(node):
+                lineno = getattr(child, 'lineno', 0)
+                if lineno > last:
+                    last = lineno
+        found = []
+        for node in name_nodes:
+            _collect_names(node, found)
+        found.sort()
+        names = []
+        seen = {}
+        for _, _, name in found:
+            if name not in seen:
+                seen[name] = None
+                names.append(name)
+        entry = (first, last, tuple(names))
+        for lineno in range(first, last + 1):
+            self._lines[lineno] = entry
+
+
+# filename -> (lines from the source providers, SourceIndex or None)
+_by_file = {}
+# source hash -> SourceIndex or None
+_by_hash = {}
+
+
+def _remember(cache, key, value):
+    if len(cache) >= MAX_CACHED:
+        cache.clear()
+    cache[key] = value
+
+
+def get_index(filename):
+    """Return the SourceIndex of a file, or None if it can't be parsed.
+
+    The source comes from the source providers, so the index follows the
+    same cache invalidation (sources.checkcache) as the rest of the
+    tracebacks."""
+    if ast is None:
+        return None
+    lines = sources.getlines(filename)
+    if not lines:
+        return None
+    try:
+        cached_lines, index = _by_file[filename]
+        if cached_lines is lines:
+            return index
+    except KeyError:
+        pass
+    # the tables are looked up by the lines in use here, which linecache
+    # may hold from an older version of the file; the providers' sources
+    # have a digest of their own, which doesn't copy their whole text
+    source = None
+    if isinstance(lines, sources.IndexedSource):
+        digest = lines.digest()
+    else:
+        source = ''.join(lines)
+        digest = md5(source).digest()
+    try:
+        index = _by_hash[digest]
+    except KeyError:
+        found, table = sharedcache.get_names(digest)
+        if found:
+            index = table is not None and SourceIndex(None, table) or None
+        else:
+            if source is None:
+                source = ''.join(lines)
+            try:
+                index = SourceIndex(source)
+            except Exception:
+                # SyntaxError, TypeError for NUL bytes, RuntimeError for too
+                # deeply nested code...  the caller will tokenize instead.
+                index = None
+            if filename[:1] != '<':
+                if index is None:
+                    sharedcache.put_names(digest, None)
+                else:
+                    sharedcache.put_names(digest, index.table())
+        _remember(_by_hash, digest, index)
+    _remember(_by_file, filename, (lines, index))
+    return index
+
+
+def line_names(filename, lineno):
+    """Names referenced by the statement at filename:lineno.
+
+    Return None when the file can't be indexed, so the caller can fall back
+    to something else."""
+    index = get_index(filename)
+    if index is None:
+        return None
+    names = index.names(lineno)
+    if names is None:
+        return ()
+    return names
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""Where tracebacks and the debugger get their source lines from.
+
+linecache reads every file it is asked about into a list of strings and
+keeps it, however little of it is shown: a five line context window of a
+huge generated module costs the whole module, in every process.  And
+without the module's globals at hand, it can't read sources which live in
+zip files (zipapps, eggs, zipimported packages).
+
+getlines(filename) returns a sequence of the lines of a file, which callers
+index and slice like the lists linecache returns:
+
+  - files linecache already holds come from linecache, at no extra cost;
+  - regular files of MMAP_THRESHOLD bytes or more are memory-mapped, with an
+    index of line offsets built in one pass: a slice only copies the lines
+    it covers, and the pages are shared with every other process mapping
+    the same file;
+  - paths running through a zip archive (/srv/app.pyz/pkg/mod.py) are read
+    from the archive through zipimport;
+  - code without a file ('<string-1>', '<generated>'...) comes from the
+    registry of sources handed to register() or compile_source(), where
+    the text is indexed like a mapped file.  '<string>' and '<stdin>',
+    which every plain exec or compile() uses, can't be registered: their
+    source would be shown for all the other code run under that name;
+  - everything else goes through linecache.getlines, as before.
+
+With the shared cache on (see sharedcache), every regular file is mapped,
+whatever its size, and the line offsets are taken from the cache, so that
+all the processes of a host share both the source pages and the work of
+indexing them.
+
+The registry is bounded: it keeps the last MAX_REGISTERED sources and at
+most REGISTRY_SIZE characters of them.  checkcache() drops the sources
+whose files changed, like linecache.checkcache(), which it also calls.
+Mapped files are checked for changes on every getlines() too: a file
+truncated in place while it is mapped must not be read past its new end.
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['IndexedSource', 'MappedSource', 'getlines', 'getline',
+           'checkcache', 'register', 'unregister', 'compile_source']
+
+import itertools
+import linecache
+import os
+import stat
+from array import array
+
+import sharedcache
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+try:
+    import zipimport
+except ImportError:
+    zipimport = None
+
+# files at least this big are memory-mapped instead of read in full
+MMAP_THRESHOLD = 256 * 1024
+
+# bounds of the registry of sources without a file
+MAX_REGISTERED = 100
+REGISTRY_SIZE = 16 * 1024 * 1024
+
+# filename -> (size, mtime, MappedSource)
+_mapped = {}
+# filename -> (archive, archive mtime, list of lines)
+_zipped = {}
+# name -> IndexedSource, and the names from the oldest to the newest
+_registered = {}
+_registered_order = []
+_registered_size = [0]
+# names shared by all the code compiled without a name of its own
+_SHARED_NAMES = frozenset(['<string>', '<stdin>'])
+# numbers the names compile_source() makes up
+_compiled = itertools.count(1)
+
+
+def _line_offsets(data):
+    """Where each line of data starts, and where the data ends."""
+    offsets = array('l', [0])
+    find = data.find
+    pos = find('\n')
+    while pos >= 0:
+        offsets.append(pos + 1)
+        pos = find('\n', pos + 1)
+    if offsets[-1] != len(data):
+        offsets.append(len(data))
+    return offsets
+
+
+class IndexedSource(object):
+    """The lines of a string or buffer, as a read-only sequence.
+
+    Indexing and slicing give lines (with their newline, which is added to
+    an unterminated last line, as linecache does), copied out of data only
+    when asked for, through an index of line offsets."""
+
+    def __init__(self, data, offsets=None):
+        self._map = data
+        # offsets[i] is where line i starts; the last one is the end
+        if offsets is None:
+            offsets = _line_offsets(data)
+        self._offsets = offsets
+        self._count = len(offsets) - 1
+
+    def __len__(self):
+        return self._count
+
+    def _line(self, i):
+        line = self._map[self._offsets[i]:self._offsets[i + 1]]
+        if not line.endswith('\n'):
+            line += '\n'
+        return line
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._count)
+            return [self._line(i) for i in range(start, stop, step)]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('line index out of range')
+        return self._line(index)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def digest(self):
+        """The md5 digest of the text, without copying it."""
+        return md5(self._map).digest()
+
+
+class MappedSource(IndexedSource):
+    """The lines of a memory-mapped file.  st is the os.stat result the
+    file is mapped as."""
+
+    def __init__(self, filename, st):
+        f = open(filename, 'rb')
+        try:
+            map = mmap.mmap(f.fileno(), st.st_size, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        offsets = sharedcache.get_offsets(filename, st)
+        if offsets is None:
+            offsets = _line_offsets(map)
+            sharedcache.put_offsets(filename, st, offsets)
+        IndexedSource.__init__(self, map, offsets)
+        self._key = sharedcache.file_key(filename, st)
+
+    def digest(self):
+        """The sharedcache key of the file as mapped, which doesn't read
+        the file at all."""
+        return self._key
+
+
+def register(name, text):
+    """Make text the source of name, a filename like '<generated>' given to
+    compile().
+
+    name must be unique to text: ValueError is raised for '<string>' and
+    '<stdin>'.  The oldest sources are forgotten when the registry grows
+    beyond its bounds."""
+    if name in _SHARED_NAMES:
+        raise ValueError('%s is shared by all unnamed code, '
+                         'register the source under a name of its own'
+                         % name)
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    unregister(name)
+    _registered[name] = IndexedSource(text)
+    _registered_order.append(name)
+    _registered_size[0] += len(text)
+    while len(_registered_order) > 1 and \
+              (len(_registered_order) > MAX_REGISTERED or
+               _registered_size[0] > REGISTRY_SIZE):
+        unregister(_registered_order[0])
+
+
+def unregister(name):
+    """Forget the registered source of name, if any."""
+    source = _registered.pop(name, None)
+    if source is not None:
+        _registered_order.remove(name)
+        _registered_size[0] -= len(source._map)
+
+
+def compile_source(source, filename=None, mode='exec', flags=0,
+                   dont_inherit=0):
+    """compile(), registering the source first, so that tracebacks and
+    syntax errors can show its lines.
+
+    Without a filename the code is named '<string-N>', N counting the
+    calls."""
+    if filename is None:
+        filename = '<string-%d>' % _compiled.next()
+    register(filename, source)
+    return compile(source, filename, mode, flags, dont_inherit)
+
+
+def _split_zip_path(filename):
+    """Return (archive, member) if filename runs through a zip file."""
+    archive = filename
+    while 1:
+        head, tail = os.path.split(archive)
+        if not tail or head == archive:
+            return None
+        archive = head
+        if os.path.isfile(archive):
+            return archive, filename[len(archive):].lstrip(os.sep)
+
+
+def _zip_lines(filename):
+    split = _split_zip_path(filename)
+    if split is None:
+        return []
+    archive, member = split
+    try:
+        mtime = os.stat(archive).st_mtime
+        cached = _zipped.get(filename)
+        if cached is not None and cached[:2] == (archive, mtime):
+            return cached[2]
+        data = zipimport.zipimporter(archive).get_data(member)
+    except (IOError, OSError, zipimport.ZipImportError):
+        return []
+    lines = data.splitlines(True)
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+    _zipped[filename] = (archive, mtime, lines)
+    return lines
+
+
+def getlines(filename, module_globals=None):
+    """Return the lines of filename as an indexable, sliceable sequence.
+
+    The result is empty if the source can't be found."""
+    lines = linecache.cache.get(filename)
+    if lines is not None:
+        return lines[2]
+    if not filename:
+        return []
+    source = _registered.get(filename)
+    if source is not None:
+        return source
+    try:
+        st = os.stat(filename)
+    except (OSError, TypeError, ValueError):
+        st = None
+    if st is None:
+        if zipimport is not None and filename[:1] != '<':
+            lines = _zip_lines(filename)
+            if lines:
+                return lines
+    elif mmap is not None and stat.S_ISREG(st.st_mode) and st.st_size \
+             and (st.st_size >= MMAP_THRESHOLD or sharedcache.enabled()):
+        cached = _mapped.get(filename)
+        if cached is not None and cached[:2] == (st.st_size, st.st_mtime):
+            return cached[2]
+        try:
+            source = MappedSource(filename, st)
+        except (IOError, OSError, mmap.error):
+            pass
+        else:
+            _mapped[filename] = (st.st_size, st.st_mtime, source)
+            return source
+    return linecache.getlines(filename, module_globals)
+
+
+def getline(filename, lineno, module_globals=None):
+    """Return line number lineno of filename, or '' if there is none."""
+    lines = getlines(filename, module_globals)
+    if 1 <= lineno <= len(lines):
+        return lines[lineno - 1]
+    return ''
+
+
+def checkcache():
+    """Forget the sources whose file changed or disappeared."""
+    linecache.checkcache()
+    for filename, (size, mtime, source) in _mapped.items():
+        try:
+            st = os.stat(filename)
+        except OSError:
+            st = None
+        if st is None or (st.st_size, st.st_mtime) != (size, mtime):
+            # the map itself goes away with the last reference to it
+            del _mapped[filename]
+    for filename, (archive, mtime, lines) in _zipped.items():
+        try:
+            if os.stat(archive).st_mtime == mtime:
+                continue
+        except OSError:
+            pass
+        del _zipped[filename]
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Counters and timers for the cost of formatting tracebacks.
+
+The formatting paths of ultraTB and PyColorize report here how many
+tracebacks and frames they rendered, how many characters they wrote, and
+how long they spent extracting frames, tokenizing, computing reprs and
+doing I/O:
+
+    tracebacks      tracebacks formatted
+    frames          frames formatted
+    chars           characters written by the printing hooks (unicode
+                    tracebacks may take more bytes once encoded)
+    degraded        times a traceback went down to a cheaper mode
+    format_time     seconds spent in the text() methods of the formatters
+    extract_time    seconds spent getting frames and source lines
+    tokenize_time   seconds spent finding the names of a line and
+                    colorizing source
+    repr_time       seconds spent computing the reprs of variables
+    io_time         seconds spent writing tracebacks out
+
+Times are wall-clock seconds; with threaded rendering the time of all the
+threads is added up.  get_stats() returns a snapshot, reset_stats() starts
+over, and start_dump() appends a snapshot to a file every so often, which
+shows what an error storm in a long running process costs.  Set enabled to
+False to turn the bookkeeping off.
+"""
+
+#*****************************************************************************
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+__license__ = "BSD"
+__all__ = ['enabled', 'clock', 'add', 'get_stats', 'reset_stats',
+           'format_stats', 'start_dump', 'stop_dump']
+
+import threading
+import time
+
+# global switch, checked by every call to add()
+enabled = True
+
+# the timer used by the instrumented code
+clock = time.time
+
+_NAMES = ('tracebacks', 'frames', 'chars', 'degraded',
+          'format_time', 'extract_time', 'tokenize_time', 'repr_time',
+          'io_time')
+
+_lock = threading.Lock()
+_stats = {}
+_since = [0.0]
+
+_dumper = [None]
+
+
+def add(name, value=1):
+    """Add value to the counter or timer called name."""
+    if not enabled:
+        return
+    _lock.acquire()
+    try:
+        _stats[name] = _stats.get(name, 0) + value
+    finally:
+        _lock.release()
+
+
+def get_stats():
+    """Return a dict with the current value of every counter and timer.
+
+    'since' holds the time the statistics were last reset."""
+    _lock.acquire()
+    try:
+        stats = _stats.copy()
+    finally:
+        _lock.release()
+    stats['since'] = _since[0]
+    return stats
+
+
+def reset_stats():
+    """Set all the counters and timers back to zero."""
+    _lock.acquire()
+    try:
+        for name in _NAMES:
+            if name.endswith('_time'):
+                _stats[name] = 0.0
+            else:
+                _stats[name] = 0
+        for name in _stats.keys():
+            if name not in _NAMES:
+                del _stats[name]
+        _since[0] = time.time()
+    finally:
+        _lock.release()
+
+reset_stats()
+
+
+def format_stats(stats=None):
+    """Return stats (the current ones by default) as a one-line string."""
+    if stats is None:
+        stats = get_stats()
+    stats = stats.copy()
+    fields = [time.strftime('%Y-%m-%d %H:%M:%S',
+                            time.localtime(stats.pop('since')))]
+    names = list(_NAMES) + sorted([k for k in stats if k not in _NAMES])
+    for name in names:
+        value = stats.get(name, 0)
+        if isinstance(value, float):
+            fields.append('%s=%.6f' % (name, value))
+        else:
+            fields.append('%s=%s' % (name, value))
+    return ' '.join(fields)
+
+
+class _Dumper(threading.Thread):
+
+    def __init__(self, filename, interval):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.filename = filename
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.isSet():
+            self.stopped.wait(self.interval)
+            self.dump()
+
+    def dump(self):
+        try:
+            f = open(self.filename, 'a')
+            try:
+                f.write(format_stats() + '\n')
+            finally:
+                f.close()
+        except (IOError, OSError):
+            # the statistics must never be what brings a process down
+            pass
+
+
+def start_dump(filename, interval=60.0):
+    """Append the statistics to filename every interval seconds.
+
+    Each dump is a line of name=value pairs, headed by the time the
+    statistics were last reset.  A dump already running is stopped first."""
+    stop_dump()
+    _dumper[0] = _Dumper(filename, interval)
+    _dumper[0].start()
+
+
+def stop_dump():
+    """Stop the periodic dump, writing out one last line."""
+    dumper, _dumper[0] = _dumper[0], None
+    if dumper is not None:
+        dumper.stopped.set()
+        dumper.join()
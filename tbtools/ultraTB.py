@@ -77,7 +77,6 @@ import os
 import time
 import inspect
 import keyword
-import linecache
 import pydoc
 import string
 import tokenize
@@ -85,6 +84,15 @@ import traceback
 import types
 
 import tbtools
+import backends
+import capture
+import ColorANSI
+import emergency
+import output
+import paths
+import sources
+import sourceindex
+import tbstats
 from excolors import ExceptionColors
 
 # Globals
@@ -117,41 +125,294 @@ def uniq_stable(elems):
             unique_dict[nn] = None
     return unique
 
-def _fixed_getinnerframes(tb, context=1, tb_offset=0):
-    import linecache
-    LNUM_POS, LINES_POS, INDEX_POS =  (2, 4, 5)
+class _HiddenRun(object):
+    """Consecutive frames left out of a traceback: how many, the first
+    three of their modules, and whether there are more."""
 
-    records  = inspect.getinnerframes(tb, context)
+    __slots__ = ('count', 'modules', 'more')
+
+    def __init__(self):
+        self.count = 0
+        self.modules = []
+        self.more = False
+
+    def add(self, module):
+        self.count += 1
+        if module not in self.modules:
+            if len(self.modules) < 3:
+                self.modules.append(module)
+            else:
+                self.more = True
+
+    def summary(self):
+        modules = self.modules[:]
+        if self.more:
+            modules.append('...')
+        return '[... %d frame%s hidden: %s ...]' % \
+               (self.count, self.count > 1 and 's' or '', ', '.join(modules))
+
+def _walk_tb(tb, tb_offset=0, hide=None):
+    """Return (frame, filename, lnum, func) for the frames of tb, minus the
+    first tb_offset ones.
+
+    hide(filename, module name) tells which frames to leave out: each run of
+    those is replaced by a _HiddenRun, and nothing else is looked at.  The
+    innermost frame is always kept."""
+
+    entries = []
+    run = None
+    while tb is not None:
+        if tb_offset:
+            tb_offset -= 1
+            tb = tb.tb_next
+            continue
+        frame = tb.tb_frame
+        code = frame.f_code
+        if hide is not None and tb.tb_next is not None:
+            module = frame.f_globals.get('__name__')
+            if hide(code.co_filename, module):
+                if run is None:
+                    run = _HiddenRun()
+                    entries.append(run)
+                run.add(module or code.co_filename)
+                tb = tb.tb_next
+                continue
+        run = None
+        entries.append((frame, code.co_filename, tb.tb_lineno, code.co_name))
+        tb = tb.tb_next
+    return entries
+
+def _fixed_getinnerframes(tb, context=1, tb_offset=0, hide=None,
+                          deadline=None):
+    """Return (frame, filename, lnum, func, lines, index) records for tb.
+
+    Like inspect.getinnerframes, but the records are built straight from
+    the traceback, and only the context window of each frame is read, from
+    the source providers: nothing has to load a whole file.  Runs of frames
+    hidden by hide (see _walk_tb) come out as _HiddenRun records.  Once
+    time.time() reaches deadline, no more source is read: lines and index
+    are None in the remaining records."""
+
+    start_time = tbstats.clock()
+    entries = _walk_tb(tb, tb_offset, hide)
 
     # If the error is at the console, don't build any context, since it would
     # otherwise produce 5 blank lines printed out (there is no file at the
     # console)
-    rec_check = records[tb_offset:]
-    try:
-        rname = rec_check[0][1]
+    shown = [entry for entry in entries[:2] if type(entry) is tuple]
+    if shown:
+        rname = shown[0][1]
         if rname == '<ipython console>' or rname.endswith('<string>'):
-            return rec_check
-    except IndexError:
-        pass
-
-    aux = traceback.extract_tb(tb)
-    assert len(records) == len(aux)
-    for i, (file, lnum, _, _) in zip(range(len(records)), aux):
+            tbstats.add('extract_time', tbstats.clock() - start_time)
+            return [type(entry) is tuple and entry + (None, None) or entry
+                    for entry in entries]
+
+    records = []
+    for entry in entries:
+        if type(entry) is not tuple:
+            records.append(entry)
+            continue
+        if deadline is not None and time.time() >= deadline:
+            records.append(entry + (None, None))
+            continue
+        frame, file, lnum, func = entry
         maybeStart = lnum-1 - context//2
         start =  max(maybeStart, 0)
         end   = start + context
-        lines = linecache.getlines(file)[start:end]
-        # pad with empty lines if necessary
-        if maybeStart < 0:
-            lines = (['\n'] * -maybeStart) + lines
-        if len(lines) < context:
-            lines += ['\n'] * (context - len(lines))
-        buf = list(records[i])
-        buf[LNUM_POS] = lnum
-        buf[INDEX_POS] = lnum - 1 - start
-        buf[LINES_POS] = lines
-        records[i] = tuple(buf)
-    return records[tb_offset:]
+        # the window is cut short at the ends of the file, not padded:
+        # _formatTracebackLines numbers whatever lines there are
+        lines = sources.getlines(file, frame.f_globals)[start:end]
+        if lines:
+            records.append((frame, file, lnum, func, lines, lnum - 1 - start))
+        else:
+            records.append(entry + (None, None))
+    tbstats.add('extract_time', tbstats.clock() - start_time)
+    return records
+
+def _extract_entries(tb, tb_offset=0, hide=None):
+    """traceback.extract_tb(tb)[tb_offset:], with the runs of frames hidden
+    by hide replaced by _HiddenRun entries; only the source lines of the
+    frames shown are read."""
+
+    entries = []
+    for entry in _walk_tb(tb, tb_offset, hide):
+        if type(entry) is not tuple:
+            entries.append(entry)
+            continue
+        frame, filename, lineno, name = entry
+        line = sources.getline(filename, lineno, frame.f_globals)
+        entries.append((filename, lineno, name, line and line.strip() or None))
+    return entries
+
+def _hide_entries(elist, hide):
+    """Collapse the runs of entries of an extracted list hidden by hide."""
+
+    entries = []
+    run = None
+    for entry in elist[:-1]:
+        if hide(entry[0], None):
+            if run is None:
+                run = _HiddenRun()
+                entries.append(run)
+            run.add(entry[0])
+        else:
+            run = None
+            entries.append(entry)
+    entries.append(elist[-1])
+    return entries
+
+def _print_tb(out, text):
+    """print >>out, text in a single write, counting the characters and the
+    time it takes."""
+    start = tbstats.clock()
+    output.write_unit(out, text, '\n')
+    tbstats.add('io_time', tbstats.clock() - start)
+    tbstats.add('chars', len(text) + 1)
+
+def _map_threaded(func, items, threads, budget=None, overdue=None):
+    """Return map(func, items), computed by a pool of daemon threads.
+
+    Results come back in the order of items.  If budget is given, an item
+    still running budget seconds after a worker picked it up is abandoned:
+    overdue(item) is used in its place, and a new worker replaces the stuck
+    one, which finishes in the background.  Exceptions raised by func are
+    re-raised in the calling thread.
+
+    The threads share the GIL, so this doesn't make pure Python work any
+    faster; it pays off when rendering waits on I/O (source files, slow
+    reprs talking to the outside world) and, with a budget, it keeps one
+    pathological frame from delaying all the others."""
+    import threading
+    import Queue
+
+    count = len(items)
+    results = [None] * count
+    started = [None] * count
+    done = [threading.Event() for i in range(count)]
+    todo = Queue.Queue()
+    for i in range(count):
+        todo.put(i)
+
+    def worker():
+        while 1:
+            try:
+                i = todo.get_nowait()
+            except Queue.Empty:
+                return
+            started[i] = time.time()
+            try:
+                results[i] = (1, func(items[i]))
+            except:
+                results[i] = (0, sys.exc_info())
+            done[i].set()
+
+    def spawn():
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)
+        thread.start()
+
+    for i in range(min(threads, count)):
+        spawn()
+
+    out = []
+    for i in range(count):
+        while budget and not done[i].isSet():
+            if started[i] is None:
+                # not picked up yet: its budget hasn't started
+                done[i].wait(budget)
+                continue
+            remaining = started[i] + budget - time.time()
+            if remaining <= 0:
+                break
+            done[i].wait(remaining)
+        if not done[i].isSet() and budget:
+            out.append(overdue(items[i]))
+            spawn()
+            continue
+        done[i].wait()
+        ok, value = results[i]
+        if not ok:
+            raise value[0], value[1], value[2]
+        out.append(value)
+    return out
+
+class _WorkerPool(object):
+    """At most size daemon threads running calls, one at a time each.
+
+    call() hands a call to an idle worker, starting one if there are fewer
+    than size, and waits for the result until its timeout.  A call which
+    doesn't finish in time keeps its worker busy until it does: the workers
+    are never abandoned, so however many calls overrun, there are never
+    more than size threads."""
+
+    def __init__(self, size):
+        import threading
+        self.size = max(size, 1)
+        self._cond = threading.Condition()
+        self._idle = []
+        self._count = 0
+
+    def _worker(self, deadline):
+        """An idle worker's task queue, or None if none is idle by the
+        time.time() deadline and size are running."""
+        import threading
+        import Queue
+
+        self._cond.acquire()
+        try:
+            while not self._idle and self._count >= self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+        finally:
+            self._cond.release()
+        tasks = Queue.Queue()
+        thread = threading.Thread(target=self._run, args=(tasks,))
+        thread.setDaemon(True)
+        thread.start()
+        return tasks
+
+    def _run(self, tasks):
+        while 1:
+            func, args, result, done = tasks.get()
+            try:
+                result.append((1, func(*args)))
+            except:
+                result.append((0, sys.exc_info()))
+            # don't keep the frames of the record alive while idle
+            func = args = result = None
+            # idle again before the caller can see the result, so that its
+            # next call finds this worker
+            self._cond.acquire()
+            self._idle.append(tasks)
+            self._cond.notify()
+            self._cond.release()
+            done.set()
+
+    def call(self, timeout, func, *args):
+        """Return (1, func(*args)) if it is run within timeout seconds, and
+        (0, None) if it isn't, waiting for a busy worker included.
+        Exceptions raised by func are re-raised in the calling thread."""
+        import threading
+
+        deadline = time.time() + timeout
+        tasks = self._worker(deadline)
+        if tasks is None:
+            return 0, None
+        result = []
+        done = threading.Event()
+        tasks.put((func, args, result, done))
+        done.wait(max(deadline - time.time(), 0))
+        if not result:
+            return 0, None
+        ok, value = result[0]
+        if not ok:
+            raise value[0], value[1], value[2]
+        return 1, value
 
 # Helper function -- largely belongs to VerboseTB, but we need the same
 # functionality to produce a pseudo verbose TB for SyntaxErrors, so that they
@@ -189,6 +450,155 @@ def _formatTracebackLines(lnum, index, lines, Colors, lvals=None):
         i = i + 1
     return res
 
+class _Unresolved(object):
+    """Marker for the values NameResolver couldn't or wouldn't compute."""
+    def __init__(self, reason):
+        self.reason = reason
+
+    def __repr__(self):
+        return '<%s>' % self.reason
+
+_undefined = _Unresolved('undefined')
+_skipped = _Unresolved('not evaluated')
+_redacted = _Unresolved('redacted')
+
+def _flatten_args(args):
+    """Names of the arguments in args, with tuple arguments unpacked."""
+    names = []
+    for arg in args:
+        if isinstance(arg, list):
+            names.extend(_flatten_args(arg))
+        else:
+            names.append(arg)
+    return names
+
+def _filter_args(frame_filter, args, varargs, varkw, locals):
+    """Return locals, or a copy where the arguments frame_filter doesn't
+    show are replaced by _redacted (an argument list can't leave any out)."""
+    names = _flatten_args(args)
+    names.extend([name for name in (varargs, varkw) if name])
+    shown = locals
+    for name in names:
+        action, value = frame_filter.check(
+            name, lambda name=name: locals.get(name, _undefined))
+        if action != capture.SHOW:
+            if shown is locals:
+                shown = locals.copy()
+            shown[name] = _redacted
+    return shown
+
+# class attributes whose __get__ is builtin code without side effects:
+# functions and methods, static and class methods, slots and the like
+_SAFE_DESCRIPTORS = (types.FunctionType, types.BuiltinFunctionType,
+                     types.MethodType, staticmethod, classmethod,
+                     types.MemberDescriptorType, types.GetSetDescriptorType,
+                     type(str.join), type(dict.__dict__['fromkeys']),
+                     type(object.__dict__['__getattribute__']))
+
+def _python_getattribute(klass):
+    """Whether klass, or one of its bases, defines __getattribute__ in
+    Python (rather than inheriting a builtin one)."""
+    for base in inspect.getmro(klass):
+        if '__getattribute__' in base.__dict__:
+            return not isinstance(base.__dict__['__getattribute__'],
+                                  _SAFE_DESCRIPTORS)
+    return False
+
+def _runs_code(obj, attr):
+    """Tell whether getattr(obj, attr) would run code of the object's class:
+    a property or any other descriptor, __getattribute__ or __getattr__.
+
+    Plain instance and class attributes, methods and module contents are
+    safe; anything undecidable counts as running code."""
+    try:
+        if type(obj) is types.ModuleType:
+            return False
+        # classic classes have no __class__
+        klass = getattr(obj, '__class__', type(obj))
+        if _python_getattribute(klass):
+            return True
+        if isinstance(obj, (type, types.ClassType)):
+            # class attributes of a class get their __get__ called too
+            for base in inspect.getmro(obj):
+                if attr in base.__dict__:
+                    value = base.__dict__[attr]
+                    if hasattr(type(value), '__get__') and \
+                           not isinstance(value, _SAFE_DESCRIPTORS):
+                        return True
+                    break
+        in_instance = attr in getattr(obj, '__dict__', {})
+        for base in inspect.getmro(klass):
+            if attr in base.__dict__:
+                value = base.__dict__[attr]
+                if isinstance(value, _SAFE_DESCRIPTORS):
+                    return False
+                kind = type(value)
+                if not hasattr(kind, '__get__'):
+                    # a plain class attribute
+                    return False
+                # the instance attribute comes first, unless the
+                # descriptor is a data descriptor
+                return not in_instance or hasattr(kind, '__set__') or \
+                       hasattr(kind, '__delete__')
+        if in_instance:
+            return False
+        # not found statically: only __getattr__ could provide it
+        return hasattr(klass, '__getattr__')
+    except KeyboardInterrupt:
+        raise
+    except:
+        return True
+
+class NameResolver(object):
+    """Resolve dotted names in a namespace with getattr instead of eval.
+
+    Each attribute lookup is memoized by (id(object), attribute), so within
+    one traceback the shared prefixes of names like self.conn and
+    self.conn.pool are computed once.  The objects are kept alive by the
+    memo, so an id can't be recycled while the resolver lives: use one
+    resolver per traceback.
+
+    With skip_properties, attributes which would run a property or another
+    descriptor, or a __getattribute__ or __getattr__ hook, resolve to the
+    _skipped marker."""
+
+    def __init__(self, skip_properties=0):
+        self.skip_properties = skip_properties
+        self._attrs = {}
+
+    def resolve(self, name_full, namespace):
+        """Return the value of name_full, looked up in the namespace dict.
+
+        Names which can't be resolved give the _undefined marker."""
+        parts = name_full.split('.')
+        try:
+            value = namespace[parts[0]]
+        except KeyError:
+            return _undefined
+        for attr in parts[1:]:
+            value = self._getattr(value, attr)
+            if isinstance(value, _Unresolved):
+                break
+        return value
+
+    def _getattr(self, obj, attr):
+        key = (id(obj), attr)
+        try:
+            return self._attrs[key][1]
+        except KeyError:
+            pass
+        if self.skip_properties and _runs_code(obj, attr):
+            value = _skipped
+        else:
+            try:
+                value = getattr(obj, attr)
+            except KeyboardInterrupt:
+                raise
+            except:
+                value = _undefined
+        self._attrs[key] = (obj, value)
+        return value
+
 #---------------------------------------------------------------------------
 # Module classes
 class TBTools(object):
@@ -197,10 +607,22 @@ class TBTools(object):
     def __init__(self, color_scheme='LightBG'):
         # Create color table
         self.color_scheme_table = ExceptionColors
-
-        if hasattr(sys.stdout, "isatty") and not sys.stdout.isatty():
+        self.backend = backends.ANSI
+        # show files under site-packages as site-packages/pkg/mod.py
+        self.short_paths = False
+        # frames to leave out (library or framework internals): a tuple of
+        # filename prefixes, and a framefilter.FrameFilter or any callable
+        # taking a filename and a module name
+        self.hidden_files = ()
+        self.frame_filter = None
+
+        # the terminal is only probed once per stream
+        depth = ColorANSI.color_depth(sys.stdout)
+        if not depth:
             self.set_colors('NoColor')
         else:
+            if depth != self.color_scheme_table.color_depth:
+                self.color_scheme_table.set_color_depth(depth)
             self.set_colors(color_scheme)
         self.old_scheme = color_scheme  # save initial value for toggles
 
@@ -214,18 +636,39 @@ class TBTools(object):
 
         self.color_scheme_table.set_active_scheme(*args, **kw)
         # for convenience, set Colors to the active scheme
-        self.Colors = self.color_scheme_table.active_colors
+        self._update_colors()
 
     def color_toggle(self):
         """Toggle between the currently active color scheme and NoColor."""
 
         if self.color_scheme_table.active_scheme_name == 'NoColor':
             self.color_scheme_table.set_active_scheme(self.old_scheme)
-            self.Colors = self.color_scheme_table.active_colors
         else:
             self.old_scheme = self.color_scheme_table.active_scheme_name
             self.color_scheme_table.set_active_scheme('NoColor')
-            self.Colors = self.color_scheme_table.active_colors
+        self._update_colors()
+
+    def set_backend(self, backend):
+        """Select the output backend: 'ansi', 'plain', 'html' or a
+        backends.Backend instance."""
+
+        self.backend = backends.get_backend(backend)
+        self._update_colors()
+
+    def _frame_hider(self):
+        """The predicate telling the frames to hide, or None."""
+        hidden = self.hidden_files
+        frame_filter = self.frame_filter
+        if not hidden:
+            return frame_filter
+        if frame_filter is None:
+            return lambda filename, module: filename.startswith(hidden)
+        return lambda filename, module: filename.startswith(hidden) or \
+               frame_filter(filename, module)
+
+    def _update_colors(self):
+        table = self.color_scheme_table
+        self.Colors = self.backend.colors(table[table.active_scheme_name])
 
 #---------------------------------------------------------------------------
 class ListTB(TBTools):
@@ -249,26 +692,74 @@ class ListTB(TBTools):
         TBTools.__init__(self, color_scheme=color_scheme)
 
     def __call__(self, etype, value, elist):
-        print >>sys.stderr, self.text(etype, value, elist)
+        _print_tb(sys.stderr, self.text(etype, value, elist))
 
     def text(self, etype, value, elist, context=5):
         """Return a color formatted string with the traceback info."""
 
-        Colors = self.Colors
+        return self._text(etype, value, elist, self._list_templates(),
+                          self._frame_hider())
+
+    def text_many(self, records, context=5, fill_lines=False):
+        """Format many (etype, value, elist) records, yielding one string
+        per record as text() would return it.
+
+        The color templates are built once for all the records.  With
+        fill_lines, entries archived without their source line get it from
+        the source file, if it can be found."""
+
+        templates = self._list_templates()
+        hide = self._frame_hider()
+        for etype, value, elist in records:
+            if fill_lines and elist:
+                elist = [(filename, lineno, name,
+                          line or sources.getline(filename, lineno))
+                         for filename, lineno, name, line in elist]
+            yield self._text(etype, value, elist, templates, hide)
+
+    def _text(self, etype, value, elist, templates, hide=None):
+        start_time = tbstats.clock()
         out_string = []
+        if elist and hide is not None:
+            elist = _hide_entries(elist, hide)
         if elist:
-            out_string.append('Traceback %s(most recent call last)%s:' % \
-                                (Colors.normalEm, Colors.Normal) + '\n')
-            out_string.extend(self._format_list(elist))
+            out_string.append(templates[0])
+            out_string.extend(self._format_list(elist, templates))
         else:
-            out_string.append('%s%s%s\n' % (Colors.topline, '-'*60, Colors.Normal))
+            out_string.append(templates[1])
         lines = self._format_exception_only(etype, value)
         for line in lines[:-1]:
             out_string.append(" "+line)
         out_string.append(lines[-1])
-        return ''.join(out_string)
+        tbstats.add('tracebacks')
+        tbstats.add('frames', len(elist or ()))
+        tbstats.add('format_time', tbstats.clock() - start_time)
+        return self.backend.wrap(''.join(out_string))
+
+    def _hidden_line(self, run):
+        return '  %s%s%s\n' % (self.Colors.topline,
+                               self.backend.escape(run.summary()),
+                               self.Colors.Normal)
+
+    def _list_templates(self):
+        """The color templates of text() and _format_list(): header, header
+        without entries, entry, source line, last entry, its source line."""
 
-    def _format_list(self, extracted_list):
+        Colors = self.Colors
+        return ('Traceback %s(most recent call last)%s:\n' %
+                (Colors.normalEm, Colors.Normal),
+                '%s%s%s\n' % (Colors.topline, '-'*60, Colors.Normal),
+                '  File %s"%%s"%s, line %s%%d%s, in %s%%s%s\n' %
+                (Colors.filename, Colors.Normal, Colors.lineno, Colors.Normal,
+                 Colors.name, Colors.Normal),
+                '    %s\n',
+                '%s  File %s"%%s"%s, line %s%%d%s, in %s%%s%s%s\n' %
+                (Colors.normalEm, Colors.filenameEm, Colors.normalEm,
+                 Colors.linenoEm, Colors.normalEm, Colors.nameEm,
+                 Colors.normalEm, Colors.Normal),
+                '%s    %%s%s\n' % (Colors.line, Colors.Normal))
+
+    def _format_list(self, extracted_list, templates=None):
         """Format a list of traceback entry tuples for printing.
 
         Given a list of tuples as returned by extract_tb() or
@@ -281,27 +772,30 @@ class ListTB(TBTools):
         Lifted almost verbatim from traceback.py
         """
 
-        Colors = self.Colors
+        if templates is None:
+            templates = self._list_templates()
+        tpl_entry, tpl_line, tpl_last, tpl_last_line = templates[2:]
+        escape = self.backend.escape
+        if self.short_paths:
+            shorten = paths.shorten
+            extracted_list = [type(entry) is _HiddenRun and entry or
+                              (shorten(entry[0]),) + tuple(entry[1:])
+                              for entry in extracted_list]
         list = []
-        for filename, lineno, name, line in extracted_list[:-1]:
-            item = '  File %s"%s"%s, line %s%d%s, in %s%s%s\n' % \
-                    (Colors.filename, filename, Colors.Normal,
-                     Colors.lineno, lineno, Colors.Normal,
-                     Colors.name, name, Colors.Normal)
+        for entry in extracted_list[:-1]:
+            if type(entry) is _HiddenRun:
+                list.append(self._hidden_line(entry))
+                continue
+            filename, lineno, name, line = entry
+            item = tpl_entry % (escape(filename), lineno, escape(name))
             if line:
-                item = item + '    %s\n' % line.strip()
+                item = item + tpl_line % escape(line.strip())
             list.append(item)
         # Emphasize the last entry
         filename, lineno, name, line = extracted_list[-1]
-        item = '%s  File %s"%s"%s, line %s%d%s, in %s%s%s%s\n' % \
-                (Colors.normalEm,
-                 Colors.filenameEm, filename, Colors.normalEm,
-                 Colors.linenoEm, lineno, Colors.normalEm,
-                 Colors.nameEm, name, Colors.normalEm,
-                 Colors.Normal)
+        item = tpl_last % (escape(filename), lineno, escape(name))
         if line:
-            item = item + '%s    %s%s\n' % (Colors.line, line.strip(),
-                                            Colors.Normal)
+            item = item + tpl_last_line % escape(line.strip())
         list.append(item)
         return list
 
@@ -320,11 +814,12 @@ class ListTB(TBTools):
         """
 
         Colors = self.Colors
+        escape = self.backend.escape
         list = []
         if not issubclass(etype, str):
-            stype = Colors.excName + etype.__name__ + Colors.Normal
+            stype = Colors.excName + escape(etype.__name__) + Colors.Normal
         else:
-            stype = etype  # String exceptions don't get special coloring
+            stype = escape(etype)  # String exceptions don't get special coloring
         if value is None:
             list.append( str(stype) + '\n')
         else:
@@ -338,14 +833,15 @@ class ListTB(TBTools):
                     if not filename: filename = "<string>"
                     list.append('%s  File %s"%s"%s, line %s%d%s\n' % \
                             (Colors.normalEm,
-                             Colors.filenameEm, filename, Colors.normalEm,
+                             Colors.filenameEm, escape(filename),
+                             Colors.normalEm,
                              Colors.linenoEm, lineno, Colors.Normal  ))
                     if line is not None:
                         i = 0
                         while i < len(line) and line[i].isspace():
                             i = i+1
                         list.append('%s    %s%s\n' % (Colors.line,
-                                                      line.strip(),
+                                                      escape(line.strip()),
                                                       Colors.Normal))
                         if offset is not None:
                             s = '    '
@@ -357,7 +853,7 @@ class ListTB(TBTools):
                             list.append('%s%s^%s\n' % (Colors.caret, s,
                                                        Colors.Normal) )
                         value = msg
-            s = self._some_str(value)
+            s = escape(self._some_str(value))
             if s:
                 list.append('%s%s:%s %s' % (str(stype), Colors.excName,
                                               Colors.Normal, s))
@@ -382,21 +878,61 @@ class VerboseTB(TBTools):
     would appear in the traceback)."""
 
     def __init__(self, color_scheme='Linux', tb_offset=0, long_header=0,
-                 include_vars=1):
+                 include_vars=1, skip_properties=0, threads=0,
+                 frame_budget=None, capture_filter=None):
         """Specify traceback offset, headers and color scheme.
 
         Define how many frames to drop from the tracebacks. Calling it with
         tb_offset=1 allows use of this handler in interpreters which will have
         their own code at the top of the traceback (VerboseTB will first
-        remove that frame before printing the traceback info)."""
+        remove that frame before printing the traceback info).
+
+        With skip_properties, variable details don't evaluate properties,
+        other descriptors or __getattribute__/__getattr__ hooks, which may be
+        slow or have side effects.
+
+        With threads > 1, frames are rendered by that many worker threads.
+        A frame_budget (in seconds) then bounds the time spent on each frame:
+        frames which take longer are replaced by a one-line placeholder
+        instead of stalling the whole report.  With a time_budget or a
+        size_budget (see FormattedTB) frames are rendered one at a time,
+        by at most max(threads, 1) worker threads kept for the next
+        tracebacks, and the frame_budget still applies to each.
+
+        A capture_filter (see the capture module) selects the variables
+        whose values are shown, redacted or left out."""
         TBTools.__init__(self, color_scheme=color_scheme)
         self.tb_offset = tb_offset
         self.long_header = long_header
         self.include_vars = include_vars
+        self.skip_properties = skip_properties
+        self.threads = threads
+        self.frame_budget = frame_budget
+        self.capture_filter = capture_filter
+        # per-traceback budgets, see FormattedTB
+        self.time_budget = None
+        self.size_budget = None
+        self.last_render = None
+        # the workers of the budgeted rendering, see _format_budgeted
+        self._workers = None
 
     def text(self, etype, evalue, tb, context=5):
         """Return a nice text document describing the traceback."""
 
+        start_time = tbstats.clock()
+        clock = tbstats.clock
+        # the time budget counts everything from here
+        budget_start = time.time()
+
+        escape = self.backend.escape
+        escapes = self.backend.escapes
+        # don't pile up more allocations on top of a MemoryError
+        if emergency.is_memory_error(etype):
+            return self.backend.wrap(escape(
+                emergency.render(etype, evalue, tb, self.tb_offset)))
+        # keep the original for the emergency renderer
+        orig_etype = etype
+
         # a str instance has once been passed as etype ...
         if isinstance(etype, (type, types.ClassType)):
             etype = etype.__name__
@@ -405,9 +941,16 @@ class VerboseTB(TBTools):
         Colors        = self.Colors   # just a shorthand + quicker name lookup
         ColorsNormal  = Colors.Normal  # used a lot
         indent        = ' '*INDENT_SIZE
-        exc           = '%s%s%s' % (Colors.excName, str(etype), ColorsNormal)
+        exc           = '%s%s%s' % (Colors.excName, escape(str(etype)),
+                                    ColorsNormal)
         em_normal     = '%s\n%s%s' % (Colors.valEm, indent, ColorsNormal)
         undefined     = '%sundefined%s' % (Colors.em, ColorsNormal)
+        skipped       = '%s%s%s' % (Colors.em, escape('<not evaluated>'),
+                                    ColorsNormal)
+        if self.capture_filter is not None:
+            redacted  = '%s%s%s' % (Colors.em,
+                                    escape(self.capture_filter.placeholder),
+                                    ColorsNormal)
 
         # some internal-use functions
         def text_repr(value):
@@ -437,7 +980,10 @@ class VerboseTB(TBTools):
                         raise
                     except:
                         return 'UNRECOVERABLE REPR FAILURE'
-        def eqrepr(value, repr=text_repr): return '=%s' % repr(value)
+        def eqrepr(value, repr=text_repr):
+            if value is _redacted:
+                return '=%s' % redacted
+            return '=%s' % escape(repr(value))
         def nullrepr(value, repr=text_repr): return ''
 
         # meat of the code begins
@@ -449,7 +995,7 @@ class VerboseTB(TBTools):
 
             head = '%s%s%s\n%s%s%s\n%s' % (Colors.topline, '-'*75, ColorsNormal,
                                            exc, ' '*(75-len(str(etype))-len(pyver)),
-                                           pyver, string.rjust(date, 75) )
+                                           escape(pyver), string.rjust(date, 75) )
             head += "\nA problem occured executing Python code.  Here is the sequence of function"\
                     "\ncalls leading up to the error, with the most recent (innermost) call last."
         else:
@@ -460,7 +1006,7 @@ class VerboseTB(TBTools):
         frames = []
         # Flush cache before calling inspect.  This helps alleviate some of the
         # problems with python 2.3's inspect.py.
-        linecache.checkcache()
+        sources.checkcache()
         # Drop topmost frames if requested
         try:
             # Try the default getinnerframes and Alex's: Alex's fixes some
@@ -468,7 +1014,11 @@ class VerboseTB(TBTools):
             # (5 blanks lines) where none should be returned.
             #records = inspect.getinnerframes(tb, context)[self.tb_offset:]
             #print 'python records:', records # dbg
-            records = _fixed_getinnerframes(tb, context, self.tb_offset)
+            deadline = None
+            if self.time_budget:
+                deadline = budget_start + self.time_budget
+            records = _fixed_getinnerframes(tb, context, self.tb_offset,
+                                            self._frame_hider(), deadline)
             #print 'alex   records:', records # dbg
         except:
 
@@ -495,18 +1045,18 @@ class VerboseTB(TBTools):
         tpl_line_em    = '%s%%s%s %%s%s' % (Colors.linenoEm, Colors.line,
                                             ColorsNormal)
 
+        # dotted names are resolved with getattr, sharing the lookups of
+        # common prefixes between all the frames of this traceback
+        resolve = NameResolver(self.skip_properties).resolve
+
         # now, loop over all records printing context and info
-        abspath = os.path.abspath
-        for frame, file, lnum, func, lines, index in records:
+        display = paths.display
+        short_paths = self.short_paths
+        def format_record((frame, file, lnum, func, lines, index),
+                          include_vars=self.include_vars):
             #print '*** record:', file, lnum, func, lines, index  # dbg
-            try:
-                file = file and abspath(file) or '?'
-            except OSError:
-                # if file is '<console>' or something not in the filesystem,
-                # the abspath call will throw an OSError.  Just ignore it and
-                # keep the original file string.
-                pass
-            link = tpl_link % file
+            file = display(file, short_paths)
+            link = tpl_link % escape(file)
             try:
                 args, varargs, varkw, locals = inspect.getargvalues(frame)
             except:
@@ -515,15 +1065,26 @@ class VerboseTB(TBTools):
                 # requirement.  Bug details at http://python.org/sf/1005466
                 traceback.print_exc(file=sys.stderr)
 
+            # the capture rules which apply to this frame; checked before
+            # anything is looked up or repr'd
+            frame_filter = None
+            if include_vars and self.capture_filter is not None:
+                frame_filter = self.capture_filter.for_frame(
+                    frame.f_globals.get('__name__'), file)
+
             if func == '?':
                 call = ''
             else:
                 # Decide whether to include variable details or not
-                var_repr = self.include_vars and eqrepr or nullrepr
+                var_repr = include_vars and eqrepr or nullrepr
+                arg_values = locals
+                if frame_filter is not None:
+                    arg_values = _filter_args(frame_filter, args, varargs,
+                                              varkw, locals)
                 try:
-                    call = tpl_call % (func, inspect.formatargvalues(args,
+                    call = tpl_call % (escape(func), inspect.formatargvalues(args,
                                                 varargs, varkw,
-                                                locals, formatvalue=var_repr))
+                                                arg_values, formatvalue=var_repr))
                 except KeyError:
                     # Very odd crash from inspect.formatargvalues().  The
                     # scenario under which it appeared was a call to
@@ -533,96 +1094,59 @@ class VerboseTB(TBTools):
                     # and barfs out. At some point I should dig into this one
                     # and file a bug report about it.
                     traceback.print_exc(file=sys.stderr)
-                    call = tpl_call_fail % func
-
-            # Initialize a list of names on the current line, which the
-            # tokenizer below will populate.
-            names = []
-
-            def tokeneater(token_type, token, start, end, line):
-                """Stateful tokeneater which builds dotted names.
-
-                The list of names it appends to (from the enclosing scope) can
-                contain repeated composite names.  This is unavoidable, since
-                there is no way to disambguate partial dotted structures until
-                the full list is known.  The caller is responsible for pruning
-                the final list of duplicates before using it."""
+                    call = tpl_call_fail % escape(func)
 
-                # build composite names
-                if token == '.':
-                    try:
-                        names[-1] += '.'
-                        # store state so the next token is added for x.y.z names
-                        tokeneater.name_cont = True
-                        return
-                    except IndexError:
-                        pass
-                if token_type == tokenize.NAME and token not in keyword.kwlist:
-                    if tokeneater.name_cont:
-                        # Dotted names
-                        names[-1] += token
-                        tokeneater.name_cont = False
-                    else:
-                        # Regular new names.  We append everything, the caller
-                        # will be responsible for pruning the list later.  It's
-                        # very tricky to try to prune as we go, b/c composite
-                        # names can fool us.  The pruning at the end is easy
-                        # to do (or the caller can print a list with repeated
-                        # names if so desired.
-                        names.append(token)
-                elif token_type == tokenize.NEWLINE:
-                    raise IndexError
-            # we need to store a bit of state in the tokenizer to build
-            # dotted names
-            tokeneater.name_cont = False
-
-            def linereader(file=file, lnum=[lnum], getline=linecache.getline):
-                line = getline(file, lnum[0])
-                lnum[0] += 1
-                return line
-
-            # Build the list of names on this line of code where the exception
-            # occurred.
-            try:
-                # This builds the names list in-place by capturing it from the
-                # enclosing scope.
-                tokenize.tokenize(linereader, tokeneater)
-            except IndexError:
-                # signals exit of tokenizer
-                pass
-            except tokenize.TokenError, msg:
-                _m = ("An unexpected error occurred while tokenizing input\n"
-                      "The following traceback may be corrupted or invalid\n"
-                      "The error message is: %s\n" % msg)
-                print >>sys.stderr, _m
+            # The names used by the whole statement where the exception
+            # occurred come from the per-file AST index.  Sources which can't
+            # be parsed fall back to tokenizing forward from the line.
+            tokenize_start = clock()
+            names = sourceindex.line_names(file, lnum)
+            if names is None:
+                names = self._tokenize_names(file, lnum)
+            tbstats.add('tokenize_time', clock() - tokenize_start)
 
             # prune names list of duplicates, but keep the right order
             unique_names = uniq_stable(names)
 
             # Start loop over vars
             lvals = []
-            if self.include_vars:
+            if include_vars:
+                repr_time = 0.0
                 for name_full in unique_names:
                     name_base = name_full.split('.', 1)[0]
                     if name_base in frame.f_code.co_varnames:
-                        if locals.has_key(name_base):
-                            try:
-                                value = repr(eval(name_full, locals))
-                            except:
-                                value = undefined
-                        else:
-                            value = undefined
+                        namespace = locals
                         name = tpl_local_var % name_full
                     else:
-                        if frame.f_globals.has_key(name_base):
-                            try:
-                                value = repr(eval(name_full, frame.f_globals))
-                            except:
-                                value = undefined
-                        else:
-                            value = undefined
+                        namespace = frame.f_globals
                         name = tpl_global_var % name_full
+                    if frame_filter is None:
+                        value = resolve(name_full, namespace)
+                    else:
+                        action, value = frame_filter.check(name_full,
+                            lambda: resolve(name_full, namespace))
+                        if action == capture.HIDE:
+                            continue
+                        if action == capture.REDACT:
+                            lvals.append(tpl_name_val % (name, redacted))
+                            continue
+                        if value is capture.UNRESOLVED:
+                            value = resolve(name_full, namespace)
+                    if value is _undefined:
+                        value = undefined
+                    elif value is _skipped:
+                        value = skipped
+                    else:
+                        repr_start = clock()
+                        try:
+                            value = escape(repr(value))
+                        except KeyboardInterrupt:
+                            raise
+                        except:
+                            value = undefined
+                        repr_time += clock() - repr_start
                     lvals.append(tpl_name_val % (name, value))
+                tbstats.add('repr_time', repr_time)
             if lvals:
                 lvals = '%s%s' % (indent, em_normal.join(lvals))
             else:
@@ -631,10 +1155,61 @@ class VerboseTB(TBTools):
             level = '%s %s\n' % (link, call)
 
             if index is None:
-                frames.append(level)
+                return level
             else:
-                frames.append('%s%s' % (level, ''.join(
-                    _formatTracebackLines(lnum, index, lines, self.Colors, lvals))))
+                if escapes:
+                    lines = map(escape, lines)
+                return '%s%s' % (level, ''.join(
+                    _formatTracebackLines(lnum, index, lines, self.Colors, lvals)))
+
+        def overdue_record((frame, file, lnum, func, lines, index)):
+            return '%s in %s\n%s%s%s%s\n' % \
+                   (tpl_link % escape(display(file, short_paths)),
+                    escape(func), indent, Colors.em,
+                    escape('<frame not rendered: over its %ss budget>' %
+                           self.frame_budget), ColorsNormal)
+
+        def plain_record((frame, file, lnum, func, lines, index)):
+            # no trailing newline: frames are joined with one, and plain
+            # entries go without blank lines in between, like in ListTB
+            if short_paths:
+                file = paths.shorten(file)
+            item = '  File %s"%s"%s, line %s%d%s, in %s%s%s' % \
+                   (Colors.filename, escape(file), ColorsNormal,
+                    Colors.lineno, lnum, ColorsNormal,
+                    Colors.name, escape(func), ColorsNormal)
+            if index is not None and index < len(lines) and \
+                   lines[index].strip():
+                item += '\n    %s' % escape(lines[index].strip())
+            return item
+
+        # a run of hidden frames is a single line, in every mode
+        def showing_hidden(format):
+            def format_any(record, *args):
+                if type(record) is _HiddenRun:
+                    return '%s%s%s\n' % (Colors.topline,
+                                         escape(record.summary()),
+                                         ColorsNormal)
+                return format(record, *args)
+            return format_any
+        format_record = showing_hidden(format_record)
+        overdue_record = showing_hidden(overdue_record)
+        plain_record = showing_hidden(plain_record)
+
+        try:
+            if self.time_budget or self.size_budget:
+                frames = self._format_budgeted(records, format_record,
+                                               plain_record, overdue_record,
+                                               budget_start)
+            elif self.threads > 1 and len(records) > 1:
+                frames = _map_threaded(format_record, records, self.threads,
+                                       self.frame_budget, overdue_record)
+            else:
+                frames = map(format_record, records)
+        except MemoryError:
+            frames = records = None
+            return self.backend.wrap(escape(
+                emergency.render(orig_etype, evalue, tb, self.tb_offset)))
 
         # Get (safely) a string form of the exception info
         try:
@@ -644,8 +1219,8 @@ class VerboseTB(TBTools):
             etype, evalue = str, sys.exc_info()[:2]
             etype_str, evalue_str = map(str, (etype, evalue))
         # ... and format it
-        exception = ['%s%s%s: %s' % (Colors.excName, etype_str,
-                                     ColorsNormal, evalue_str)]
+        exception = ['%s%s%s: %s' % (Colors.excName, escape(etype_str),
+                                     ColorsNormal, escape(evalue_str))]
         if type(evalue) is types.InstanceType:
             try:
                 names = [w for w in dir(evalue) if isinstance(w, basestring)]
@@ -656,19 +1231,197 @@ class VerboseTB(TBTools):
                 _m = '%sException reporting error (object with broken dir())%s:'
                 exception.append(_m % (Colors.excName, ColorsNormal))
                 etype_str, evalue_str = map(str, sys.exc_info()[:2])
-                exception.append('%s%s%s: %s' % (Colors.excName, etype_str,
-                                     ColorsNormal, evalue_str))
+                exception.append('%s%s%s: %s' % (Colors.excName,
+                                     escape(etype_str),
+                                     ColorsNormal, escape(evalue_str)))
                 names = []
             for name in names:
                 value = text_repr(getattr(evalue, name))
-                exception.append('\n%s%s = %s' % (indent, name, value))
+                exception.append('\n%s%s = %s' % (indent, escape(name),
+                                                  escape(value)))
+        tbstats.add('tracebacks')
+        tbstats.add('frames', len(records))
+        tbstats.add('format_time', clock() - start_time)
         # return all our info assembled as a single string
-        return '%s\n\n%s\n%s' % (head, '\n'.join(frames), ''.join(exception[0]) )
+        try:
+            return self.backend.wrap('%s\n\n%s\n%s' % (
+                head, '\n'.join(frames), ''.join(exception[0])))
+        except MemoryError:
+            frames = records = None
+            return self.backend.wrap(escape(
+                emergency.render(orig_etype, evalue, tb, self.tb_offset)))
+
+    def _format_budgeted(self, records, format_record, plain_record,
+                         overdue_record, start=None):
+        """Format records, degrading the output to stay within the budgets.
+
+        Frames are rendered in the current mode (Verbose or Context) until
+        half of the time or size budget is spent, then in Context mode until
+        the whole budget is, and in Plain mode after that.  The time budget
+        runs from start, the beginning of text(), so that extracting the
+        records counts too.  A Verbose or Context frame is given what is
+        left of the time budget (and at most frame_budget) in a worker
+        thread: if it doesn't make it, it is printed in Plain mode and so
+        are the frames after it (or, over the frame_budget only, it is
+        replaced by a placeholder).  The workers are kept from one frame
+        and one traceback to the next, max(threads, 1) of them at most: a
+        frame which ran over keeps its worker until it finishes, and the
+        time a frame waits for a worker counts in its budget.  A marker
+        line shows where the output degraded and which budget was exceeded;
+        the details are kept in self.last_render."""
+
+        Colors = self.Colors
+        time_budget = self.time_budget
+        size_budget = self.size_budget
+        frame_budget = self.frame_budget
+        modes = self.valid_modes   # Plain, Context, Verbose
+        level = self.include_vars and 2 or 1
+        if start is None:
+            start = time.time()
+        info = self.last_render = {'mode': modes[level],
+                                   'frames': len(records),
+                                   'degraded': [],
+                                   'overdue': [],
+                                   'elapsed': 0.0,
+                                   'size': 0}
+        size = 0
+        frames = []
+
+        def degrade(i, target, reason):
+            info['degraded'].append((i, modes[target], reason))
+            tbstats.add('degraded')
+            frames.append('%s[... %s budget exceeded, %d frames left '
+                          'in %s mode ...]%s\n' %
+                          (Colors.topline, reason, len(records) - i,
+                           modes[target], Colors.Normal))
+            return target
+
+        for i in range(len(records)):
+            record = records[i]
+            # fraction of each budget spent so far
+            time_spent = size_spent = 0.0
+            if time_budget:
+                time_spent = (time.time() - start) / time_budget
+            if size_budget:
+                size_spent = float(size) / size_budget
+            spent = max(time_spent, size_spent)
+            target = level
+            if spent >= 1:
+                target = 0
+            elif spent >= 0.5:
+                target = min(level, 1)
+            if target < level:
+                level = degrade(i, target, time_spent >= size_spent and
+                                'time' or 'size')
+            frame = None
+            if level:
+                timeout = frame_budget
+                if time_budget:
+                    left = max(start + time_budget - time.time(), 0)
+                    if timeout is None or left < timeout:
+                        timeout = left
+                if timeout is None or type(record) is _HiddenRun:
+                    frame = format_record(record, level == 2)
+                else:
+                    if self._workers is None:
+                        self._workers = _WorkerPool(self.threads)
+                    done, frame = self._workers.call(timeout, format_record,
+                                                     record, level == 2)
+                    if not done:
+                        if frame_budget and timeout == frame_budget:
+                            info['overdue'].append(i)
+                            frame = overdue_record(record)
+                        else:
+                            level = degrade(i, 0, 'time')
+            if frame is None:
+                frame = plain_record(record)
+            size += len(frame)
+            frames.append(frame)
+        info['elapsed'] = time.time() - start
+        info['size'] = size
+        return frames
+
+    def _tokenize_names(self, file, lnum):
+        """Return the names on a source line, by tokenizing forward from it.
+
+        This is the fallback for sources the AST index can't handle; it stops
+        at the first NEWLINE token, so it only sees logical lines."""
+
+        # Initialize a list of names on the current line, which the
+        # tokenizer below will populate.
+        names = []
+
+        def tokeneater(token_type, token, start, end, line):
+            """Stateful tokeneater which builds dotted names.
+
+            The list of names it appends to (from the enclosing scope) can
+            contain repeated composite names.  This is unavoidable, since
+            there is no way to disambguate partial dotted structures until
+            the full list is known.  The caller is responsible for pruning
+            the final list of duplicates before using it."""
+
+            # build composite names
+            if token == '.':
+                try:
+                    names[-1] += '.'
+                    # store state so the next token is added for x.y.z names
+                    tokeneater.name_cont = True
+                    return
+                except IndexError:
+                    pass
+            if token_type == tokenize.NAME and token not in keyword.kwlist:
+                if tokeneater.name_cont:
+                    # Dotted names
+                    names[-1] += token
+                    tokeneater.name_cont = False
+                else:
+                    # Regular new names.  We append everything, the caller
+                    # will be responsible for pruning the list later.  It's
+                    # very tricky to try to prune as we go, b/c composite
+                    # names can fool us.  The pruning at the end is easy
+                    # to do (or the caller can print a list with repeated
+                    # names if so desired.
+                    names.append(token)
+            elif token_type == tokenize.NEWLINE:
+                raise IndexError
+        # we need to store a bit of state in the tokenizer to build
+        # dotted names
+        tokeneater.name_cont = False
+
+        def linereader(file=file, lnum=[lnum], getline=sources.getline):
+            line = getline(file, lnum[0])
+            lnum[0] += 1
+            return line
+
+        # Build the list of names on this line of code where the exception
+        # occurred.
+        try:
+            # This builds the names list in-place by capturing it from the
+            # enclosing scope.
+            tokenize.tokenize(linereader, tokeneater)
+        except IndexError:
+            # signals exit of tokenizer
+            pass
+        except tokenize.TokenError, msg:
+            _m = ("An unexpected error occurred while tokenizing input\n"
+                  "The following traceback may be corrupted or invalid\n"
+                  "The error message is: %s\n" % msg)
+            print >>sys.stderr, _m
+
+        return names
 
     def handler(self, info=None):
         (etype, evalue, tb) = info or sys.exc_info()
         self.tb = tb
-        print >>sys.stderr, self.text(etype, evalue, tb)
+        if emergency.is_memory_error(etype):
+            emergency.report(etype, evalue, tb, sys.stderr, self.tb_offset)
+            return
+        try:
+            text = self.text(etype, evalue, tb)
+        except MemoryError:
+            emergency.report(etype, evalue, tb, sys.stderr, self.tb_offset)
+            return
+        _print_tb(sys.stderr, text)
 
     # Changed so an instance can just be called as VerboseTB_inst() and print
     # out the right info on its own.
@@ -693,10 +1446,21 @@ class FormattedTB(VerboseTB, ListTB):
     like Python shells).  """
 
     def __init__(self, mode='Plain', color_scheme='Linux',
-                 tb_offset=0, long_header=0, include_vars=0):
+                 tb_offset=0, long_header=0, include_vars=0,
+                 time_budget=None, size_budget=None, capture_filter=None):
+        """The optional time_budget (seconds) and size_budget (characters)
+        bound the cost of each traceback in the verbose modes: once half a
+        budget is used, the remaining frames are printed in Context mode, and
+        once all of it is, in Plain mode.  The time budget covers reading the
+        source as well, and a frame still running when it runs out is
+        abandoned for its Plain form.  capture_filter selects the
+        variables shown in Verbose mode, see VerboseTB."""
 
         VerboseTB.__init__(self, color_scheme, tb_offset, long_header,
-                           include_vars=include_vars)
+                           include_vars=include_vars,
+                           capture_filter=capture_filter)
+        self.time_budget = time_budget
+        self.size_budget = size_budget
         self.set_mode(mode)
 
     def _extract_tb(self, tb):
@@ -719,12 +1483,24 @@ class FormattedTB(VerboseTB, ListTB):
         else:
             # We must check the source cache because otherwise we can print
             # out-of-date source code.
-            linecache.checkcache()
+            sources.checkcache()
             # Now we can extract and format the exception
-            elist = self._extract_tb(tb)
-            if len(elist) > self.tb_offset:
-                del elist[:self.tb_offset]
-            return ListTB.text(self, etype, value, elist)
+            start_time = tbstats.clock()
+            hide = self._frame_hider()
+            if hide is None:
+                elist = self._extract_tb(tb)
+                if len(elist) > self.tb_offset:
+                    del elist[:self.tb_offset]
+            else:
+                # hidden frames are skipped before their lines are read
+                depth, frame_tb = 0, tb
+                while frame_tb is not None:
+                    depth, frame_tb = depth + 1, frame_tb.tb_next
+                tb_offset = depth > self.tb_offset and self.tb_offset or 0
+                elist = _extract_entries(tb, tb_offset, hide)
+            tbstats.add('extract_time', tbstats.clock() - start_time)
+            # the hidden frames have been collapsed already
+            return self._text(etype, value, elist, self._list_templates())
 
     def set_mode(self, mode=None):
         """Switch to the desired mode.
@@ -778,12 +1554,15 @@ class SyntaxTB(ListTB):
 
         # We must check the source cache because otherwise we can print
         # out-of-date source code.
-        linecache.checkcache()
+        sources.checkcache()
         if mode in self.verbose_modes:
+            start_time = tbstats.clock()
             Colors = self.Colors
             ColorsNormal = Colors.Normal
+            escape = self.backend.escape
             # Simplified header
-            exc = '%s%s%s' % (Colors.excName, etype.__name__, ColorsNormal)
+            exc = '%s%s%s' % (Colors.excName, escape(etype.__name__),
+                              ColorsNormal)
             tpl_link = '%s%%s%s' % (Colors.filenameEm, ColorsNormal)
             head = '%s%s%s\n%s%s' % (Colors.topline, '-'*75, ColorsNormal, exc,
                                      string.rjust('Source of error (context)',
@@ -800,31 +1579,31 @@ class SyntaxTB(ListTB):
 
             context = context/2
 
-            lines = linecache.getlines(value.filename)
-            lines = lines[(lineno-1)-context:(lineno-1)+context]
-
-            while len(lines) <> context*2 + 1:
-                lines.append("\n")
+            # slicing mapped and registered sources copies only the window
+            start = max(lineno - 1 - context, 0)
+            lines = sources.getlines(value.filename)[start:lineno + context]
+            index = lineno - 1 - start
+            if index >= len(lines):
+                # no source: just the line the exception holds
+                lines = [(value.text or '').rstrip('\n') + '\n']
+                index = 0
 
-            index = context
-
-            try:
-                filename = filename and os.path.abspath(filename) or '?'
-            except OSError:
-                # if file is '<console>' or something not in the filesystem,
-                # the abspath call will throw an OSError.  Just ignore it and
-                # keep the original file string.
-                pass
-            link = tpl_link % filename
+            filename = paths.display(filename, self.short_paths)
+            link = tpl_link % escape(filename)
+            if self.backend.escapes:
+                lines = map(escape, lines)
 
             sourcelines = [link + "\n"]
             sourcelines += _formatTracebackLines(lineno, index, lines, Colors)
 
             etype_str, evalue_str = "SyntaxError", value.msg
             exception = '%s%s%s: %s' % (Colors.excName, etype_str,
-                                        ColorsNormal, evalue_str)
+                                        ColorsNormal, escape(evalue_str))
 
-            return '%s\n\n%s\n%s' % (head, ''.join(sourcelines), exception)
+            tbstats.add('tracebacks')
+            tbstats.add('format_time', tbstats.clock() - start_time)
+            return self.backend.wrap('%s\n\n%s\n%s' % (
+                head, ''.join(sourcelines), exception))
         else:
             # Now we can extract and format the exception
             elist = self._extract_tb(tb)
@@ -851,11 +1630,13 @@ class AutoFormattedTB(SyntaxTB, FormattedTB):
       AutoTB()  # or AutoTB(out=logfile) where logfile is an open file object
     """
     def __init__(self, mode='Plain', color_scheme='Linux',
-                 tb_offset=0, long_header=0, include_vars=0):
+                 tb_offset=0, long_header=0, include_vars=0,
+                 time_budget=None, size_budget=None, capture_filter=None):
 
         SyntaxTB.__init__(self, mode, color_scheme)
         FormattedTB.__init__(self, mode, color_scheme,
-                             tb_offset, long_header, include_vars)
+                             tb_offset, long_header, include_vars,
+                             time_budget, size_budget, capture_filter)
 
     def __call__(self, etype=None, evalue=None, tb=None,
                  out=None, tb_offset=None):
@@ -876,12 +1657,23 @@ class AutoFormattedTB(SyntaxTB, FormattedTB):
 
         if out is None:
             out = sys.stderr
-        if tb_offset is not None:
-            tb_offset, self.tb_offset = self.tb_offset, tb_offset
-            print >>out, handler.text(self, etype, evalue, tb)
+        if tb_offset is None:
+            tb_offset = self.tb_offset
+        # a MemoryError, or running out of memory while formatting, goes to
+        # the emergency renderer, which writes to the file descriptor
+        if emergency.is_memory_error(etype):
+            emergency.report(etype, evalue, tb, out, tb_offset)
+            return
+        tb_offset, self.tb_offset = self.tb_offset, tb_offset
+        try:
+            try:
+                text = handler.text(self, etype, evalue, tb)
+            except MemoryError:
+                emergency.report(etype, evalue, tb, out, self.tb_offset)
+                return
+        finally:
             self.tb_offset = tb_offset
-        else:
-            print >>out, handler.text(self, etype, evalue, tb)
+        _print_tb(out, text)
 
     def text(self, etype=None, value=None, tb=None, context=5, mode=None):
         if etype is None:
@@ -909,6 +1701,11 @@ def print_exc(limit=None, file=None):
     try:
         etype, value, tb = sys.exc_info()
         tbtools.defaultTB(etype, value, tb, out=file)
+        if tbtools.crash_store is not None:
+            try:
+                tbtools.crash_store.record(etype, value, tb)
+            except (IOError, OSError):
+                pass
     finally:
         etype = value = tb = None
 
@@ -0,0 +1,168 @@
+"""Tests for tbtools.asynctb, with stand-ins for the loop objects."""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import unittest
+from StringIO import StringIO
+
+from tbtools import asynctb, ultraTB
+
+
+def _failing_callback():
+    raise ValueError('callback failed')
+
+
+class _Future(object):
+    """What the handler looks at in a failed trollius future."""
+
+    def __init__(self, exception, tb):
+        self._exception = exception
+        self._exception_tb = tb
+        self._callbacks = []
+
+    def __repr__(self):
+        return '<_Future finished>'
+
+
+class _BlockedStream(object):
+    """A stream whose writes wait for its release() call."""
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.written = []
+
+    def write(self, data):
+        self.released.wait()
+        self.written.append(data)
+
+    def release(self):
+        self.released.set()
+
+
+# reports pending when the process exits, written slowly
+_EXITING = """
+import sys, time
+from tbtools import asynctb, ultraTB
+
+class Slow(object):
+    def write(self, data):
+        time.sleep(0.05)
+        sys.stdout.write(data)
+        sys.stdout.flush()
+
+formatter = ultraTB.AutoFormattedTB(mode='Plain', color_scheme='NoColor')
+handler = asynctb.LoopExceptionHandler(formatter, out=Slow())
+for i in range(5):
+    handler(None, {'message': 'report %d' % i})
+"""
+
+
+class _Loop(object):
+
+    def __init__(self):
+        self.handler = None
+
+    def set_exception_handler(self, handler):
+        self.handler = handler
+
+
+def _formatter():
+    formatter = ultraTB.AutoFormattedTB(mode='Plain', color_scheme='NoColor')
+    formatter.set_colors('NoColor')
+    return formatter
+
+
+class LoopExceptionHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        self.handler = asynctb.install(_Loop(), formatter=_formatter(),
+                                       out=self.out)
+
+    def report(self, context):
+        self.handler(None, context)
+        self.handler.close()
+        return self.out.getvalue()
+
+    def test_traceback_of_the_handler_except_clause(self):
+        # as trollius' Handle._run calls the handler
+        try:
+            _failing_callback()
+        except ValueError, exc:
+            text = self.report({'message': 'Exception in callback',
+                                'exception': exc})
+        self.assertTrue(text.startswith('Exception in callback\n'))
+        self.assertTrue('in _failing_callback' in text)
+        self.assertTrue('ValueError: callback failed' in text)
+
+    def test_traceback_kept_by_the_future(self):
+        try:
+            _failing_callback()
+        except ValueError, exc:
+            future = _Future(exc, sys.exc_info()[2])
+        sys.exc_clear()
+        text = self.report({'message': 'Future exception was never '
+                                       'retrieved',
+                            'exception': exc, 'future': future})
+        self.assertTrue('in _failing_callback' in text)
+        self.assertTrue('Task: <_Future finished>' in text)
+
+    def test_creation_traceback(self):
+        created = traceback.extract_stack()
+        text = self.report({'message': 'no traceback',
+                            'exception': KeyError('k'),
+                            'source_traceback': created})
+        self.assertTrue("KeyError: 'k'" in text)
+        self.assertTrue('Object created at (most recent call last):' in text)
+        self.assertTrue('in test_creation_traceback' in text)
+
+    def test_formatter_of_the_caller_is_left_alone(self):
+        formatter = _formatter()
+        handler = asynctb.LoopExceptionHandler(formatter)
+        self.assertEqual(formatter.hidden_files, ())
+        self.assertTrue(handler.formatter is not formatter)
+        self.assertEqual(handler.formatter.hidden_files,
+                         asynctb.loop_prefixes())
+
+    def test_pending_reports_are_written_at_exit(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root)
+        process = subprocess.Popen([sys.executable, '-c', _EXITING],
+                                   stdout=subprocess.PIPE, env=env)
+        out = process.communicate()[0]
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual([line for line in out.splitlines()
+                          if line.startswith('report')],
+                         ['report %d' % i for i in range(5)])
+
+    def test_close_does_not_block_on_a_full_queue(self):
+        out = _BlockedStream()
+        handler = asynctb.LoopExceptionHandler(_formatter(), out=out,
+                                               max_pending=1)
+        try:
+            for i in range(3):
+                handler(None, {'message': 'm'})
+                time.sleep(0.05)
+            start = time.time()
+            self.assertFalse(handler.close(0.1))
+            self.assertTrue(time.time() - start < 1)
+        finally:
+            out.release()
+        self.assertTrue(handler.close())
+        self.assertEqual(''.join(out.written), 'm\nm\n')
+
+    def test_dropped_reports(self):
+        handler = asynctb.LoopExceptionHandler(_formatter(), out=self.out,
+                                               max_pending=1)
+        handler._thread = object()      # no worker: the queue fills up
+        for i in range(3):
+            handler(None, {'message': 'm'})
+        self.assertEqual(handler.dropped, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Tests for tbtools.batch."""
+
+import unittest
+
+from tbtools import batch
+
+
+def _records(n, counter=None):
+    for i in xrange(n):
+        if counter is not None:
+            counter[0] += 1
+        yield ('KeyError', 'k%d' % i, [('f.py', i + 1, 'g', 'x = %d' % i)])
+
+
+class RenderTest(unittest.TestCase):
+
+    def test_plain_text_in_order(self):
+        texts = list(batch.render(_records(3)))
+        self.assertEqual(len(texts), 3)
+        self.assertTrue('line 1, in g' in texts[0])
+        self.assertTrue(texts[2].endswith('KeyError: k2'))
+        self.assertFalse('\x1b' in ''.join(texts))
+
+    def test_processes_give_the_same_results(self):
+        self.assertEqual(list(batch.render(_records(50), processes=2,
+                                           chunk_size=3)),
+                         list(batch.render(_records(50))))
+
+    def test_processes_read_records_as_results_are_consumed(self):
+        counter = [0]
+        texts = batch.render(_records(100000, counter), processes=2,
+                             chunk_size=10)
+        try:
+            for i in range(5):
+                texts.next()
+        finally:
+            texts.close()
+        window = 2 * batch.CHUNKS_PER_WORKER
+        self.assertTrue(counter[0] <= (window + 1) * 10, counter[0])
+
+    def test_named_types_and_portable_records(self):
+        record = batch.portable(('mod.Error', object(), [('f.py', 1, 'g',
+                                                          None)]))
+        self.assertEqual(record[0], 'mod.Error')
+        self.assertTrue(isinstance(record[1], str))
+        text = list(batch.render([record]))[0]
+        self.assertTrue('Error: <object object' in text)
+
+
+if __name__ == '__main__':
+    unittest.main()
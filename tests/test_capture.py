@@ -0,0 +1,88 @@
+"""Tests for tbtools.capture and the variables VerboseTB shows with it."""
+
+import sys
+import unittest
+
+from tbtools import capture, ultraTB
+
+
+class _Secret(object):
+    pass
+
+
+def _login(user, password):
+    token = 'tok' + '-123'
+    payload = [user] * 3
+    return user.missing + password + token + str(payload)
+
+
+class RuleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = capture.CaptureFilter([
+            {'action': 'redact', 'names': ['*password*', '*token*']},
+            {'action': 'hide', 'types': [list]},
+            {'action': 'redact', 'types': ['test_capture._Secret']},
+            {'action': 'hide', 'modules': ['vendor.*']},
+        ])
+
+    def check(self, name, value, module='app', filename='app.py'):
+        frame_filter = self.filter.for_frame(module, filename)
+        return frame_filter.check(name, lambda: value)[0]
+
+    def test_names_match_whole_or_last_part(self):
+        self.assertEqual(self.check('password', 'x'), capture.REDACT)
+        self.assertEqual(self.check('self.db_password', 'x'), capture.REDACT)
+        self.assertEqual(self.check('user', 'x'), capture.SHOW)
+
+    def test_types_by_class_or_name(self):
+        self.assertEqual(self.check('items', [1]), capture.HIDE)
+        self.assertEqual(self.check('key', _Secret()), capture.REDACT)
+
+    def test_first_matching_rule_wins(self):
+        self.assertEqual(self.check('tokens', [1]), capture.REDACT)
+
+    def test_frame_rules(self):
+        self.assertEqual(self.check('user', 'x', module='vendor.lib'),
+                         capture.HIDE)
+        self.assertEqual(capture.CaptureFilter().for_frame('app', 'app.py'),
+                         None)
+
+    def test_value_only_looked_up_when_needed(self):
+        looked_up = []
+        frame_filter = self.filter.for_frame('app', 'app.py')
+        action, value = frame_filter.check(
+            'password', lambda: looked_up.append(1))
+        self.assertEqual((action, looked_up), (capture.REDACT, []))
+        self.assertTrue(value is capture.UNRESOLVED)
+
+    def test_unknown_actions(self):
+        self.assertRaises(ValueError, capture.Rule, 'drop')
+        self.assertRaises(ValueError, capture.CaptureFilter, default='drop')
+
+
+class VerboseCaptureTest(unittest.TestCase):
+
+    def test_redacted_and_hidden_variables(self):
+        capture_filter = capture.CaptureFilter([
+            {'action': 'redact', 'names': ['*password*', 'token']},
+            {'action': 'hide', 'names': ['payload']},
+        ])
+        formatter = ultraTB.VerboseTB(color_scheme='NoColor',
+                                      capture_filter=capture_filter)
+        formatter.set_colors('NoColor')
+        password = 'hunter' + '2'
+        try:
+            _login('bob', password)
+        except AttributeError:
+            text = formatter.text(*sys.exc_info())
+        self.assertFalse('hunter2' in text)
+        self.assertFalse('tok-123' in text)
+        self.assertTrue("user='bob'" in text)
+        self.assertTrue('password=<redacted>' in text)
+        self.assertTrue('token = <redacted>' in text)
+        self.assertFalse("['bob', 'bob', 'bob']" in text)
+
+
+if __name__ == '__main__':
+    unittest.main()
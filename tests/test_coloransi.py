@@ -0,0 +1,94 @@
+"""Tests for tbtools.ColorANSI."""
+
+import gc
+import os
+import unittest
+
+from tbtools import ColorANSI
+
+
+class _Terminal(object):
+
+    def __init__(self, tty=True):
+        self.tty = tty
+        self.probes = 0
+
+    def isatty(self):
+        self.probes += 1
+        return self.tty
+
+
+class ColorDepthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.environ = os.environ.copy()
+        for name in ('NO_COLOR', 'COLORTERM'):
+            os.environ.pop(name, None)
+        os.environ['TERM'] = 'xterm-256color'
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def test_depths(self):
+        self.assertEqual(ColorANSI.color_depth(_Terminal()),
+                         ColorANSI.COLORS_256)
+        self.assertEqual(ColorANSI.color_depth(_Terminal(tty=False)),
+                         ColorANSI.NO_COLORS)
+        os.environ['NO_COLOR'] = '1'
+        self.assertEqual(ColorANSI.color_depth(_Terminal()),
+                         ColorANSI.NO_COLORS)
+
+    def test_cached_per_stream_until_reset(self):
+        stream = _Terminal()
+        ColorANSI.color_depth(stream)
+        ColorANSI.color_depth(stream)
+        self.assertEqual(stream.probes, 1)
+        ColorANSI.reset_color_depth(stream)
+        ColorANSI.color_depth(stream)
+        self.assertEqual(stream.probes, 2)
+
+    def test_streams_are_not_kept_alive(self):
+        stream = _Terminal()
+        ColorANSI.color_depth(stream)
+        self.assertTrue(stream in ColorANSI._depths)
+        count = len(ColorANSI._depths)
+        del stream
+        gc.collect()
+        self.assertEqual(len(ColorANSI._depths), count - 1)
+
+    def test_streams_without_weak_references(self):
+        from cStringIO import StringIO
+        self.assertEqual(ColorANSI.color_depth(StringIO()),
+                         ColorANSI.NO_COLORS)
+        ColorANSI.reset_color_depth(StringIO())
+
+
+class StructTest(unittest.TestCase):
+
+    def test_attribute_and_item_access(self):
+        colors = ColorANSI.Struct(normal='0', red='31')
+        self.assertEqual(colors.red, '31')
+        colors.green = '32'
+        self.assertEqual(colors['green'], '32')
+        colors['blue'] = '34'
+        self.assertEqual(colors.blue, '34')
+        del colors.red
+        self.assertRaises(AttributeError, getattr, colors, 'red')
+        colors.pop('blue')
+        self.assertRaises(AttributeError, getattr, colors, 'blue')
+        colors.clear()
+        self.assertRaises(AttributeError, getattr, colors, 'normal')
+
+    def test_keys_cannot_shadow_methods(self):
+        colors = ColorANSI.Struct(update='1', copy='2')
+        colors['keys'] = '3'
+        self.assertEqual(colors['update'], '1')
+        self.assertEqual(sorted(colors.keys()), ['copy', 'keys', 'update'])
+        colors.update(red='31')
+        self.assertEqual(colors.copy()['red'], '31')
+        self.assertRaises(AttributeError, setattr, colors, 'items', '4')
+
+
+if __name__ == '__main__':
+    unittest.main()
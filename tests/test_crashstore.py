@@ -0,0 +1,122 @@
+"""Tests for tbtools.crashstore."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import tbtools
+from tbtools import crashstore
+
+
+def _raise_in(depth):
+    if depth:
+        return _raise_in(depth - 1)
+    raise ValueError('deep down')
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_ignores_directories_and_compiled_suffix(self):
+        a = crashstore.fingerprint('KeyError', [('/a/x.py', 'f'),
+                                                ('/a/y.py', 'g')])
+        b = crashstore.fingerprint(KeyError, [('/b/x.pyc', 'f'),
+                                              ('y.py', 'g')])
+        self.assertEqual(a, b)
+        self.assertEqual(len(a), 16)
+
+    def test_depends_on_type_and_functions(self):
+        frames = [('x.py', 'f')]
+        self.assertNotEqual(crashstore.fingerprint('KeyError', frames),
+                            crashstore.fingerprint('ValueError', frames))
+        self.assertNotEqual(crashstore.fingerprint('KeyError', frames),
+                            crashstore.fingerprint('KeyError',
+                                                   [('x.py', 'g')]))
+
+
+class CrashStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_and_read(self):
+        store = crashstore.CrashStore(self.directory)
+        try:
+            _raise_in(2)
+        except ValueError:
+            entry = store.record(*sys.exc_info())
+        self.assertEqual(entry.etype, 'ValueError')
+        self.assertEqual([e.fingerprint for e in store.entries()],
+                         [entry.fingerprint])
+        text = store.read(entry)
+        self.assertTrue(text.startswith('Crash-Report: %s\n'
+                                        % entry.fingerprint))
+        self.assertTrue('_raise_in' in text)
+        self.assertTrue('deep down' in text)
+        self.assertEqual(store.groups()[entry.fingerprint][0], 1)
+
+    def test_rotation_keeps_entries_of_retained_segments(self):
+        store = crashstore.CrashStore(self.directory, segment_size=200,
+                                      max_segments=2)
+        added = []
+        for i in range(1, 9):
+            added.append(store.add('x' * 60, 'E%d' % i, '%016x' % i))
+            segments = store._segments()
+            self.assertTrue(len(segments) <= 2)
+            expected = [e.etype for e in reversed(added)
+                        if e.segment >= segments[0]]
+            self.assertEqual([e.etype for e in store.entries()], expected)
+            # a second reader, starting from scratch, agrees
+            fresh = crashstore.CrashStore(self.directory)
+            self.assertEqual([e.etype for e in fresh.entries()], expected)
+        self.assertTrue(added[-1].segment > 2)
+        for entry in store.entries():
+            self.assertTrue(store.read(entry).startswith('Crash-Report'))
+
+    def test_entries_filters(self):
+        store = crashstore.CrashStore(self.directory)
+        store.add('a', 'KeyError', 'aaaa000000000000', timestamp=10)
+        store.add('b', 'ValueError', 'bbbb000000000000', timestamp=20)
+        store.add('c', 'KeyError', 'aaaa000000000000', timestamp=30)
+        self.assertEqual([e.timestamp for e in store.entries('aaaa')],
+                         [30, 10])
+        self.assertEqual([e.timestamp for e in
+                          store.entries(etype='ValueError')], [20])
+        self.assertEqual([e.timestamp for e in
+                          store.entries(since=15, until=30)], [20])
+        self.assertEqual([e.timestamp for e in store.entries(limit=1)],
+                         [30])
+
+
+
+class _BrokenStore(object):
+
+    def record(self, etype, value, tb):
+        raise ValueError('corrupt index')
+
+
+class ExceptHookTest(unittest.TestCase):
+
+    def test_failing_store_leaves_the_traceback(self):
+        saved = tbtools.crash_store, sys.stderr, sys.stdout
+        tbtools.crash_store = _BrokenStore()
+        sys.stderr = sys.stdout = StringIO()
+        try:
+            try:
+                _raise_in(1)
+            except ValueError:
+                tbtools.excepthook(*sys.exc_info())
+            text = sys.stderr.getvalue()
+        finally:
+            tbtools.crash_store, sys.stderr, sys.stdout = saved
+        self.assertTrue('deep down' in text)
+        self.assertFalse('corrupt index' in text)
+
+
+if __name__ == '__main__':
+    unittest.main()
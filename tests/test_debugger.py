@@ -0,0 +1,127 @@
+"""Tests for the breakpoint bookkeeping and the stack entries of
+tbtools.Debugger."""
+
+import sys
+import unittest
+from StringIO import StringIO
+
+from tbtools import Debugger
+
+
+def _first():
+    return 1
+
+
+def _second():
+    return 2
+
+
+def _frame_of(function):
+    frames = []
+    def tracer(frame, event, arg):
+        if event == 'call' and frame.f_code is function.func_code:
+            frames.append(frame)
+    sys.setprofile(tracer)
+    try:
+        function()
+    finally:
+        sys.setprofile(None)
+    return frames[0]
+
+
+class BreakpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.debugger = Debugger.Pdb(color_scheme='NoColor')
+        self.filename = _first.func_code.co_filename
+        if self.filename.endswith('.pyc'):
+            self.filename = self.filename[:-1]
+
+    def tearDown(self):
+        self.debugger.clear_all_breaks()
+
+    def test_break_anywhere_per_code_object(self):
+        debugger = self.debugger
+        debugger.set_break(self.filename, _first.func_code.co_firstlineno + 1)
+        self.assertTrue(debugger.break_anywhere(_frame_of(_first)))
+        self.assertFalse(debugger.break_anywhere(_frame_of(_second)))
+        # answers are forgotten when the breakpoints change
+        debugger.set_break(self.filename,
+                           _second.func_code.co_firstlineno + 1)
+        self.assertTrue(debugger.break_anywhere(_frame_of(_second)))
+        debugger.clear_all_file_breaks(self.filename)
+        self.assertEqual(debugger._code_breaks, {})
+        self.assertFalse(debugger.break_anywhere(_frame_of(_first)))
+
+    def test_code_table_is_bounded(self):
+        debugger = self.debugger
+        saved = Debugger.MAX_CODE_BREAKS
+        Debugger.MAX_CODE_BREAKS = 3
+        try:
+            for i in range(10):
+                namespace = {}
+                exec compile('def f():\n    return %d\n' % i,
+                             '<bench %d>' % i, 'exec') in namespace
+                debugger.break_anywhere(_frame_of(namespace['f']))
+                self.assertTrue(len(debugger._code_breaks) <= 3)
+        finally:
+            Debugger.MAX_CODE_BREAKS = saved
+
+    def test_breakpoint_index(self):
+        debugger = self.debugger
+        line = _first.func_code.co_firstlineno + 1
+        debugger.set_break(self.filename, line, cond='x > 1')
+        self.assertEqual(debugger.get_file_break_index(self.filename).keys(),
+                         [line])
+        debugger.clear_break(self.filename, line)
+        self.assertEqual(debugger.get_file_break_index(self.filename), {})
+
+
+
+class StackEntryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        self.debugger = Debugger.Pdb(color_scheme='NoColor',
+                                     stdout=self.out)
+        self.namespace = {'sys': sys}
+        exec 'frame = sys._getframe()' in self.namespace
+        self.frame = self.namespace.pop('frame')
+        self.namespace['__return__'] = [1]
+        # what interaction() does before its command loop
+        self.debugger.Completer = None
+        self.debugger.reset()
+        self.debugger.setup(self.frame, None)
+
+    def tearDown(self):
+        self.debugger.forget()
+        self.frame = None
+
+    def run_command(self, line):
+        debugger = self.debugger
+        # the stack entries are printed to sys.stdout
+        saved, sys.stdout = sys.stdout, self.out
+        try:
+            debugger.postcmd(debugger.onecmd(line), line)
+        finally:
+            sys.stdout = saved
+
+    def entry(self):
+        return self.debugger.format_stack_entry((self.frame, 1))
+
+    def test_commands_changing_values_refresh_the_entries(self):
+        self.assertTrue(self.entry().startswith('[1]\n'))
+        self.run_command('where')
+        self.namespace['__return__'].append(0)
+        # only looking: still the same rendering
+        self.assertTrue(self.entry().startswith('[1]\n'))
+        self.run_command('!__return__.append(2)')
+        self.assertTrue(self.entry().startswith('[1, 0, 2]\n'))
+        self.run_command('!__return__ = 5')
+        self.assertTrue(self.entry().startswith('5\n'))
+        self.run_command('p __return__')
+        self.assertEqual(self.out.getvalue().splitlines()[-1], '5')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Tests for tbtools.emergency."""
+
+import os
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from tbtools import emergency
+
+
+def _exc_info():
+    try:
+        {}['missing']
+    except KeyError:
+        return sys.exc_info()
+
+
+class _Broken(object):
+    def flush(self):
+        pass
+
+    def write(self, data):
+        raise IOError('closed')
+
+
+class ReportTest(unittest.TestCase):
+
+    def test_render(self):
+        text = emergency.render(*_exc_info())
+        lines = text.splitlines()
+        self.assertEqual(lines[0], 'Traceback (most recent call last):')
+        self.assertTrue(lines[1].endswith(', in _exc_info'))
+        self.assertEqual(lines[-1], "KeyError: 'missing'")
+
+    def test_report_to_stream_without_fileno(self):
+        out = StringIO()
+        emergency.report(ValueError, ValueError('x'), None, out=out)
+        self.assertEqual(out.getvalue(), 'ValueError: x\n')
+
+    def test_report_to_file_descriptor(self):
+        f = tempfile.TemporaryFile()
+        try:
+            emergency.report(*_exc_info(), **{'out': f})
+            f.seek(0)
+            text = f.read()
+        finally:
+            f.close()
+        self.assertEqual(text, emergency.render(*_exc_info()) + '\n')
+
+    def test_failing_stream_falls_back_to_stderr(self):
+        read, write = os.pipe()
+        saved = os.dup(2)
+        os.dup2(write, 2)
+        try:
+            emergency.report(ValueError, ValueError('y'), None,
+                             out=_Broken())
+        finally:
+            os.dup2(saved, 2)
+            os.close(saved)
+            os.close(write)
+        try:
+            self.assertEqual(os.read(read, 1024), 'ValueError: y\n')
+        finally:
+            os.close(read)
+
+    def test_memory_errors(self):
+        self.assertTrue(emergency.is_memory_error(MemoryError))
+        self.assertFalse(emergency.is_memory_error(ValueError))
+        self.assertFalse(emergency.is_memory_error('MemoryError'))
+
+
+if __name__ == '__main__':
+    unittest.main()
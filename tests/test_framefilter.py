@@ -0,0 +1,161 @@
+"""Tests for tbtools.framefilter and the hidden frames of the formatters."""
+
+import os
+import sys
+import unittest
+
+from tbtools import framefilter, ultraTB
+from tbtools.framefilter import FrameFilter
+
+
+def _function(module, source, name, **names):
+    """Define the function name of source in a namespace where __name__
+    is module."""
+    namespace = {'__name__': module}
+    namespace.update(names)
+    exec compile(source, '/fw/%s.py' % module, 'exec') in namespace
+    return namespace[name]
+
+
+class FrameFilterTest(unittest.TestCase):
+
+    def test_globs_shared_with_capture(self):
+        pattern = framefilter.compile_globs(['a.*', 'b'])
+        self.assertTrue(pattern.match('a.x') and pattern.match('b'))
+        self.assertFalse(pattern.match('a') or pattern.match('bc'))
+        self.assertEqual(framefilter.compile_globs(()), None)
+
+    def test_module_globs(self):
+        hide = FrameFilter(exclude_modules=['django.*', 'werkzeug'])
+        self.assertTrue(hide('/x/views.py', 'django.views'))
+        self.assertTrue(hide('/x/serving.py', 'werkzeug'))
+        self.assertFalse(hide('/x/__init__.py', 'django'))
+        self.assertFalse(hide('/x/app.py', 'app'))
+        self.assertFalse(hide('/x/app.py', None))
+
+    def test_path_prefixes(self):
+        hide = FrameFilter(exclude_paths='/opt/fw')
+        self.assertTrue(hide('/opt/fw/core.py'))
+        self.assertTrue(hide('/opt/fw/sub/core.py'))
+        self.assertFalse(hide('/opt/fw2/core.py'))
+        self.assertFalse(hide('<string>'))
+
+    def test_relative_filenames(self):
+        hide = FrameFilter(exclude_paths=[os.getcwd()])
+        self.assertTrue(hide('script.py'))
+        self.assertTrue(hide(os.path.join(os.getcwd(), 'script.py')))
+
+    def test_includes_win(self):
+        hide = FrameFilter(exclude_modules=['fw.*'],
+                           include_modules=['fw.plugins.*'])
+        self.assertTrue(hide('/x/a.py', 'fw.core'))
+        self.assertFalse(hide('/x/b.py', 'fw.plugins.mine'))
+
+    def test_includes_only(self):
+        hide = FrameFilter(include_paths=['/srv/app'])
+        self.assertFalse(hide('/srv/app/main.py', 'main'))
+        self.assertTrue(hide('/usr/lib/other.py', 'other'))
+
+    def test_stdlib(self):
+        hide = FrameFilter(exclude_stdlib=True)
+        self.assertTrue(hide(os.__file__, 'os'))
+        self.assertFalse(hide(__file__, __name__))
+        for site in hide.site:
+            self.assertFalse(hide(os.path.join(site, 'pkg.py'), 'pkg'))
+
+    def test_cache_is_bounded(self):
+        saved = framefilter.MAX_CACHED
+        framefilter.MAX_CACHED = 10
+        try:
+            hide = FrameFilter(exclude_paths='/opt/fw')
+            for i in range(50):
+                self.assertTrue(hide('/opt/fw/m%d.py' % i))
+            self.assertTrue(len(hide._cache) <= 10)
+        finally:
+            framefilter.MAX_CACHED = saved
+
+
+class HiddenFramesTest(unittest.TestCase):
+
+    def setUp(self):
+        def fail():
+            raise ValueError('deep')
+        inner = _function('fw.inner', 'def inner():\n    fail()\n',
+                          'inner', fail=fail)
+        outer = _function('fw.outer', 'def outer():\n    inner()\n',
+                          'outer', inner=inner)
+        try:
+            outer()
+        except ValueError:
+            self.exc_info = sys.exc_info()
+
+    def format(self, mode):
+        formatter = ultraTB.AutoFormattedTB(mode=mode, color_scheme='NoColor')
+        formatter.set_colors('NoColor')
+        formatter.frame_filter = FrameFilter(exclude_modules=['fw.*'])
+        return formatter.text(*self.exc_info)
+
+    def test_runs_are_summarized(self):
+        for mode in ('Plain', 'Context', 'Verbose'):
+            text = self.format(mode)
+            self.assertTrue('[... 2 frames hidden: fw.outer, fw.inner ...]'
+                            in text, mode)
+            self.assertFalse('/fw/fw.outer.py' in text, mode)
+            self.assertTrue('fail' in text, mode)
+
+    def test_innermost_frame_is_kept(self):
+        tb = self.exc_info[2]
+        hide = lambda filename, module: True
+        entries = ultraTB._walk_tb(tb, hide=hide)
+        self.assertEqual(type(entries[0]), ultraTB._HiddenRun)
+        self.assertEqual(entries[0].count, 3)
+        self.assertEqual(entries[-1][3], 'fail')
+
+    def test_summary_lists_at_most_three_modules(self):
+        run = ultraTB._HiddenRun()
+        for module in ('a', 'b', 'a', 'c', 'd', 'e'):
+            run.add(module)
+        self.assertEqual(run.summary(),
+                         '[... 6 frames hidden: a, b, c, ... ...]')
+        run = ultraTB._HiddenRun()
+        for module in ('a', 'b', 'c', 'b'):
+            run.add(module)
+        self.assertEqual(run.summary(), '[... 4 frames hidden: a, b, c ...]')
+        self.assertEqual(run.modules, ['a', 'b', 'c'])
+        run = ultraTB._HiddenRun()
+        run.add('a')
+        self.assertEqual(run.summary(), '[... 1 frame hidden: a ...]')
+
+
+class HideEntriesTest(unittest.TestCase):
+
+    elist = [('/app/main.py', 1, 'main', 'run()'),
+             ('/fw/a.py', 2, 'a', 'b()'),
+             ('/fw/b.py', 3, 'b', 'handler()'),
+             ('/app/views.py', 4, 'handler', 'fw.c()'),
+             ('/fw/c.py', 5, 'c', 'raise Error')]
+
+    def hide(self, filename, module):
+        return filename.startswith('/fw/')
+
+    def test_runs_collapse(self):
+        entries = ultraTB._hide_entries(self.elist, self.hide)
+        self.assertEqual(len(entries), 4)
+        self.assertEqual(entries[0], self.elist[0])
+        self.assertEqual(entries[1].summary(),
+                         '[... 2 frames hidden: /fw/a.py, /fw/b.py ...]')
+        self.assertEqual(entries[2:], self.elist[3:])
+
+    def test_list_tb(self):
+        formatter = ultraTB.ListTB(color_scheme='NoColor')
+        formatter.set_colors('NoColor')
+        formatter.hidden_files = ('/fw/',)
+        text = formatter.text(ValueError, ValueError('x'), self.elist)
+        self.assertTrue('[... 2 frames hidden: /fw/a.py, /fw/b.py ...]'
+                        in text)
+        self.assertTrue('/fw/c.py' in text)
+        self.assertFalse('/fw/a.py", line' in text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""Tests for tbtools.logscan."""
+
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from tbtools import crashstore, logscan, ultraTB
+from tbtools.framefilter import FrameFilter
+
+
+def _fail(n):
+    if n == 0:
+        raise KeyError('missing')
+    _fail(n - 1)
+
+
+def _exc_info():
+    try:
+        _fail(2)
+    except KeyError:
+        return sys.exc_info()
+
+
+def _text(mode, color_scheme='NoColor'):
+    formatter = ultraTB.AutoFormattedTB(mode=mode, color_scheme=color_scheme)
+    formatter.set_colors(color_scheme)
+    return formatter.text(*_exc_info())
+
+
+def _framework():
+    """A function of a module named fw.core calling itself n times, then
+    _fail(0)."""
+    namespace = {'__name__': 'fw.core', 'fail': _fail}
+    exec compile('def call(n):\n'
+                 '    if n == 0:\n'
+                 '        fail(0)\n'
+                 '    call(n - 1)\n', '/fw/core.py', 'exec') in namespace
+    return namespace['call']
+
+
+def _through_framework(depth):
+    call = _framework()
+    try:
+        call(depth)
+    except KeyError:
+        return sys.exc_info()
+
+
+def _frames(tb):
+    return [(os.path.basename(f), name) for f, lineno, name in tb.frames]
+
+
+class ParseTest(unittest.TestCase):
+
+    expected = [('test_logscan.py', '_exc_info')] + \
+               [('test_logscan.py', '_fail')] * 3
+
+    def check(self, tracebacks):
+        self.assertEqual(len(tracebacks), 1)
+        tb = tracebacks[0]
+        self.assertEqual(tb.short_type(), 'KeyError')
+        self.assertEqual(tb.message, "'missing'")
+        self.assertEqual(_frames(tb), self.expected)
+        return tb
+
+    def test_formats(self):
+        fingerprints = []
+        for mode in ('Plain', 'Context', 'Verbose'):
+            lines = ['noise\n'] + (_text(mode) + '\n').splitlines(True) + \
+                    ['more noise\n']
+            tb = self.check(list(logscan.parse(lines, 'log')))
+            self.assertEqual(tb.line, 2)
+            fingerprints.append(tb.fingerprint())
+        # line numbers (missing from some formats) don't matter
+        self.assertEqual(len(set(fingerprints)), 1)
+
+    def test_prefixes_and_colors(self):
+        text = _text('Context', 'Linux')
+        lines = ['2024-01-01 12:00:00 ERROR %s\n' % line
+                 for line in text.splitlines()]
+        self.check(list(logscan.parse(lines)))
+
+    def test_same_fingerprint_as_crashstore(self):
+        etype, value, tb = _exc_info()
+        frames = crashstore.tb_frames(tb)
+        parsed = self.check(list(logscan.parse(
+            _text('Plain').splitlines(True))))
+        self.assertEqual(parsed.fingerprint(),
+                         crashstore.fingerprint(etype, frames))
+
+    def test_degraded_output(self):
+        formatter = ultraTB.AutoFormattedTB(mode='Verbose',
+                                            color_scheme='NoColor')
+        formatter.set_colors('NoColor')
+        formatter.size_budget = 1
+        text = formatter.text(*_exc_info())
+        self.assertTrue('[... size budget exceeded' in text)
+        tb = self.check(list(logscan.parse(text.splitlines(True))))
+        self.assertEqual(tb.fingerprint(),
+                         self.check(list(logscan.parse(
+                             _text('Plain').splitlines(True)))).fingerprint())
+
+    def test_hidden_frames(self):
+        fingerprints = []
+        for mode in ('Plain', 'Context', 'Verbose'):
+            for depth in (1, 3):
+                formatter = ultraTB.AutoFormattedTB(mode=mode,
+                                                    color_scheme='NoColor')
+                formatter.set_colors('NoColor')
+                formatter.frame_filter = FrameFilter(
+                    exclude_modules=['fw.*'])
+                text = formatter.text(*_through_framework(depth))
+                self.assertTrue('frames hidden: fw.core ...]' in text)
+                tracebacks = list(logscan.parse(text.splitlines(True)))
+                self.assertEqual(len(tracebacks), 1)
+                self.assertEqual(_frames(tracebacks[0]),
+                                 [('test_logscan.py', '_through_framework'),
+                                  ('test_logscan.py', '_fail')])
+                fingerprints.append(tracebacks[0].fingerprint())
+        self.assertEqual(len(set(fingerprints)), 1)
+
+    def test_truncated_traceback_then_complete_one(self):
+        first = _text('Plain').splitlines(True)[:3]
+        lines = first + _text('Plain').splitlines(True)
+        tracebacks = list(logscan.parse(lines))
+        self.assertEqual(len(tracebacks), 1)
+        self.assertEqual(tracebacks[0].line, 4)
+
+    def test_standard_traceback_module_format(self):
+        import traceback
+        lines = ''.join(traceback.format_exception(*_exc_info()))
+        self.check(list(logscan.parse(lines.splitlines(True))))
+
+
+class GrouperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        if name.endswith('.gz'):
+            f = gzip.open(path, 'wb')
+        else:
+            f = open(path, 'wb')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+        return path
+
+    def test_groups_and_diff(self):
+        plain = _text('Plain') + '\n'
+        other = 'Traceback (most recent call last):\n' \
+                '  File "x.py", line 1, in f\n    g()\nValueError: bad\n'
+        old = self.write('old.log', plain * 2 + other)
+        new = self.write('new.log.gz', plain * 5)
+        grouper = logscan.scan([old])
+        self.assertEqual(grouper.total, 3)
+        groups = grouper.sorted()
+        self.assertEqual([g.count for g in groups], [2, 1])
+        self.assertEqual(groups[1].sample.etype, 'ValueError')
+        report = grouper.format(verbose=True)
+        self.assertTrue(report.startswith('3 tracebacks, 2 distinct'))
+        lines = logscan.diff(grouper, logscan.scan([new]))
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].strip().startswith('+3'))
+        self.assertTrue(lines[1].startswith('gone'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Tests for tbtools.output."""
+
+import unittest
+from StringIO import StringIO
+
+from tbtools import output
+
+
+class _Stream(object):
+    """Records its writes and flushes."""
+
+    def __init__(self):
+        self.writes = []
+        self.flushes = 0
+        self.softspace = 0
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def flush(self):
+        self.flushes += 1
+
+
+class WriteUnitTest(unittest.TestCase):
+
+    def test_text_is_not_copied(self):
+        out = _Stream()
+        text = 'Traceback\n' * 1000
+        output.write_unit(out, text, '\n')
+        self.assertTrue(out.writes[0] is text)
+        self.assertEqual(out.writes[1:], ['\n'])
+        self.assertEqual(out.flushes, 1)
+
+    def test_pieces_go_in_one_write(self):
+        out = _Stream()
+        output.write_unit(out, 'a', 'b', 'c')
+        self.assertEqual(out.writes, ['abc'])
+        self.assertEqual(out.flushes, 1)
+
+    def test_softspace_like_print(self):
+        expected = StringIO()
+        print >>expected, 'x',
+        print >>expected, 'report'
+        print >>expected, 'y'
+        out = StringIO()
+        print >>out, 'x',
+        output.write_unit(out, 'report', '\n')
+        print >>out, 'y'
+        self.assertEqual(out.getvalue(), expected.getvalue())
+
+    def test_buffered_writer(self):
+        out = _Stream()
+        writer = output.BufferedWriter(out, chunk_size=4)
+        for piece in 'abcdef':
+            writer.write(piece)
+        self.assertEqual(out.writes, ['abcd'])
+        writer.flush()
+        self.assertEqual(out.writes, ['abcd', 'ef'])
+        self.assertEqual(out.flushes, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Tests for tbtools.paths."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tbtools import Debugger, paths
+
+
+class PathsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        for name in ('a', 'b'):
+            os.mkdir(os.path.join(self.directory, name))
+        paths.clear()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+        paths.set_site_dirs()
+        paths.clear()
+
+    def test_relative_names_follow_the_directory(self):
+        for name in ('a', 'b'):
+            os.chdir(os.path.join(self.directory, name))
+            expected = os.path.join(self.directory, name, 'mod.py')
+            self.assertEqual(paths.abspath('mod.py'), expected)
+            self.assertEqual(paths.canonic('mod.py'),
+                             os.path.normcase(expected))
+        self.assertEqual(paths.abspath('/x/../y/mod.py'), '/y/mod.py')
+
+    def test_names_outside_the_filesystem(self):
+        self.assertEqual(paths.abspath(''), '?')
+        # twice: computed, then from the table
+        for i in range(2):
+            self.assertEqual(paths.canonic('<string>'), '<string>')
+
+    def test_tables_are_bounded(self):
+        saved = paths.MAX_CACHED
+        paths.MAX_CACHED = 10
+        try:
+            for i in range(50):
+                self.assertEqual(paths.canonic('/x/m%d.py' % i),
+                                 os.path.normcase('/x/m%d.py' % i))
+                paths.abspath('/x/m%d.py' % i)
+            self.assertTrue(len(paths._canonics) <= 10)
+            self.assertTrue(len(paths._abspaths) <= 10)
+        finally:
+            paths.MAX_CACHED = saved
+
+    def test_shorten(self):
+        site = os.path.join(self.directory, 'a')
+        nested = os.path.join(site, 'site-packages')
+        paths.set_site_dirs([site, nested + os.sep])
+        self.assertEqual(paths.shorten(os.path.join(nested, 'pkg', 'm.py')),
+                         os.path.join('site-packages', 'pkg', 'm.py'))
+        self.assertEqual(paths.shorten(os.path.join(site, 'm.py')),
+                         os.path.join('a', 'm.py'))
+        elsewhere = os.path.join(self.directory, 'b', 'm.py')
+        self.assertEqual(paths.shorten(elsewhere), elsewhere)
+        self.assertEqual(paths.display('m.py', short=False),
+                         os.path.abspath('m.py'))
+        # the shortened names are forgotten with the site directories
+        paths.set_site_dirs([])
+        self.assertEqual(paths.shorten(os.path.join(site, 'm.py')),
+                         os.path.join(site, 'm.py'))
+
+    def test_debugger_sees_directory_changes_at_its_stops(self):
+        pdb = Debugger.Pdb()
+        os.chdir(os.path.join(self.directory, 'a'))
+        self.assertEqual(pdb.canonic('mod.py'), os.path.normcase(
+            os.path.join(self.directory, 'a', 'mod.py')))
+        os.chdir(os.path.join(self.directory, 'b'))
+        pdb.forget()
+        self.assertEqual(pdb.canonic('mod.py'), os.path.normcase(
+            os.path.join(self.directory, 'b', 'mod.py')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""Tests for tbtools.PyColorize."""
+
+import unittest
+from StringIO import StringIO
+
+from tbtools import PyColorize
+
+
+class ParserTest(unittest.TestCase):
+
+    def test_string_output(self):
+        parser = PyColorize.Parser()
+        text = parser.format('x = 1 # one', 'str', 'NoColor')
+        self.assertEqual(text, 'x = 1 # one\n')
+        colored = parser.format('x = 1', 'str', 'Linux')
+        self.assertTrue('\x1b[' in colored)
+
+    def test_stream_output_is_flushed(self):
+        out = StringIO()
+        parser = PyColorize.Parser(out=out)
+        self.assertEqual(parser.format('def f():\n    return 2', None,
+                                       'NoColor'), None)
+        self.assertEqual(out.getvalue(), 'def f():\n    return 2\n')
+        self.assertTrue(parser.out is out)
+
+    def test_stream_restored_when_tokenizing_fails(self):
+        out = StringIO()
+        parser = PyColorize.Parser(out=out)
+        # inconsistent dedent: IndentationError, not a TokenError
+        self.assertRaises(IndentationError, parser.format,
+                          'if x:\n        a = 1\n    b = 2\n', None,
+                          'NoColor')
+        self.assertTrue(parser.out is out)
+        self.assertTrue(out.getvalue().startswith('if x:'))
+
+    def test_stream_restored_on_unknown_scheme(self):
+        out = StringIO()
+        parser = PyColorize.Parser(out=out)
+        self.assertRaises(KeyError, parser.format, 'x', None, 'NoSuchScheme')
+        self.assertTrue(parser.out is out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""Tests for tbtools.sharedcache and its use by sources and sourceindex."""
+
+import linecache
+import os
+import shutil
+import tempfile
+import unittest
+
+from tbtools import sharedcache, sourceindex, sources
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+
+class SharedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.saved = sharedcache._directory[0]
+        sharedcache.enable(os.path.join(self.directory, 'cache'))
+        self.source = os.path.join(self.directory, 'mod.py')
+
+    def tearDown(self):
+        sharedcache.disable()
+        sharedcache._directory[0] = self.saved
+        sources._mapped.clear()
+        sourceindex._by_file.clear()
+        sourceindex._by_hash.clear()
+        shutil.rmtree(self.directory)
+
+    def forget_locally(self):
+        """What another process of the host starts with."""
+        sourceindex._by_file.clear()
+        sourceindex._by_hash.clear()
+        sharedcache._mapped.clear()
+
+    def write(self, text):
+        f = open(self.source, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+        sources.checkcache()
+
+    def key(self):
+        """What the names of the mapped source are stored under."""
+        return sharedcache.file_key(self.source, os.stat(self.source))
+
+    def test_directory_must_be_private(self):
+        shared = os.path.join(self.directory, 'shared')
+        os.mkdir(shared)
+        os.chmod(shared, 0777)
+        self.assertRaises(OSError, sharedcache.enable, shared)
+        self.assertFalse(sharedcache.enabled())
+        self.assertEqual(sharedcache.get_names(md5('x').digest()),
+                         (False, None))
+        link = os.path.join(self.directory, 'link')
+        os.symlink(os.path.join(self.directory, 'cache'), link)
+        self.assertRaises(OSError, sharedcache.enable, link)
+        if os.getuid() == 0:
+            os.chmod(shared, 0700)
+            os.chown(shared, 12345, -1)
+            self.assertRaises(OSError, sharedcache.enable, shared)
+        sharedcache.enable(os.path.join(self.directory, 'cache'))
+        self.assertTrue(sharedcache.enabled())
+
+    def test_offsets_round_trip(self):
+        self.write('a = 1\nb = 2\n')
+        st = os.stat(self.source)
+        self.assertEqual(sharedcache.get_offsets(self.source, st), None)
+        from array import array
+        sharedcache.put_offsets(self.source, st,
+                                array(sharedcache._TYPECODE, [0, 6, 12]))
+        self.forget_locally()
+        self.assertEqual(list(sharedcache.get_offsets(self.source, st)),
+                         [0, 6, 12])
+
+    def test_names_shared_by_file_key(self):
+        self.write('x = obj.attr + y\n')
+        self.assertEqual(sourceindex.line_names(self.source, 1),
+                         ('x', 'obj.attr', 'y'))
+        found, table = sharedcache.get_names(self.key())
+        self.assertTrue(found)
+        # the mapped text isn't hashed
+        self.assertEqual(sharedcache.get_names(
+            md5('x = obj.attr + y\n').digest()), (False, None))
+        self.forget_locally()
+        self.assertEqual(sourceindex.line_names(self.source, 1),
+                         ('x', 'obj.attr', 'y'))
+
+    def test_mapped_text_is_not_copied(self):
+        self.write('x = obj.attr + y\n')
+        sourceindex.line_names(self.source, 1)
+        def copied(lines):
+            raise AssertionError('the mapped text was copied')
+        saved = sources.IndexedSource.__iter__
+        sources.IndexedSource.__iter__ = copied
+        try:
+            for forget in (sourceindex._by_file.clear, self.forget_locally):
+                forget()
+                sources.checkcache()
+                self.assertEqual(sourceindex.line_names(self.source, 1),
+                                 ('x', 'obj.attr', 'y'))
+        finally:
+            sources.IndexedSource.__iter__ = saved
+
+    def test_edited_file_gets_its_own_names(self):
+        self.write('x = obj.attr + y\n')
+        sourceindex.line_names(self.source, 1)
+        self.write('z = other(w)\n')
+        self.forget_locally()
+        self.assertEqual(sourceindex.line_names(self.source, 1),
+                         ('z', 'other', 'w'))
+
+    def test_names_follow_the_lines_in_use(self):
+        self.write('z = other(w)\n')
+        sourceindex.line_names(self.source, 1)
+        self.forget_locally()
+        # linecache still holds an older version of the file
+        old = ['x = obj.attr + y\n']
+        linecache.cache[self.source] = (len(old[0]), 0, old, self.source)
+        try:
+            self.assertEqual(sourceindex.line_names(self.source, 1),
+                             ('x', 'obj.attr', 'y'))
+        finally:
+            del linecache.cache[self.source]
+
+    def test_unparsable_sources(self):
+        self.write('def (:\n')
+        self.assertEqual(sourceindex.line_names(self.source, 1), None)
+        self.assertEqual(sharedcache.get_names(self.key()), (True, None))
+
+    def test_mapped_files_are_bounded(self):
+        saved = sharedcache.MAX_MAPPED
+        sharedcache.MAX_MAPPED = 2
+        try:
+            from array import array
+            for i in range(5):
+                self.write('a = %d\n' % i * (i + 1))
+                st = os.stat(self.source)
+                sharedcache.put_offsets(self.source, st,
+                                        array(sharedcache._TYPECODE, [0]))
+                self.assertTrue(sharedcache.get_offsets(self.source, st)
+                                is not None)
+                self.assertTrue(len(sharedcache._mapped) <= 2)
+        finally:
+            sharedcache.MAX_MAPPED = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
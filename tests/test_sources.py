@@ -0,0 +1,124 @@
+"""Tests for tbtools.sources and the syntax errors SyntaxTB shows from it."""
+
+import sys
+import unittest
+
+from tbtools import sources, ultraTB
+
+
+_SOURCE = ''.join(['x%d = %d\n' % (i, i) for i in range(1, 20)]) + \
+          'y = (1 +\n' + 'z = 3\n'
+
+
+class RegistryTest(unittest.TestCase):
+
+    def tearDown(self):
+        for name in list(sources._registered_order):
+            if name.startswith('<test ') or name.startswith('<string-'):
+                sources.unregister(name)
+
+    def test_default_name_is_unique(self):
+        first = sources.compile_source('x = 1\ny = 2\nz = 3\n')
+        second = sources.compile_source('w = 0\n')
+        self.assertNotEqual(first.co_filename, second.co_filename)
+        self.assertEqual(sources.getline(first.co_filename, 3), 'z = 3\n')
+        self.assertEqual(sources.getlines('<string>'), [])
+        try:
+            exec "a = 1\nraise ValueError('elsewhere')\n" in {}
+        except ValueError:
+            formatter = ultraTB.AutoFormattedTB(mode='Context',
+                                                color_scheme='NoColor')
+            formatter.set_colors('NoColor')
+            text = formatter.text(*sys.exc_info())
+        self.assertFalse('y = 2' in text)
+        try:
+            compile('a=1\nb=(\n', '<string>', 'exec')
+        except SyntaxError:
+            formatter = ultraTB.SyntaxTB(mode='Context',
+                                         color_scheme='NoColor')
+            formatter.set_colors('NoColor')
+            text = formatter.text(*sys.exc_info())
+        self.assertFalse('y = 2' in text)
+
+    def test_shared_names_are_refused(self):
+        for name in ('<string>', '<stdin>'):
+            self.assertRaises(ValueError, sources.register, name, 'x = 1\n')
+            self.assertRaises(ValueError, sources.compile_source, 'x = 1\n',
+                              name)
+            self.assertEqual(sources.getlines(name), [])
+
+    def test_compiled_source_lines(self):
+        code = sources.compile_source('a = 1\nb = a / 0\n', '<test div>')
+        self.assertEqual(sources.getline('<test div>', 2), 'b = a / 0\n')
+        try:
+            exec code in {}
+        except ZeroDivisionError:
+            formatter = ultraTB.AutoFormattedTB(mode='Context',
+                                                color_scheme='NoColor')
+            formatter.set_colors('NoColor')
+            text = formatter.text(*sys.exc_info())
+        self.assertTrue('----> 2 b = a / 0' in text)
+
+    def test_registry_is_bounded(self):
+        saved = sources.MAX_REGISTERED
+        sources.MAX_REGISTERED = 3
+        try:
+            for i in range(6):
+                sources.register('<test %d>' % i, 'v = %d\n' % i)
+            self.assertEqual(sources.getlines('<test 0>'), [])
+            self.assertEqual(sources.getline('<test 5>', 1), 'v = 5\n')
+            self.assertTrue(len(sources._registered) <= 3)
+        finally:
+            sources.MAX_REGISTERED = saved
+
+    def test_unregister(self):
+        sources.register('<test gone>', 'a\n')
+        sources.unregister('<test gone>')
+        self.assertEqual(sources.getlines('<test gone>'), [])
+        self.assertEqual(sources.getlines(''), [])
+
+
+class SyntaxTBTest(unittest.TestCase):
+
+    def tearDown(self):
+        sources.unregister('<test syntax>')
+
+    def syntax_error(self):
+        try:
+            sources.compile_source(_SOURCE, '<test syntax>')
+        except SyntaxError:
+            return sys.exc_info()
+        self.fail('no SyntaxError')
+
+    def test_window_around_the_error(self):
+        etype, value, tb = self.syntax_error()
+        formatter = ultraTB.SyntaxTB(mode='Context', color_scheme='NoColor')
+        formatter.set_colors('NoColor')
+        text = formatter.text(etype, value, tb, context=6)
+        lines = text.splitlines()
+        marked = [line for line in lines if line.startswith('--->')]
+        self.assertEqual(len(marked), 1)
+        self.assertTrue(marked[0].endswith('z = 3'))
+        self.assertTrue('     18 x18 = 18' in lines)
+        self.assertFalse('     17 x17 = 17' in lines)
+        self.assertTrue(lines[-1].startswith('SyntaxError: invalid syntax'))
+
+    def test_error_text_without_source(self):
+        etype, value, tb = self.syntax_error()
+        sources.unregister('<test syntax>')
+        formatter = ultraTB.SyntaxTB(mode='Context', color_scheme='NoColor')
+        formatter.set_colors('NoColor')
+        text = formatter.text(etype, value, tb)
+        self.assertTrue('---> %d z = 3' % value.lineno in text)
+
+    def test_plain_mode(self):
+        etype, value, tb = self.syntax_error()
+        formatter = ultraTB.SyntaxTB(mode='Plain', color_scheme='NoColor')
+        formatter.set_colors('NoColor')
+        text = formatter.text(etype, value, None)
+        self.assertTrue('File "<test syntax>", line 21' in text)
+        self.assertTrue(text.endswith('SyntaxError: invalid syntax'))
+
+
+if __name__ == '__main__':
+    unittest.main()
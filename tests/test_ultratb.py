@@ -0,0 +1,190 @@
+"""Tests for the formatters of tbtools.ultraTB."""
+
+import sys
+import threading
+import time
+import unittest
+
+from tbtools import sources, ultraTB
+
+
+class _SlowRepr(object):
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def __repr__(self):
+        time.sleep(self.delay)
+        return '<slow>'
+
+
+def _recurse(n, obj):
+    if n == 0:
+        return obj.missing
+    return _recurse(n - 1, obj)
+
+
+def _exc_info(obj, depth=5):
+    try:
+        _recurse(depth, obj)
+    except AttributeError:
+        return sys.exc_info()
+
+
+def _formatter(**kw):
+    formatter = ultraTB.AutoFormattedTB(mode='Verbose', color_scheme='NoColor',
+                                        **kw)
+    formatter.set_colors('NoColor')
+    return formatter
+
+
+class BudgetTest(unittest.TestCase):
+
+    def test_slow_frame_is_cut_at_the_time_budget(self):
+        formatter = _formatter(time_budget=0.2)
+        info = _exc_info(_SlowRepr(2))
+        start = time.time()
+        text = formatter.text(*info)
+        self.assertTrue(time.time() - start < 0.6)
+        self.assertEqual(formatter.last_render['degraded'][0][1:],
+                         ('Plain', 'time'))
+        self.assertTrue('time budget exceeded' in text)
+        self.assertTrue(text.endswith("object has no attribute 'missing'"))
+
+    def test_threads_keep_the_time_budget(self):
+        formatter = _formatter(time_budget=0.2)
+        formatter.threads = 4
+        start = time.time()
+        formatter.text(*_exc_info(_SlowRepr(2)))
+        self.assertTrue(time.time() - start < 0.6)
+        self.assertTrue(formatter.last_render['degraded'])
+
+    def test_size_budget_is_named_as_the_reason(self):
+        formatter = _formatter(time_budget=100, size_budget=1500)
+        text = formatter.text(*_exc_info(_SlowRepr(0)))
+        degraded = formatter.last_render['degraded']
+        self.assertTrue(degraded)
+        for i, mode, reason in degraded:
+            self.assertEqual(reason, 'size')
+        self.assertTrue('size budget exceeded' in text)
+
+    def test_frame_budget_replaces_single_frames(self):
+        formatter = _formatter(time_budget=10)
+        formatter.frame_budget = 0.05
+        text = formatter.text(*_exc_info(_SlowRepr(0.2), depth=1))
+        self.assertEqual(formatter.last_render['degraded'], [])
+        self.assertTrue(formatter.last_render['overdue'])
+        self.assertTrue('over its 0.05s budget' in text)
+
+    def test_workers_are_bounded(self):
+        formatter = _formatter(time_budget=10)
+        formatter.frame_budget = 0.02
+        formatter.threads = 2
+        before = threading.activeCount()
+        for i in range(3):
+            text = formatter.text(*_exc_info(_SlowRepr(0.1), depth=3))
+            self.assertTrue('over its 0.02s budget' in text)
+            self.assertTrue(threading.activeCount() - before <= 2)
+        self.assertEqual(formatter.last_render['degraded'], [])
+
+    def test_within_budget_nothing_degrades(self):
+        formatter = _formatter(time_budget=10, size_budget=10 ** 6)
+        text = formatter.text(*_exc_info(_SlowRepr(0)))
+        self.assertEqual(formatter.last_render['degraded'], [])
+        self.assertEqual(text, _formatter().text(*_exc_info(_SlowRepr(0))))
+
+
+class _Descriptor(object):
+    """A data descriptor with a side effect."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __get__(self, obj, klass):
+        self.calls += 1
+        return 'computed'
+
+    def __set__(self, obj, value):
+        pass
+
+
+class _Model(object):
+    column = _Descriptor()
+    plain = 1
+
+    def __init__(self):
+        self.field = 2
+
+    def method(self):
+        pass
+
+    def prop(self):
+        raise AssertionError('property evaluated')
+    prop = property(prop)
+
+
+class _Proxy(object):
+    def __getattribute__(self, name):
+        raise AssertionError('__getattribute__ called')
+
+
+class _Lazy:
+    def __getattr__(self, name):
+        raise AssertionError('__getattr__ called')
+
+
+class NameResolverTest(unittest.TestCase):
+
+    def test_resolves_attribute_chains(self):
+        resolver = ultraTB.NameResolver()
+        namespace = {'model': _Model()}
+        self.assertEqual(resolver.resolve('model.field', namespace), 2)
+        self.assertEqual(resolver.resolve('model.field.real', namespace), 2)
+        self.assertTrue(resolver.resolve('model.nothing', namespace)
+                        is ultraTB._undefined)
+        self.assertTrue(resolver.resolve('other', namespace)
+                        is ultraTB._undefined)
+
+    def test_skip_properties_runs_no_code(self):
+        resolver = ultraTB.NameResolver(skip_properties=1)
+        namespace = {'model': _Model(), 'proxy': _Proxy(), 'lazy': _Lazy(),
+                     'Model': _Model}
+        for name in ('model.column', 'model.prop', 'proxy.anything',
+                     'lazy.anything', 'Model.column'):
+            self.assertTrue(resolver.resolve(name, namespace)
+                            is ultraTB._skipped, name)
+        self.assertEqual(_Model.__dict__['column'].calls, 0)
+        self.assertEqual(resolver.resolve('model.field', namespace), 2)
+        self.assertEqual(resolver.resolve('model.plain', namespace), 1)
+        self.assertEqual(resolver.resolve('model.method', namespace).__name__,
+                         'method')
+        self.assertEqual(resolver.resolve('Model.plain', namespace), 1)
+
+
+class ContextWindowTest(unittest.TestCase):
+
+    def tearDown(self):
+        sources.unregister('<test top>')
+
+    def test_window_of_a_short_file(self):
+        code = sources.compile_source('b = 1 / 0\na = 1\n', '<test top>')
+        try:
+            exec code in {}
+        except ZeroDivisionError:
+            info = sys.exc_info()
+        records = ultraTB._fixed_getinnerframes(info[2], context=5)
+        frame, file, lnum, func, lines, index = records[-1]
+        self.assertEqual((lnum, index), (1, 0))
+        # cut at both ends of the file, not padded
+        self.assertEqual(lines, ['b = 1 / 0\n', 'a = 1\n'])
+        formatter = ultraTB.AutoFormattedTB(mode='Context',
+                                            color_scheme='NoColor')
+        formatter.set_colors('NoColor')
+        text = formatter.text(*info)
+        window = text[text.rindex('<test top>'):].splitlines()[1:3]
+        self.assertEqual(window, ['----> 1 b = 1 / 0', '      2 a = 1'])
+        self.assertFalse('      3 ' in text[text.rindex('<test top>'):])
+
+
+if __name__ == '__main__':
+    unittest.main()